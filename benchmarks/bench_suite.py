@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Time parsing, filtering, iterating and writing synthetic programs, and compare with a baseline
+
+Each stage runs in its own process, so that its peak resident memory is measured independently of the
+other stages. Results can be saved as JSON and compared with a previously saved baseline, the exit status
+being 1 when a stage is slower than the baseline by more than the tolerance.
+"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+from synthetic import write_synthetic
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def iterate(gcode):
+    for line in gcode:
+        line.current_x
+
+
+def write(gcode):
+    with open(os.devnull, 'w') as output_file:
+        gcode.write(output_file)
+
+
+def arc_optimizer(gcode):
+    from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+    GCodeArcOptimizerFilter().filter(gcode)
+
+
+def slic3r_stretch(gcode):
+    from gcodeutils.stretch.stretch import Slic3rStretchFilter
+    Slic3rStretchFilter().filter(gcode)
+
+
+def cura_stretch(gcode):
+    from gcodeutils.stretch.stretch import CuraStretchFilter
+    CuraStretchFilter().filter(gcode)
+
+
+def translate(gcode):
+    from gcodeutils.filter.translate import GCodeXYTranslateFilter
+    GCodeXYTranslateFilter(x=10, y=-10).filter(gcode)
+
+
+def relative_extrusion(gcode):
+    from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+
+
+# stage name, flavor of the program it runs on and function applied to the parsed program (None for parse)
+STAGES = [
+    ('parse', 'slic3r', None),
+    ('iterate', 'slic3r', iterate),
+    ('write', 'slic3r', write),
+    ('translate', 'slic3r', translate),
+    ('relative_extrusion', 'slic3r', relative_extrusion),
+    ('arc_optimizer', 'slic3r', arc_optimizer),
+    ('slic3r_stretch', 'slic3r', slic3r_stretch),
+    ('cura_stretch', 'cura', cura_stretch),
+]
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_stage(name, path, repeat):
+    """time a stage on the program at path, in this process, return its result"""
+    import logging
+    from gcodeutils.gcoder import GCode
+
+    logging.disable(logging.WARNING)
+    function = dict((stage, stage_function) for stage, _, stage_function in STAGES)[name]
+    with open(path) as input_file:
+        raws = input_file.readlines()
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        gcode = GCode(raws)
+        if function is not None:
+            start = time.time()
+            function(gcode)
+        timings.append(time.time() - start)
+        del gcode
+    seconds = min(timings)
+    return {'lines': len(raws), 'seconds': seconds, 'lines_per_second': len(raws) / seconds if seconds else None,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def spawn_stage(name, path, repeat):
+    """run a stage in a child process, return its result"""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--stage', name, '--repeat',
+                                      str(repeat), path])
+    return json.loads(output.decode('utf-8'))
+
+
+def compare(results, baseline, tolerance):
+    """print the throughput of each stage relative to the baseline, return the names of the regressed stages"""
+    regressions = []
+    if baseline.get('lines') != results['lines']:
+        print("warning: baseline measured on %s lines, not %s" % (baseline.get('lines'), results['lines']))
+    for name, result in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if not reference or not reference.get('lines_per_second') or not result['lines_per_second']:
+            continue
+        ratio = result['lines_per_second'] / reference['lines_per_second']
+        regressed = ratio < 1 - tolerance
+        if regressed:
+            regressions.append(name)
+        print("%-20s %6.2fx %s" % (name, ratio, 'REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gcodeutils stages on synthetic programs')
+    parser.add_argument('--lines', type=float, default=1e5,
+                        help='Approximate number of lines of the programs (1e4 to 1e7), defaults to %(default)s')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, defaults to %(default)s')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the programs, defaults to %(default)s')
+    parser.add_argument('--only', action='append', choices=[name for name, _, _ in STAGES],
+                        help='Run only this stage, can be repeated.')
+    parser.add_argument('--save', metavar='json', help='Save the results to this file.')
+    parser.add_argument('--baseline', metavar='json', nargs='?', const=BASELINE,
+                        help='Compare with a saved baseline, defaults to %s.' % os.path.basename(BASELINE))
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown reported as a regression, defaults to %(default)s')
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('path', nargs='?', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # some filters print warnings, stdout is kept for the result
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            result = run_stage(args.stage, args.path, args.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    stages = [stage for stage in STAGES if not args.only or stage[0] in args.only]
+    work_dir = tempfile.mkdtemp()
+    try:
+        paths = {}
+        for flavor in set(flavor for _, flavor, _ in stages):
+            paths[flavor] = os.path.join(work_dir, 'synthetic_%s.gcode' % flavor)
+            write_synthetic(paths[flavor], int(args.lines), flavor, args.seed)
+
+        results = {'lines': int(args.lines), 'seed': args.seed, 'python': platform.python_version(),
+                   'platform': platform.platform(), 'stages': {}}
+        for name, flavor, _ in stages:
+            result = spawn_stage(name, paths[flavor], args.repeat)
+            results['stages'][name] = result
+            print("%-20s %10.0f lines/s %8.2fs %8.1f MB peak RSS" % (
+                name, result['lines_per_second'] or 0, result['seconds'], result['peak_rss_mb'] or 0))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.save:
+        with open(args.save, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            if compare(results, json.load(baseline_file), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Compare the parse throughput of split + parse_coordinates and of the single pass tokenizer, line by line and
+through GCode on synthetic programs"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import time
+
+from gcodeutils.gcoder import GCode, Line, split, parse_coordinates, tokenize
+from synthetic import FLAVORS, synthetic_gcode
+
+
+def legacy_parse(lines):
+    for raw in lines:
+        line = Line(raw)
+        parse_coordinates(line, split(line))
+
+
+def tokenizer_parse(lines):
+    for raw in lines:
+        tokenize(Line(raw))
+
+
+def legacy_gcode(lines):
+    GCode(lines)
+
+
+def tokenizer_gcode(lines):
+    GCode(lines, tokenizer=tokenize)
+
+
+def best_time(function, lines, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function(lines)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gcode line parsing throughput')
+    parser.add_argument('--lines', type=int, default=1000000, help='Number of lines to parse, defaults to %(default)s')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, defaults to %(default)s')
+    parser.add_argument('--flavor', choices=FLAVORS, default='slic3r', help='Slicer comments, defaults to %(default)s')
+    args = parser.parse_args()
+
+    lines = list(synthetic_gcode(args.lines, args.flavor))
+
+    for name, legacy_function, tokenizer_function in [('lines', legacy_parse, tokenizer_parse),
+                                                      ('GCode', legacy_gcode, tokenizer_gcode)]:
+        legacy = best_time(legacy_function, lines, args.repeat)
+        tokenizer = best_time(tokenizer_function, lines, args.repeat)
+
+        print("%s, split + parse_coordinates: %10.0f lines/s" % (name, len(lines) / legacy))
+        print("%s, tokenize:                  %10.0f lines/s" % (name, len(lines) / tokenizer))
+        print("%s, speed-up:                  %10.2fx" % (name, legacy / tokenizer))
+
+
+if __name__ == "__main__":
+    main()
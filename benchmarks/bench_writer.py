@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Compare the write throughput of printing lines one by one and of the buffered GCodeWriter"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from gcodeutils.writer import GCodeWriter
+from synthetic import synthetic_gcode
+
+# lines per layer, as written by GCode.write
+LAYER_SIZE = 1000
+
+
+def print_write(layers, output_file):
+    for layer in layers:
+        for raw in layer:
+            print(raw, file=output_file)
+
+
+def writer_write(layers, output_file, use_writev=False):
+    with GCodeWriter(output_file, use_writev=use_writev) as writer:
+        for layer in layers:
+            writer.write_lines(layer)
+
+
+def writev_write(layers, output_file):
+    writer_write(layers, output_file, use_writev=True)
+
+
+def best_time(function, layers, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        with io.open(path, 'w') as output_file:
+            start = time.time()
+            function(layers, output_file)
+            output_file.flush()
+            timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark gcode writing throughput')
+    parser.add_argument('--lines', type=int, default=2000000, help='Number of lines to write, defaults to %(default)s')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs, defaults to %(default)s')
+    args = parser.parse_args()
+
+    lines = list(synthetic_gcode(args.lines))
+    layers = [lines[start:start + LAYER_SIZE] for start in range(0, len(lines), LAYER_SIZE)]
+
+    handle, path = tempfile.mkstemp(suffix='.gcode')
+    os.close(handle)
+    try:
+        printing = best_time(print_write, layers, path, args.repeat)
+        buffered = best_time(writer_write, layers, path, args.repeat)
+        writev = best_time(writev_write, layers, path, args.repeat)
+    finally:
+        os.remove(path)
+
+    print("print:                %10.0f lines/s" % (len(lines) / printing))
+    print("GCodeWriter:          %10.0f lines/s (%.2fx)" % (len(lines) / buffered, printing / buffered))
+    print("GCodeWriter + writev: %10.0f lines/s (%.2fx)" % (len(lines) / writev, printing / writev))
+
+
+if __name__ == "__main__":
+    main()
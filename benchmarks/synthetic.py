@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Generate reproducible, slicer like, GCode programs of any size"""
+from __future__ import print_function
+from __future__ import division
+
+import argparse
+import math
+import random
+
+FLAVORS = ['slic3r', 'cura']
+
+# segments of each circular perimeter, as slicers write arcs
+ARC_SEGMENTS = 48
+PERIMETERS = 3
+EXTRUSION_WIDTH = 0.45
+LAYER_HEIGHT = 0.2
+# mm of filament per mm of extrusion
+E_PER_MM = 0.033
+RETRACT_LENGTH = 1.5
+OBJECT_RADIUS = 8.
+OBJECT_SPACING = 20.
+BED_SIZE = 200.
+# approximate lines produced by each object in each layer
+LINES_PER_OBJECT = PERIMETERS * (ARC_SEGMENTS + 2) + 23
+
+
+class Extruder(object):
+    """format moves, keeping track of the position and of the absolute extrusion"""
+
+    def __init__(self, flavor):
+        self.flavor = flavor
+        self.x = self.y = 0.
+        self.e = 0.
+
+    def travel(self, x, y, comment='move to first perimeter point'):
+        self.x, self.y = x, y
+        if self.flavor == 'cura':
+            return "G0 F9000 X%.3f Y%.3f" % (x, y)
+        return "G1 X%.3f Y%.3f F7800.000 ; %s" % (x, y, comment)
+
+    def extrude(self, x, y, comment):
+        self.e += math.hypot(x - self.x, y - self.y) * E_PER_MM
+        self.x, self.y = x, y
+        if self.flavor == 'cura':
+            return "G1 X%.3f Y%.3f E%.5f" % (x, y, self.e)
+        return "G1 X%.3f Y%.3f E%.5f ; %s" % (x, y, self.e, comment)
+
+    def retract(self):
+        if self.flavor == 'cura':
+            return "G1 F2400 E%.5f" % (self.e - RETRACT_LENGTH)
+        return "G1 E%.5f F2400.00000 ; retract" % (self.e - RETRACT_LENGTH)
+
+    def unretract(self):
+        if self.flavor == 'cura':
+            return "G1 F2400 E%.5f" % self.e
+        return "G1 E%.5f F2400.00000 ; unretract" % self.e
+
+
+def header(flavor):
+    if flavor == 'cura':
+        return [";FLAVOR:RepRap", ";Generated with the gcodeutils synthetic benchmark", "M104 S200", "M109 S200",
+                "G21", "G90", "M82", "G28", "G92 E0"]
+    return ["; generated by the gcodeutils synthetic benchmark",
+            "; external perimeters extrusion width = %.2fmm" % EXTRUSION_WIDTH, "M104 S200", "M109 S200", "G21",
+            "G90", "M82", "G28", "G92 E0"]
+
+
+def perimeter(extruder, center_x, center_y, radius, phase, comment, unretract=False):
+    """return the lines of a circular perimeter, as a polygon of ARC_SEGMENTS sides, travelling to its start
+    (and unretracting)"""
+    points = [(center_x + radius * math.cos(phase + 2 * math.pi * index / ARC_SEGMENTS),
+               center_y + radius * math.sin(phase + 2 * math.pi * index / ARC_SEGMENTS))
+              for index in range(ARC_SEGMENTS + 1)]
+    lines = [extruder.travel(*points[0])]
+    if unretract:
+        lines.append(extruder.unretract())
+    lines.extend(extruder.extrude(x, y, comment) for x, y in points[1:])
+    return lines
+
+
+def infill(extruder, center_x, center_y, radius, layer_idx):
+    """return the lines of a zigzag infill of the square inscribed in the perimeters, retracting at its end"""
+    half = radius / math.sqrt(2)
+    count = 10
+    lines = [extruder.travel(center_x - half, center_y - half, 'move to first infill point')]
+    for index in range(count):
+        offset = -half + 2 * half * index / (count - 1)
+        if layer_idx % 2:
+            start, end = (center_x + offset, center_y - half), (center_x + offset, center_y + half)
+        else:
+            start, end = (center_x - half, center_y + offset), (center_x + half, center_y + offset)
+        if index % 2:
+            start, end = end, start
+        lines.append(extruder.extrude(start[0], start[1], 'infill'))
+        lines.append(extruder.extrude(end[0], end[1], 'infill'))
+    lines.append(extruder.retract())
+    return lines
+
+
+def synthetic_gcode(lines, flavor='slic3r', seed=0):
+    """generate about lines lines of a program printing cylinders, with the comments of the given slicer
+    flavor: circular perimeters as segments, zigzag infill, retractions and an E reset on each layer"""
+    if flavor not in FLAVORS:
+        raise ValueError("unknown flavor: %s" % flavor)
+    rand = random.Random(seed)
+    lines_per_layer = max(LINES_PER_OBJECT, int(4 * math.sqrt(lines)))
+    objects = max(1, lines_per_layer // LINES_PER_OBJECT)
+    columns = max(1, int(BED_SIZE // OBJECT_SPACING))
+    centers = [(OBJECT_SPACING * (index % columns + 0.5) + rand.uniform(-1, 1),
+                OBJECT_SPACING * ((index // columns) % columns + 0.5) + rand.uniform(-1, 1))
+               for index in range(objects)]
+
+    extruder = Extruder(flavor)
+    count = 0
+    for line in header(flavor):
+        count += 1
+        yield line
+
+    layer_idx = 0
+    while count < lines:
+        z = LAYER_HEIGHT * (layer_idx + 1)
+        if flavor == 'cura':
+            layer = [";LAYER:%d" % layer_idx, "G0 F9000 Z%.3f" % z]
+        else:
+            layer = ["G1 Z%.3f F7800.000 ; move to next layer (%d)" % (z, layer_idx)]
+        layer.append("G92 E0")
+        extruder.e = 0.
+        for center_x, center_y in centers:
+            radius = OBJECT_RADIUS + rand.uniform(-0.5, 0.5)
+            phase = rand.uniform(0, 2 * math.pi)
+            # inner perimeters first, then the external one
+            for index in reversed(range(PERIMETERS)):
+                if flavor == 'cura':
+                    layer.append(";TYPE:WALL-OUTER" if index == 0 else ";TYPE:WALL-INNER")
+                layer.extend(perimeter(extruder, center_x, center_y, radius - index * EXTRUSION_WIDTH, phase,
+                                       'perimeter external' if index == 0 else 'perimeter',
+                                       unretract=index == PERIMETERS - 1))
+            if flavor == 'cura':
+                layer.append(";TYPE:FILL")
+            layer.extend(infill(extruder, center_x, center_y, radius - PERIMETERS * EXTRUSION_WIDTH, layer_idx))
+        for line in layer:
+            count += 1
+            yield line
+        layer_idx += 1
+
+
+def write_synthetic(path, lines, flavor='slic3r', seed=0):
+    """write a synthetic program to path, return its number of lines"""
+    count = 0
+    with open(path, 'w') as output_file:
+        for line in synthetic_gcode(lines, flavor, seed):
+            output_file.write(line + '\n')
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic slicer like GCode program')
+    parser.add_argument('outfile', help='Generated program filename.')
+    parser.add_argument('--lines', type=float, default=1e5, help='Approximate number of lines, defaults to %(default)s')
+    parser.add_argument('--flavor', choices=FLAVORS, default='slic3r', help='Slicer comments, defaults to %(default)s')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, defaults to %(default)s')
+    args = parser.parse_args()
+
+    print("%d lines written" % write_synthetic(args.outfile, int(args.lines), args.flavor, args.seed))
+
+
+if __name__ == "__main__":
+    main()
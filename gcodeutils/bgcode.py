@@ -0,0 +1,604 @@
+"""Binary GCode (.bgcode) reading and writing
+
+Binary GCode files start with a header followed by blocks: metadata (INI like key=value lines), thumbnails
+and GCode text, each optionally compressed (deflate or heatshrink) and protected by a CRC32. GCode blocks
+are usually MeatPack encoded, packing the most frequent characters two per byte.
+
+BGCodeReader decodes the GCode blocks into a regular binary stream, so that binary files are read like
+ASCII ones (see gcodeutils.compression.open_gcode), the metadata and thumbnails being kept aside.
+BGCodeWriter is a text file like object encoding what is written to it into a binary GCode file.
+"""
+
+import io
+import re
+import struct
+import zlib
+from collections import OrderedDict, namedtuple
+
+__author__ = 'olivier'
+
+ENCODING = 'utf-8'
+
+MAGIC = b'GCDE'
+VERSION = 1
+
+CHECKSUM_NONE = 0
+CHECKSUM_CRC32 = 1
+
+FILE_METADATA = 0
+GCODE = 1
+SLICER_METADATA = 2
+PRINTER_METADATA = 3
+PRINT_METADATA = 4
+THUMBNAIL = 5
+
+NO_COMPRESSION = 0
+DEFLATE = 1
+HEATSHRINK_11_4 = 2
+HEATSHRINK_12_4 = 3
+
+# encoding of metadata blocks
+INI = 0
+# encodings of GCode blocks
+ASCII = 0
+MEATPACK = 1
+MEATPACK_COMMENTS = 2
+
+# formats of thumbnail blocks
+PNG = 0
+JPG = 1
+QOI = 2
+
+# window and lookahead sizes, in bits, of the heatshrink compressions
+HEATSHRINK_PARAMETERS = {HEATSHRINK_11_4: (11, 4), HEATSHRINK_12_4: (12, 4)}
+
+# characters of GCode text per GCode block, as written by slicers
+GCODE_BLOCK_SIZE = 65535
+
+# most recent positions tried when looking for heatshrink back references
+HEATSHRINK_CANDIDATES = 16
+
+Thumbnail = namedtuple('Thumbnail', ['format', 'width', 'height', 'data'])
+
+_FILE_HEADER = struct.Struct('<4sIH')
+_BLOCK_HEADER = struct.Struct('<HHI')
+_SIZE = struct.Struct('<I')
+_ENCODING_PARAMETERS = struct.Struct('<H')
+_THUMBNAIL_PARAMETERS = struct.Struct('<HHH')
+
+
+def is_bgcode(head):
+    """whether data starting with the head bytes is binary GCode"""
+    return head.startswith(MAGIC)
+
+
+def heatshrink_decompress(data, window_bits, lookahead_bits):
+    """return data decompressed with heatshrink: bits, most significant first, forming literals (1 and a
+    byte) or back references (0, offset - 1 on window_bits and count - 1 on lookahead_bits)"""
+    data = bytearray(data) + bytearray(3)
+    total_bits = (len(data) - 3) * 8
+    backref_bits = window_bits + lookahead_bits
+    output = bytearray()
+    position = 0
+
+    def read(position, count):
+        index = position >> 3
+        value = data[index] << 16 | data[index + 1] << 8 | data[index + 2]
+        return (value >> (24 - (position & 7) - count)) & ((1 << count) - 1)
+
+    while True:
+        if position + 9 > total_bits:
+            break
+        if read(position, 1):
+            output.append(read(position + 1, 8))
+            position += 9
+            continue
+        if position + 1 + backref_bits > total_bits:
+            # padding of the last byte
+            break
+        offset = read(position + 1, window_bits) + 1
+        count = read(position + 1 + window_bits, lookahead_bits) + 1
+        position += 1 + backref_bits
+        start = len(output) - offset
+        if start < 0:
+            # the window starts filled with zeros
+            output.extend(bytearray(min(-start, count)))
+            count -= min(-start, count)
+            start = 0
+        if count <= len(output) - start:
+            output.extend(output[start:start + count])
+        else:
+            for index in range(start, start + count):
+                output.append(output[index])
+    return bytes(output)
+
+
+def heatshrink_compress(data, window_bits, lookahead_bits):
+    """return data compressed with heatshrink, back references replacing matches of 2 bytes or more"""
+    data = bytearray(data)
+    size = len(data)
+    window = 1 << window_bits
+    max_count = 1 << lookahead_bits
+    # bits are accumulated in an integer, flushed to output by whole bytes
+    output = bytearray()
+    accumulator = 0
+    bits = 0
+    heads = {}
+
+    position = 0
+    while position < size:
+        best_count = 1
+        best_offset = 0
+        if position + 1 < size:
+            candidates = heads.get(data[position] | data[position + 1] << 8)
+            if candidates:
+                limit = min(max_count, size - position)
+                for candidate in reversed(candidates[-HEATSHRINK_CANDIDATES:]):
+                    if position - candidate > window:
+                        break
+                    count = 2
+                    while count < limit and data[candidate + count] == data[position + count]:
+                        count += 1
+                    if count > best_count:
+                        best_count = count
+                        best_offset = position - candidate
+                        if count == limit:
+                            break
+
+        if best_offset:
+            accumulator = (accumulator << (1 + window_bits + lookahead_bits)) | \
+                ((best_offset - 1) << lookahead_bits) | (best_count - 1)
+            bits += 1 + window_bits + lookahead_bits
+        else:
+            accumulator = (accumulator << 9) | 0x100 | data[position]
+            bits += 9
+        while bits >= 8:
+            bits -= 8
+            output.append((accumulator >> bits) & 0xff)
+        accumulator &= (1 << bits) - 1
+
+        for index in range(position, min(position + best_count, size - 1)):
+            key = data[index] | data[index + 1] << 8
+            candidates = heads.get(key)
+            if candidates is None:
+                heads[key] = [index]
+            else:
+                candidates.append(index)
+                if len(candidates) > 4 * HEATSHRINK_CANDIDATES:
+                    del candidates[:-HEATSHRINK_CANDIDATES]
+        position += best_count
+
+    if bits:
+        output.append((accumulator << (8 - bits)) & 0xff)
+    return bytes(output)
+
+
+# MeatPack: characters packed in 4 bits, the first character of a pair in the low bits. 0xf signals a
+# character which isn't packed and follows the packed byte. A packed newline ends the line, ignoring the
+# other half of its byte. Commands are 0xff 0xff followed by a command byte.
+MEATPACK_COMMAND = b'\xff\xff'
+MEATPACK_ENABLE_PACKING = 0xfb
+MEATPACK_DISABLE_PACKING = 0xfa
+MEATPACK_RESET_ALL = 0xf9
+MEATPACK_QUERY_CONFIG = 0xf8
+MEATPACK_ENABLE_NO_SPACES = 0xf7
+MEATPACK_DISABLE_NO_SPACES = 0xf6
+
+_MEATPACK_FULL = 0xf
+_MEATPACK_NEWLINE = 12
+_MEATPACK_CHARACTERS = b'0123456789. \nGX'
+# with no spaces, spaces are dropped from G lines and E takes the place of the space
+_MEATPACK_NO_SPACES_CHARACTERS = b'0123456789.E\nGX'
+
+
+def _meatpack_table(characters, high):
+    table = bytearray(256)
+    for value in range(256):
+        nibble = value >> 4 if high else value & 0xf
+        if nibble != _MEATPACK_FULL:
+            table[value] = bytearray(characters)[nibble]
+    return bytes(table)
+
+
+# characters of the low and high halves of packed bytes, indexed by the no spaces mode
+_MEATPACK_LOW = [_meatpack_table(characters, False)
+                 for characters in (_MEATPACK_CHARACTERS, _MEATPACK_NO_SPACES_CHARACTERS)]
+_MEATPACK_HIGH = [_meatpack_table(characters, True)
+                  for characters in (_MEATPACK_CHARACTERS, _MEATPACK_NO_SPACES_CHARACTERS)]
+
+
+def _byte_class(predicate):
+    return b'[' + b''.join(re.escape(struct.pack('B', value)) for value in range(256) if predicate(value)) + b']'
+
+
+def _packed(nibble):
+    return nibble != _MEATPACK_FULL
+
+
+_MEATPACK_COMMAND_RE = re.compile(re.escape(MEATPACK_COMMAND) + b'(.)', re.DOTALL)
+# runs of bytes packing two characters, a newline first, a character which isn't packed first, second, both
+_MEATPACK_TOKEN_RE = re.compile(b'|'.join([
+    b'(' + _byte_class(lambda value: _packed(value >> 4) and _packed(value & 0xf) and
+                       value & 0xf != _MEATPACK_NEWLINE) + b'+)',
+    b'(' + _byte_class(lambda value: value & 0xf == _MEATPACK_NEWLINE) + b')',
+    b'(' + _byte_class(lambda value: _packed(value >> 4) and not _packed(value & 0xf)) + b'.)',
+    b'(' + _byte_class(lambda value: not _packed(value >> 4) and _packed(value & 0xf) and
+                       value & 0xf != _MEATPACK_NEWLINE) + b'.)',
+    b'(\xff..)',
+]), re.DOTALL)
+
+# position of the missing space before the parameters of G lines
+_G_PARAMETER_RE = re.compile(r'(?<=[^ ])(?=[A-Z])')
+
+
+def _unpack(data, no_spaces):
+    low = _MEATPACK_LOW[no_spaces]
+    high = _MEATPACK_HIGH[no_spaces]
+    output = []
+    for match in _MEATPACK_TOKEN_RE.finditer(data):
+        run, newline, first_full, second_full, both_full = match.groups()
+        if run is not None:
+            characters = bytearray(2 * len(run))
+            characters[0::2] = run.translate(low)
+            characters[1::2] = run.translate(high)
+            output.append(bytes(characters))
+        elif newline is not None:
+            output.append(b'\n')
+        elif first_full is not None:
+            output.append(first_full[1:2] + first_full[0:1].translate(high))
+        elif second_full is not None:
+            output.append(second_full[0:1].translate(low) + second_full[1:2])
+        else:
+            output.append(both_full[1:3])
+    return b''.join(output)
+
+
+def meatpack_decode(data):
+    """return the GCode text, as bytes, of MeatPack encoded data, spaces being put back in G lines"""
+    output = []
+    packing = False
+    no_spaces = False
+    parts = _MEATPACK_COMMAND_RE.split(data)
+    # parts alternate data and command bytes
+    for index, part in enumerate(parts):
+        if index % 2:
+            command = bytearray(part)[0]
+            if command == MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif command in (MEATPACK_DISABLE_PACKING, MEATPACK_RESET_ALL):
+                packing = False
+            elif command == MEATPACK_ENABLE_NO_SPACES:
+                no_spaces = True
+            elif command == MEATPACK_DISABLE_NO_SPACES:
+                no_spaces = False
+        elif part:
+            output.append(_unpack(part, no_spaces) if packing else part)
+
+    lines = b''.join(output).decode(ENCODING).split('\n')
+    add_space = _G_PARAMETER_RE.sub
+    for index, line in enumerate(lines):
+        if line.startswith('G'):
+            if ';' in line:
+                code, separator, comment = line.partition(';')
+                lines[index] = add_space(' ', code) + separator + comment
+            else:
+                lines[index] = add_space(' ', line)
+    return '\n'.join(lines).encode(ENCODING)
+
+
+class _MeatPackPairs(dict):
+    """encoded bytes of each pair of characters"""
+
+    codes = dict((character, nibble) for nibble, character in enumerate(bytearray(_MEATPACK_NO_SPACES_CHARACTERS)))
+
+    def __missing__(self, pair):
+        pair = bytearray(pair)
+        first = self.codes.get(pair[0], _MEATPACK_FULL)
+        second = self.codes.get(pair[1], _MEATPACK_FULL)
+        if first == _MEATPACK_NEWLINE:
+            # the other half of the byte is ignored
+            second = _MEATPACK_NEWLINE
+        encoded = bytearray([second << 4 | first])
+        if first == _MEATPACK_FULL:
+            encoded.append(pair[0])
+        if second == _MEATPACK_FULL:
+            encoded.append(pair[1])
+        self[bytes(pair)] = encoded = bytes(encoded)
+        return encoded
+
+
+_MEATPACK_PAIRS = _MeatPackPairs()
+_PAIR_RE = re.compile(b'..', re.DOTALL)
+
+
+def meatpack_encode(text, keep_comments=True):
+    """return the MeatPack encoding, spaces of G lines dropped, of GCode text (without comments unless
+    keep_comments)"""
+    lines = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not keep_comments:
+            line = line.split(';', 1)[0].rstrip()
+        if not line:
+            continue
+        if line.startswith('G'):
+            code, separator, comment = line.partition(';')
+            line = code.replace(' ', '') + separator + comment
+        # each line ends a byte, a newline packed first ignoring the other half of its byte
+        lines.append(line + '\n' if len(line) % 2 else line + '\n\n')
+    data = ''.join(lines).encode(ENCODING)
+    return (MEATPACK_COMMAND + struct.pack('B', MEATPACK_ENABLE_PACKING) + MEATPACK_COMMAND +
+            struct.pack('B', MEATPACK_ENABLE_NO_SPACES) +
+            b''.join([_MEATPACK_PAIRS[pair] for pair in _PAIR_RE.findall(data)]))
+
+
+def compress(data, compression):
+    if compression == NO_COMPRESSION:
+        return data
+    if compression == DEFLATE:
+        return zlib.compress(data)
+    if compression in HEATSHRINK_PARAMETERS:
+        return heatshrink_compress(data, *HEATSHRINK_PARAMETERS[compression])
+    raise ValueError("unknown binary GCode compression: %r" % compression)
+
+
+def decompress(data, compression):
+    if compression == NO_COMPRESSION:
+        return data
+    if compression == DEFLATE:
+        return zlib.decompress(data)
+    if compression in HEATSHRINK_PARAMETERS:
+        return heatshrink_decompress(data, *HEATSHRINK_PARAMETERS[compression])
+    raise ValueError("unknown binary GCode compression: %r" % compression)
+
+
+def decode_metadata(data):
+    """return the ordered key/values of INI encoded metadata"""
+    metadata = OrderedDict()
+    for line in data.decode(ENCODING).split('\n'):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            metadata[key.strip()] = value.strip()
+    return metadata
+
+
+def encode_metadata(metadata):
+    return ''.join('%s=%s\n' % (key, value) for key, value in metadata.items()).encode(ENCODING)
+
+
+def _read_exactly(raw_file, size):
+    data = raw_file.read(size)
+    if len(data) != size:
+        raise ValueError("truncated binary GCode file")
+    return data
+
+
+def read_blocks(raw_file):
+    """generate the (type, parameters, decompressed data) of the blocks of a binary GCode file, after its
+    header, checking their checksums"""
+    magic, version, checksum_type = _FILE_HEADER.unpack(_read_exactly(raw_file, _FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("not a binary GCode file")
+    if version != VERSION:
+        raise ValueError("unsupported binary GCode version: %d" % version)
+    if checksum_type not in (CHECKSUM_NONE, CHECKSUM_CRC32):
+        raise ValueError("unknown binary GCode checksum: %d" % checksum_type)
+
+    while True:
+        header = raw_file.read(_BLOCK_HEADER.size)
+        if not header:
+            return
+        if len(header) != _BLOCK_HEADER.size:
+            raise ValueError("truncated binary GCode file")
+        block_type, compression, size = _BLOCK_HEADER.unpack(header)
+        if compression != NO_COMPRESSION:
+            compressed_size = _read_exactly(raw_file, _SIZE.size)
+            header += compressed_size
+            size = _SIZE.unpack(compressed_size)[0]
+        parameters_struct = _THUMBNAIL_PARAMETERS if block_type == THUMBNAIL else _ENCODING_PARAMETERS
+        parameters = _read_exactly(raw_file, parameters_struct.size)
+        data = _read_exactly(raw_file, size)
+        if checksum_type == CHECKSUM_CRC32:
+            checksum = _SIZE.unpack(_read_exactly(raw_file, _SIZE.size))[0]
+            if zlib.crc32(header + parameters + data) & 0xffffffff != checksum:
+                raise ValueError("binary GCode block checksum mismatch")
+        yield block_type, parameters_struct.unpack(parameters), decompress(data, compression)
+
+
+def write_block(raw_file, block_type, parameters, data, compression=NO_COMPRESSION,
+                checksum_type=CHECKSUM_CRC32):
+    """write a block of a binary GCode file, compressing its data"""
+    compressed = compress(data, compression)
+    header = _BLOCK_HEADER.pack(block_type, compression, len(data))
+    if compression != NO_COMPRESSION:
+        header += _SIZE.pack(len(compressed))
+    parameters_struct = _THUMBNAIL_PARAMETERS if block_type == THUMBNAIL else _ENCODING_PARAMETERS
+    block = header + parameters_struct.pack(*parameters) + compressed
+    if checksum_type == CHECKSUM_CRC32:
+        block += _SIZE.pack(zlib.crc32(block) & 0xffffffff)
+    raw_file.write(block)
+
+
+def _decode_gcode(parameters, data):
+    encoding = parameters[0]
+    if encoding == ASCII:
+        return data
+    if encoding in (MEATPACK, MEATPACK_COMMENTS):
+        return meatpack_decode(data)
+    raise ValueError("unknown binary GCode encoding: %d" % encoding)
+
+
+class BGCodeReader(io.RawIOBase):
+    """binary stream of the GCode text of a binary GCode file, decoded block by block.
+
+    The metadata (file_metadata, printer_metadata, print_metadata, slicer_metadata) and thumbnails, which
+    precede the GCode blocks, are read when the reader is created. Closing the reader closes raw_file."""
+
+    def __init__(self, raw_file):
+        super(BGCodeReader, self).__init__()
+        self.raw_file = raw_file
+        self.file_metadata = OrderedDict()
+        self.printer_metadata = OrderedDict()
+        self.print_metadata = OrderedDict()
+        self.slicer_metadata = OrderedDict()
+        self.thumbnails = []
+        self._blocks = read_blocks(raw_file)
+        self._pending = b''
+        self._offset = 0
+        self._next_gcode()
+
+    def _next_gcode(self):
+        """decode blocks up to the next GCode one, return False at the end of the file"""
+        metadata = {FILE_METADATA: self.file_metadata, PRINTER_METADATA: self.printer_metadata,
+                    PRINT_METADATA: self.print_metadata, SLICER_METADATA: self.slicer_metadata}
+        for block_type, parameters, data in self._blocks:
+            if block_type == GCODE:
+                self._pending = _decode_gcode(parameters, data)
+                self._offset = 0
+                return True
+            if block_type == THUMBNAIL:
+                self.thumbnails.append(Thumbnail(*(parameters + (data,))))
+            elif block_type in metadata:
+                metadata[block_type].update(decode_metadata(data))
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._pending):
+            if not self._next_gcode():
+                return 0
+        count = min(len(buffer), len(self._pending) - self._offset)
+        buffer[:count] = self._pending[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self.raw_file.close()
+        super(BGCodeReader, self).close()
+
+
+def bgcode_reader(gcode_file):
+    """return the BGCodeReader a text file object returned by read_bgcode_file reads, None for other files"""
+    raw = getattr(getattr(gcode_file, 'buffer', None), 'raw', None)
+    return raw if isinstance(raw, BGCodeReader) else None
+
+
+def read_bgcode_file(raw_file, encoding=ENCODING):
+    """return a text file object reading the GCode of the binary GCode raw_file"""
+    return io.TextIOWrapper(io.BufferedReader(BGCodeReader(raw_file)), encoding=encoding)
+
+
+class BGCodeWriter(object):
+    """text file like object writing what is written to it as a binary GCode file.
+
+    The header, metadata and thumbnails (list of Thumbnail) are written first, along with the first GCode
+    block, so that they can be changed until then (see copy_metadata). GCode blocks of about GCODE_BLOCK_SIZE
+    characters are written as text is written, cut at line ends. Closing the writer writes the last block
+    and closes raw_file."""
+
+    def __init__(self, raw_file, file_metadata=None, printer_metadata=None, print_metadata=None,
+                 slicer_metadata=None, thumbnails=(), compression=DEFLATE, gcode_encoding=MEATPACK_COMMENTS,
+                 checksum_type=CHECKSUM_CRC32, encoding=ENCODING):
+        self.raw_file = raw_file
+        self.compression = compression
+        self.gcode_encoding = gcode_encoding
+        self.checksum_type = checksum_type
+        self.encoding = encoding
+        self.chunks = []
+        self.size = 0
+        self.closed = False
+
+        if file_metadata is None:
+            file_metadata = OrderedDict([('Producer', 'gcodeutils')])
+        self.file_metadata = OrderedDict(file_metadata)
+        self.printer_metadata = OrderedDict(printer_metadata or {})
+        self.print_metadata = OrderedDict(print_metadata or {})
+        self.slicer_metadata = OrderedDict(slicer_metadata or {})
+        self.thumbnails = list(thumbnails)
+        self.header_written = False
+
+    def copy_metadata(self, reader):
+        """write the metadata and thumbnails read by a BGCodeReader rather than the ones given"""
+        if self.header_written:
+            raise ValueError("binary GCode metadata has already been written")
+        self.file_metadata = OrderedDict(reader.file_metadata)
+        self.printer_metadata = OrderedDict(reader.printer_metadata)
+        self.print_metadata = OrderedDict(reader.print_metadata)
+        self.slicer_metadata = OrderedDict(reader.slicer_metadata)
+        self.thumbnails = list(reader.thumbnails)
+
+    def _write_header(self):
+        self.header_written = True
+        self.raw_file.write(_FILE_HEADER.pack(MAGIC, VERSION, self.checksum_type))
+        self._write_metadata(FILE_METADATA, self.file_metadata)
+        self._write_metadata(PRINTER_METADATA, self.printer_metadata)
+        for thumbnail in self.thumbnails:
+            write_block(self.raw_file, THUMBNAIL, thumbnail[:3], thumbnail.data, NO_COMPRESSION,
+                        self.checksum_type)
+        self._write_metadata(PRINT_METADATA, self.print_metadata)
+        self._write_metadata(SLICER_METADATA, self.slicer_metadata)
+
+    def _write_metadata(self, block_type, metadata):
+        write_block(self.raw_file, block_type, (INI,), encode_metadata(metadata), self.compression,
+                    self.checksum_type)
+
+    def _write_gcode(self, text):
+        if not self.header_written:
+            self._write_header()
+        if self.gcode_encoding == ASCII:
+            data = text.encode(self.encoding)
+        elif self.gcode_encoding in (MEATPACK, MEATPACK_COMMENTS):
+            data = meatpack_encode(text, self.gcode_encoding == MEATPACK_COMMENTS)
+        else:
+            raise ValueError("unknown binary GCode encoding: %r" % self.gcode_encoding)
+        write_block(self.raw_file, GCODE, (self.gcode_encoding,), data, self.compression, self.checksum_type)
+
+    def write(self, text):
+        if self.closed:
+            raise ValueError("write to closed file")
+        if not text:
+            return
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size < GCODE_BLOCK_SIZE:
+            return
+        text = ''.join(self.chunks)
+        start = 0
+        while len(text) - start >= GCODE_BLOCK_SIZE:
+            end = text.rfind('\n', start, start + GCODE_BLOCK_SIZE) + 1
+            if not end:
+                # line longer than a block
+                end = text.find('\n', start) + 1 or len(text)
+            self._write_gcode(text[start:end])
+            start = end
+        self.chunks = [text[start:]]
+        self.size = len(text) - start
+
+    def writelines(self, lines):
+        self.write(''.join(lines))
+
+    def flush(self):
+        """flush raw_file, the pending text being written as a block when the writer is closed"""
+        self.raw_file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            text = ''.join(self.chunks)
+            if text:
+                self._write_gcode(text)
+            elif not self.header_written:
+                self._write_header()
+        finally:
+            self.raw_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
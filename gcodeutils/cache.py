@@ -0,0 +1,210 @@
+"""On-disk cache of parsed GCode programs
+
+Parsed programs are stored as zlib compressed JSON of plain values (lines attributes, layers with their
+recorded states and global values), which loading can't turn into code even in a shared cache directory. They
+are keyed by the hash of the program text and the parser version, so that parsing the same program again only
+costs rebuilding the line objects. The cache directory is bounded in size, the least recently used entries
+being evicted first.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+from datetime import timedelta
+
+from gcodeutils.gcoder import GCode, GCodeState, Layer, Line, PreprocessSnapshot, PyLine, tokenize
+from gcodeutils.stats import stage
+
+__author__ = 'olivier'
+
+# to be increased whenever parsing gives different results or the stored values change, so that stale cache
+# entries are not used anymore
+PARSER_VERSION = 3
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+CACHE_SUFFIX = '.gcache'
+
+LINE_ATTRIBUTES = [attribute for attribute in PyLine.__slots__
+                   if attribute not in ('gcview_end_vertex', 'parameters_memo')]
+
+GLOBAL_ATTRIBUTES = ['filament_length', 'duration', 'xmin', 'xmax', 'ymin', 'ymax', 'zmin', 'zmax',
+                     'width', 'depth', 'height', 'est_layer_height', 'layer_height']
+
+
+def _timedelta_values(duration):
+    if duration is None:
+        return None
+    return [duration.days, duration.seconds, duration.microseconds]
+
+
+def _tuples(values):
+    """return values read from JSON, their lists (tuples when dumped) turned back into tuples"""
+    return [tuple(value) if isinstance(value, list) else value for value in values]
+
+
+def dump_gcode(gcode):
+    """return the compact serialization of a parsed GCode program, as zlib compressed JSON of plain values so
+    that loading a cache entry can't run any code"""
+    values = {
+        'version': PARSER_VERSION,
+        'lines': [[getattr(line, attribute) for attribute in LINE_ATTRIBUTES]
+                  for layer in gcode.all_layers for line in layer],
+        'layers': [(layer.z, getattr(layer, 'duration', None), len(layer), layer.state, layer.snapshot)
+                   for layer in gcode.all_layers],
+        'append_layer_id': gcode.append_layer_id,
+        'all_zs': list(gcode.all_zs),
+        'zs_added': gcode._zs_added,
+        'state': gcode._get_state(),
+        'home_pos': gcode.home_pos,
+    }
+    for attribute in GLOBAL_ATTRIBUTES:
+        values[attribute] = getattr(gcode, attribute)
+    values['duration'] = _timedelta_values(gcode.duration)
+    return zlib.compress(json.dumps(values, separators=(',', ':')).encode('utf-8'))
+
+
+def load_gcode(data):
+    """return the GCode program serialized by dump_gcode"""
+    values = json.loads(zlib.decompress(data).decode('utf-8'))
+    if values.get('version') != PARSER_VERSION:
+        raise ValueError("GCode cache entry of another parser version")
+
+    gcode = GCode(deferred=True)
+    gcode.home_pos = values['home_pos']
+    gcode._set_state(GCodeState._make(values['state']))
+    for attribute in GLOBAL_ATTRIBUTES:
+        setattr(gcode, attribute, values[attribute])
+    if values['duration'] is not None:
+        gcode.duration = timedelta(*values['duration'])
+
+    lines = []
+    for line_values in values['lines']:
+        line = Line()
+        for attribute, value in zip(LINE_ATTRIBUTES, line_values):
+            if value is not None:
+                setattr(line, attribute, value)
+        lines.append(line)
+
+    gcode.all_layers = []
+    start = 0
+    for z, duration, count, state, snapshot in values['layers']:
+        layer = Layer(lines[start:start + count], z)
+        if duration is not None:
+            layer.duration = duration
+        if state is not None:
+            layer.state = GCodeState._make(state)
+        if snapshot is not None:
+            layer.snapshot = PreprocessSnapshot._make(_tuples(snapshot))
+        gcode.all_layers.append(layer)
+        start += count
+
+    gcode.append_layer_id = values['append_layer_id']
+    gcode.append_layer = gcode.all_layers[gcode.append_layer_id]
+    gcode.all_zs = set(values['all_zs'])
+    gcode._zs_added = values['zs_added']
+    gcode.layers = {}
+    # lines, layer_idxs and line_idxs are rebuilt from the layers when first accessed
+    gcode.invalidate_indexes()
+    return gcode
+
+
+class GCodeCache(object):
+    """directory of parsed GCode programs, bounded to max_size bytes"""
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(data, home_pos=None):
+        """return the cache key of a program given as an iterable of lines"""
+        digest = hashlib.sha1()
+        digest.update(('%d %r\n' % (PARSER_VERSION, home_pos)).encode('utf-8'))
+        for line in data:
+            digest.update(line.strip().encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """return the cached GCode for key, None if it isn't in the cache"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                gcode = load_gcode(cache_file.read())
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            logging.warning("ignoring unreadable GCode cache entry %s: %s" % (path, e))
+            return None
+        # record the access for the eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return gcode
+
+    def store(self, key, gcode):
+        """serialize gcode in the cache, evicting the least recently used entries if needed"""
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as cache_file:
+                cache_file.write(dump_gcode(gcode))
+            os.rename(temp_path, self.path(key))
+        except (IOError, OSError) as e:
+            logging.warning("can't store GCode cache entry %s: %s" % (self.path(key), e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """remove the least recently used entries, but the keep one, until the cache fits in max_size"""
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(CACHE_SUFFIX):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        entries.sort()
+
+        keep_filename = os.path.basename(self.path(keep)) if keep else None
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total_size <= self.max_size:
+                break
+            if filename == keep_filename:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            total_size -= size
+
+    def parse(self, data, home_pos=None, stats=None, tokenizer=None):
+        """return GCode(data, home_pos, tokenizer=tokenizer), from the cache when the same program has already been
+        parsed, recording the cache load and store stages in stats"""
+        data = list(data)
+        with stage(stats, 'cache load', len(data)):
+            key = self.key(data, home_pos)
+            gcode = self.load(key)
+        if gcode is None:
+            gcode = GCode(data, home_pos, stats=stats, tokenizer=tokenizer)
+            with stage(stats, 'cache store', len(data)):
+                self.store(key, gcode)
+        return gcode
+
+
+def parse_gcode(data, cache_dir=None, stats=None):
+    """return GCode(data) parsed with the single pass tokenizer, going through the cache in cache_dir when given,
+    recording the stages in stats"""
+    if cache_dir is None:
+        return GCode(data, stats=stats, tokenizer=tokenize)
+    return GCodeCache(cache_dir).parse(data, stats=stats, tokenizer=tokenize)
@@ -0,0 +1,122 @@
+"""Columnar representation of a parsed GCode program, backed by NumPy arrays
+
+Each parsed line is a row, each line attribute a contiguous array, so that statistics over millions
+of moves can be computed with vectorized operations instead of walking PyLine objects.
+NumPy is an optional dependency of gcodeutils, only required when using this module.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gcodeutils.gcoder import gcode_possible_arguments
+
+__author__ = 'olivier'
+
+CURRENT_ATTRIBUTES = ['current_x', 'current_y', 'current_z', 'current_e', 'current_f']
+FLAG_ATTRIBUTES = ['is_move', 'extruding', 'relative', 'relative_e']
+
+NO_COMMAND = -1
+
+
+class ColumnarGCode(object):
+    """Contiguous arrays view of a GCode program.
+
+    Commands are stored as indices in the `commands` vocabulary (NO_COMMAND for comments), coordinates
+    and current state as float arrays where NaN means the value is absent, flags as booleans and the
+    layer of each line in `layer`."""
+
+    def __init__(self, gcode):
+        if numpy is None:
+            raise RuntimeError("NumPy is required for the columnar representation of GCode")
+
+        lines = [line for layer in gcode.all_layers for line in layer]
+
+        self.layer = numpy.repeat(numpy.arange(len(gcode.all_layers), dtype=numpy.int32),
+                                  [len(layer) for layer in gcode.all_layers])
+        self.layer_z = numpy.array([layer.z for layer in gcode.all_layers], dtype=numpy.float64)
+
+        self.commands = []
+        command_idxs = {None: NO_COMMAND}
+        codes = []
+        for line in lines:
+            code = command_idxs.get(line.command)
+            if code is None:
+                code = command_idxs[line.command] = len(self.commands)
+                self.commands.append(line.command)
+            codes.append(code)
+        self.command = numpy.array(codes, dtype=numpy.int32)
+
+        # None values are converted to NaN by numpy when building float arrays
+        for attribute in gcode_possible_arguments + CURRENT_ATTRIBUTES:
+            setattr(self, attribute, numpy.array([getattr(line, attribute) for line in lines], dtype=numpy.float64))
+
+        for attribute in FLAG_ATTRIBUTES:
+            setattr(self, attribute, numpy.array([bool(getattr(line, attribute)) for line in lines], dtype=bool))
+
+        self.tool = numpy.array([line.current_tool if line.current_tool is not None else -1 for line in lines],
+                                dtype=numpy.int32)
+
+    def __len__(self):
+        return len(self.command)
+
+    @property
+    def layers_count(self):
+        return len(self.layer_z)
+
+    def command_mask(self, *commands):
+        """return a boolean mask of the lines whose command is one of the given commands (eg 'G1')"""
+        mask = numpy.zeros(len(self), dtype=bool)
+        for command in commands:
+            if command in self.commands:
+                mask |= self.command == self.commands.index(command)
+        return mask
+
+    def extruded(self):
+        """return the filament length extruded by each line (negative for retractions)"""
+        current_e = self.current_e.copy()
+        # comment lines don't change the extruder position, carry over the previous known one
+        missing = numpy.isnan(current_e)
+        if missing.any():
+            idx = numpy.where(missing, 0, numpy.arange(len(current_e)))
+            numpy.maximum.accumulate(idx, out=idx)
+            current_e = current_e[idx]
+            current_e[numpy.isnan(current_e)] = 0.
+        return numpy.diff(current_e, prepend=0.)
+
+    def travelled(self):
+        """return the distance travelled in the X/Y plane by each line"""
+        distances = numpy.zeros(len(self))
+        moves = numpy.flatnonzero(self.is_move)
+        if len(moves):
+            dx = numpy.diff(self.current_x[moves], prepend=self.current_x[moves[0]])
+            dy = numpy.diff(self.current_y[moves], prepend=self.current_y[moves[0]])
+            distances[moves] = numpy.hypot(dx, dy)
+        return distances
+
+    def filament_length(self):
+        """return the maximum filament length pushed in the extruder, as computed by GCode"""
+        return float(numpy.nanmax(numpy.append(self.current_e, 0.)))
+
+    def bounding_box(self, extruding_only=True):
+        """return the (xmin, xmax, ymin, ymax, zmin, zmax) bounding box of the moves, by default only
+        accounting for the extruding ones"""
+        mask = self.is_move & self.extruding if extruding_only else self.is_move
+        if not mask.any():
+            return (0., 0., 0., 0., 0., 0.)
+        bounds = []
+        for coordinates in (self.current_x[mask], self.current_y[mask], self.current_z[mask]):
+            bounds += [float(numpy.nanmin(coordinates)), float(numpy.nanmax(coordinates))]
+        return tuple(bounds)
+
+    def layer_stats(self):
+        """return a dict of per layer arrays: number of lines and moves, extruded filament and X/Y travel"""
+        count = self.layers_count
+        return {
+            'z': self.layer_z,
+            'lines': numpy.bincount(self.layer, minlength=count),
+            'moves': numpy.bincount(self.layer, weights=self.is_move, minlength=count).astype(numpy.int64),
+            'extruded': numpy.bincount(self.layer, weights=self.extruded(), minlength=count),
+            'travel': numpy.bincount(self.layer, weights=self.travelled(), minlength=count),
+        }
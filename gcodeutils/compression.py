@@ -0,0 +1,269 @@
+"""Transparent reading and writing of compressed GCode files
+
+Compressed input is detected from its first bytes (gzip, xz and, when the zstandard module is installed,
+zstd) and decompressed in chunks while being read. Output is compressed according to the file name
+extension (.gz, .xz, .zst), on a background thread so that compressing overlaps the production of the
+program, the compressors releasing the GIL while they work.
+"""
+
+import gzip
+import io
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
+try:
+    import lzma
+except ImportError:  # python 2 without backports.lzma
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from gcodeutils.bgcode import BGCodeWriter, bgcode_reader, is_bgcode, read_bgcode_file
+
+__author__ = 'olivier'
+
+ENCODING = 'utf-8'
+
+GZIP = 'gzip'
+XZ = 'xz'
+ZSTD = 'zstd'
+
+# compression name, leading magic bytes and file name extensions
+COMPRESSIONS = [
+    (GZIP, b'\x1f\x8b', ('.gz',)),
+    (XZ, b'\xfd7zXZ\x00', ('.xz',)),
+    (ZSTD, b'\x28\xb5\x2f\xfd', ('.zst', '.zstd')),
+]
+
+MAGIC_SIZE = max(len(magic) for _, magic, _ in COMPRESSIONS)
+
+GZIP_LEVEL = 6
+
+BGCODE_EXTENSION = '.bgcode'
+
+# number of chunks waiting to be compressed before the producer is blocked
+QUEUE_SIZE = 8
+
+
+def available_compressions():
+    """return the names of the compressions supported by the installed modules"""
+    modules = {GZIP: gzip, XZ: lzma, ZSTD: zstandard}
+    return [name for name, _, _ in COMPRESSIONS if modules[name] is not None]
+
+
+def detect_compression(head):
+    """return the name of the compression of data starting with the head bytes, None if uncompressed"""
+    for name, magic, _ in COMPRESSIONS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def compression_from_filename(filename):
+    """return the name of the compression matching the extension of filename, None if uncompressed"""
+    filename = filename.lower()
+    for name, _, extensions in COMPRESSIONS:
+        if filename.endswith(extensions):
+            return name
+    return None
+
+
+def _check_available(compression):
+    if compression not in available_compressions():
+        raise ValueError("%s compression is not available, the %s module is missing" % (
+            compression, 'lzma' if compression == XZ else 'zstandard'))
+
+
+def decompressing_file(raw_file, compression):
+    """return a binary file object decompressing raw_file"""
+    _check_available(compression)
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=raw_file, mode='rb')
+    if compression == XZ:
+        return lzma.LZMAFile(raw_file, 'rb')
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw_file))
+
+
+def compressing_file(raw_file, compression):
+    """return a binary file object compressing into raw_file"""
+    _check_available(compression)
+    if compression == GZIP:
+        return gzip.GzipFile(fileobj=raw_file, mode='wb', compresslevel=GZIP_LEVEL)
+    if compression == XZ:
+        return lzma.LZMAFile(raw_file, 'wb')
+    return zstandard.ZstdCompressor().stream_writer(raw_file)
+
+
+class BackgroundCompressingWriter(object):
+    """text file like object compressing what is written to it on a background thread.
+
+    Written text is queued, the thread encoding, compressing and writing it to raw_file. Errors of the
+    thread are raised by the next write, flush or close. Closing the writer ends the compressed stream and
+    closes raw_file."""
+
+    def __init__(self, raw_file, compression, encoding=ENCODING):
+        self.raw_file = raw_file
+        self.encoding = encoding
+        self.compressed_file = compressing_file(raw_file, compression)
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            text = self.queue.get()
+            try:
+                if text is None:
+                    return
+                if self.error is None:
+                    self.compressed_file.write(text.encode(self.encoding))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def write(self, text):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self._raise_error()
+        if text:
+            self.queue.put(text)
+
+    def writelines(self, lines):
+        self.write(''.join(lines))
+
+    def flush(self):
+        """wait until everything written so far has been compressed"""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self._raise_error()
+            self.compressed_file.close()
+        finally:
+            self.raw_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _peekable(raw_file):
+    if not hasattr(raw_file, 'peek'):
+        raw_file = io.BufferedReader(raw_file)
+    return raw_file
+
+
+def read_gcode_file(raw_file, encoding=ENCODING):
+    """return a text file object reading the binary raw_file, decompressing it (or decoding binary GCode)
+    if needed"""
+    raw_file = _peekable(raw_file)
+    head = raw_file.peek(MAGIC_SIZE)[:MAGIC_SIZE]
+    if is_bgcode(head):
+        return read_bgcode_file(raw_file, encoding)
+    compression = detect_compression(head)
+    if compression is not None:
+        raw_file = decompressing_file(raw_file, compression)
+    return io.TextIOWrapper(raw_file, encoding=encoding)
+
+
+def write_gcode_file(raw_file, compression=None, encoding=ENCODING):
+    """return a text file object writing to the binary raw_file, compressed with the given compression"""
+    if compression is None:
+        return io.TextIOWrapper(raw_file, encoding=encoding)
+    return BackgroundCompressingWriter(raw_file, compression, encoding)
+
+
+def _std_stream(stream):
+    # python 3 text streams expose their underlying binary stream
+    return getattr(stream, 'buffer', stream)
+
+
+def open_gcode(filename, mode='r', compression=None, encoding=ENCODING):
+    """open a GCode file for reading ('r') or writing ('w') as a text file object.
+
+    Read files are decompressed, or decoded from binary GCode, according to their content. Written files are
+    compressed with compression, guessed from the filename extension by default, or written as binary GCode
+    when their extension is .bgcode. '-' stands for the standard input or output, which is written
+    uncompressed unless compression is given."""
+    if mode not in ('r', 'w'):
+        raise ValueError("invalid mode: %r" % mode)
+
+    if mode == 'r':
+        if filename == '-':
+            raw_file = io.open(_std_stream(sys.stdin).fileno(), 'rb', closefd=False)
+        else:
+            raw_file = io.open(filename, 'rb')
+        return read_gcode_file(raw_file, encoding)
+
+    if filename == '-':
+        if compression is None:
+            return sys.stdout
+        raw_file = io.open(_std_stream(sys.stdout).fileno(), 'wb', closefd=False)
+    else:
+        if compression is None and filename.lower().endswith(BGCODE_EXTENSION):
+            return BGCodeWriter(io.open(filename, 'wb'), encoding=encoding)
+        if compression is None:
+            compression = compression_from_filename(filename)
+        raw_file = io.open(filename, 'wb')
+    return write_gcode_file(raw_file, compression, encoding)
+
+
+def carry_metadata(input_file, output_file):
+    """write the metadata and thumbnails of a binary GCode input file to a binary GCode output file, both
+    opened by open_gcode, so that rewriting a binary file keeps them. return whether they were carried"""
+    reader = bgcode_reader(input_file)
+    if reader is None or not isinstance(output_file, BGCodeWriter):
+        return False
+    output_file.copy_metadata(reader)
+    return True
+
+
+def close_gcode(gcode_file):
+    """close a file opened by open_gcode, leaving the standard streams open"""
+    if gcode_file not in (sys.stdin, sys.stdout):
+        gcode_file.close()
+
+
+class GCodeFileType(object):
+    """argparse type opening GCode files with open_gcode, like argparse.FileType does with open"""
+
+    def __init__(self, mode='r'):
+        self.mode = mode
+
+    def __call__(self, filename):
+        try:
+            return open_gcode(filename, self.mode)
+        except (IOError, OSError, ValueError) as e:
+            import argparse
+            raise argparse.ArgumentTypeError("can't open '%s': %s" % (filename, e))
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.mode)
@@ -0,0 +1,134 @@
+"""Semantic diff of GCode programs
+
+Programs are compared layer by layer, with digests computed in two steps: a digest of the code part
+(comments left aside) of the raw lines of each layer first, then, only for the runs of layers whose raw
+digests differ once both programs are aligned on them, a digest of the meaning of their lines (command
+and arguments quantized to PyLine.EQ_EPSILON). Layers still differing are finally compared line by line,
+lines being aligned the same way and compared with the PyLine tolerance, so that every difference is
+reported with its position while identical layers cost a single digest.
+
+Layers of MappedGCode programs which aren't loaded are read from the file without being kept (and without
+being parsed for raw digests), so that big files can be compared with a bounded memory footprint.
+"""
+
+import difflib
+from collections import namedtuple
+from operator import attrgetter
+
+from gcodeutils.gcoder import PyLine, gcode_possible_arguments
+from gcodeutils.mapped import MappedLayer
+
+__author__ = 'olivier'
+
+CHANGED = 'changed'
+REMOVED = 'removed'
+ADDED = 'added'
+
+# kind of difference, position (layer index and line index in the layer, None when the line is missing)
+# and raw line in both programs
+Difference = namedtuple('Difference', ['kind', 'layer', 'line', 'other_layer', 'other_line', 'raw', 'other_raw'])
+
+
+_arguments = attrgetter(*gcode_possible_arguments)
+
+
+def line_key(line):
+    """return a hashable key of the meaning of a line, its command and its arguments quantized to
+    PyLine.EQ_EPSILON. Lines with the same key are equal, lines with different keys usually aren't"""
+    scale = 1. / PyLine.EQ_EPSILON
+    return line.command, tuple([value if value is None else round(value * scale) for value in _arguments(line)])
+
+
+def layer_lines(gcode, layer_idx):
+    """return the lines of a layer, parsing the layers of a MappedGCode without keeping them"""
+    layer = gcode.all_layers[layer_idx]
+    if isinstance(layer, MappedLayer) and not layer.loaded:
+        return gcode.parse_layer_lines(layer)
+    return layer
+
+
+def layer_raw_lines(gcode, layer_idx):
+    """return the raw lines of a layer, read from the file for the layers of a MappedGCode"""
+    layer = gcode.all_layers[layer_idx]
+    if isinstance(layer, MappedLayer) and not layer.loaded:
+        return gcode.raw_lines(layer.start, layer.count)
+    return [line.raw for line in layer]
+
+
+def raw_digests(gcode):
+    """return the digest of the code part of the raw lines of each layer of a program"""
+    digests = []
+    for layer_idx in range(len(gcode.all_layers)):
+        codes = (raw.split(';', 1)[0].strip() for raw in layer_raw_lines(gcode, layer_idx))
+        digests.append(hash(tuple(code for code in codes if code)))
+    return digests
+
+
+def semantic_digests(gcode, first_layer, last_layer):
+    """return the digest of the meaningful lines of each layer of a range of layers of a program"""
+    return [hash(tuple(line_key(line) for line in layer_lines(gcode, layer_idx) if line.command is not None))
+            for layer_idx in range(first_layer, last_layer)]
+
+
+def _differing_runs(digests, other_digests):
+    """generate the (start, end, other_start, other_end) runs of digests not matched by the alignment"""
+    matcher = difflib.SequenceMatcher(None, digests, other_digests, autojunk=False)
+    for tag, start, end, other_start, other_end in matcher.get_opcodes():
+        if tag != 'equal':
+            yield start, end, other_start, other_end
+
+
+def _meaningful_lines(gcode, first_layer, last_layer):
+    """return (layer index, line index, line) of the meaningful lines of a range of layers"""
+    lines = []
+    for layer_idx in range(first_layer, last_layer):
+        for line_idx, line in enumerate(layer_lines(gcode, layer_idx)):
+            if line.command is not None:
+                lines.append((layer_idx, line_idx, line))
+    return lines
+
+
+def _diff_lines(lines, other_lines):
+    matcher = difflib.SequenceMatcher(None, [line_key(line) for _, _, line in lines],
+                                      [line_key(line) for _, _, line in other_lines], autojunk=False)
+    for tag, start, end, other_start, other_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        # lines are paired in order, as GCode.__eq__ does, the remaining ones being missing on the other side
+        for offset in range(max(end - start, other_end - other_start)):
+            index = start + offset
+            other_index = other_start + offset
+            if index < end and other_index < other_end:
+                layer_idx, line_idx, line = lines[index]
+                other_layer_idx, other_line_idx, other_line = other_lines[other_index]
+                if line != other_line:
+                    yield Difference(CHANGED, layer_idx, line_idx, other_layer_idx, other_line_idx,
+                                     line.raw, other_line.raw)
+            elif index < end:
+                layer_idx, line_idx, line = lines[index]
+                yield Difference(REMOVED, layer_idx, line_idx, None, None, line.raw, None)
+            else:
+                other_layer_idx, other_line_idx, other_line = other_lines[other_index]
+                yield Difference(ADDED, None, None, other_layer_idx, other_line_idx, None, other_line.raw)
+
+
+def semantic_diff(gcode, other):
+    """generate the Difference between the meaningful lines of two programs, in order"""
+    for start, end, other_start, other_end in _differing_runs(raw_digests(gcode), raw_digests(other)):
+        runs = _differing_runs(semantic_digests(gcode, start, end), semantic_digests(other, other_start, other_end))
+        for run_start, run_end, other_run_start, other_run_end in runs:
+            for difference in _diff_lines(_meaningful_lines(gcode, start + run_start, start + run_end),
+                                          _meaningful_lines(other, other_start + other_run_start,
+                                                            other_start + other_run_end)):
+                yield difference
+
+
+def format_difference(difference):
+    if difference.kind == REMOVED:
+        return "layer {} line {}: only in self: '{}'".format(difference.layer, difference.line, difference.raw)
+    if difference.kind == ADDED:
+        return "layer {} line {}: only in other: '{}'".format(difference.other_layer, difference.other_line,
+                                                            difference.other_raw)
+    return "layer {} line {} vs layer {} line {}: '{}' vs '{}'".format(
+        difference.layer, difference.line, difference.other_layer, difference.other_line, difference.raw,
+        difference.other_raw)
@@ -83,6 +83,8 @@ class GCodeArcOptimizerFilter(GCodeFilter):
 
     queue = []
     valid_circle = False
+    # arcs are fitted to the moves of a layer, the queue being flushed at its end
+    layer_local = True
 
     def __init__(self):
         self.queue = []
@@ -115,11 +117,17 @@ class GCodeArcOptimizerFilter(GCodeFilter):
         """
         return opcode
 
-    def parse_gcode(self, gcode, opcode_filter):
-        for layer in gcode.all_layers:
-            self.parse_layer(layer, opcode_filter)
-        if len(self.queue) > 0:
-            layer += self.queue
+    def flush(self):
+        """return the moves still queued, as an arc if they make one"""
+        if self.valid_circle:
+            # to_gcode keeps the line invalidating the circle, there's none left
+            self.queue.append(None)
+            result = self.to_gcode()[:-1]
+        else:
+            result = self.queue
+        self.queue = []
+        self.valid_circle = False
+        return result
 
     def get_circle_least_squares(self):
         """
@@ -1,33 +1,145 @@
+from gcodeutils.gcoder import LightLine, Line
+from gcodeutils.progress import progress_layers
+
 __author__ = 'olivier'
 
+# opcode_filter returns None to keep a line, a line to replace it (possibly the line itself, modified in place),
+# or any other iterable of lines to expand it into these lines (DROP, or any empty one, to drop it)
+LINE_CLASSES = (Line, LightLine)
+DROP = ()
+
+# above this many lines expanded or dropped in a layer, it is rebuilt at once rather than spliced at each of them
+SPLICE_LIMIT = 16
+
+
+def splice(layer, expansions):
+    """expand in place the lines of a layer given by expansions, a list of (line index, lines) in increasing
+    line index order"""
+    if len(expansions) <= SPLICE_LIMIT:
+        # from the end, so that the indexes of the lines still to be expanded don't change
+        for line_idx, lines in reversed(expansions):
+            layer[line_idx:line_idx + 1] = lines
+        return
+    new_layer = []
+    start = 0
+    for line_idx, lines in expansions:
+        new_layer += layer[start:line_idx]
+        new_layer += lines
+        start = line_idx + 1
+    new_layer += layer[start:]
+    layer[:] = new_layer
+
 
 class GCodeFilter(object):
     """abstract base filter class"""
 
+    # whether filter_layer_from can filter any layer on its own, given the state returned for this layer by
+    # layer_states, so that layers can be filtered in parallel (see gcodeutils.parallel.filter_parallel)
+    layer_local = False
+
+    # attributes holding the state carried by opcode_filter from line to line (updated by update_state),
+    # get_state returning their values as a tuple of plain, picklable values
+    state_attributes = ()
+
+    @property
+    def name(self):
+        """name of the filter in statistics and progress reports"""
+        return type(self).__name__
+
     def opcode_filter(self, x):
         raise NotImplementedError
 
+    def flush(self):
+        """return the lines held back by opcode_filter once every line has been filtered"""
+        return []
+
+    def get_state(self):
+        """return the state of the filter, to be restored by set_state"""
+        return tuple(getattr(self, attribute) for attribute in self.state_attributes)
+
+    def set_state(self, state):
+        for attribute, value in zip(self.state_attributes, state):
+            setattr(self, attribute, value)
+
+    def update_state(self, opcode):
+        """update the state_attributes as opcode_filter(opcode) would, without filtering opcode"""
+        raise NotImplementedError
+
+    def layer_states(self, gcode):
+        """return the state of the filter at the start of each layer of gcode, as given to filter_layer_from.
+
+        The states of a filter carrying state_attributes are followed along the lines with update_state, which
+        only looks at the few commands changing them, the state of the filter being left untouched."""
+        if not self.state_attributes:
+            return [None] * len(gcode.all_layers)
+        initial_state = self.get_state()
+        update_state = self.update_state
+        states = []
+        for layer in gcode.all_layers:
+            states.append(self.get_state())
+            for line in layer:
+                update_state(line)
+        self.set_state(initial_state)
+        return states
+
+    def filter_layer_from(self, layer, state):
+        """filter a layer in place on its own, starting from state, the lines held back at its end being
+        flushed into it"""
+        if state is not None:
+            self.set_state(state)
+        self.parse_layer(layer, self.opcode_filter)
+        layer += self.flush()
+
     def filter(self, gcode):
         self.parse_gcode(gcode, self.opcode_filter)
 
+    def iter_filter(self, lines):
+        """generate the lines resulting of filtering an iterable of preprocessed lines (eg a GCodeStream), as
+        they come, so that filters can be chained lazily between a reader and a writer"""
+        opcode_filter = self.opcode_filter
+        for opcode in lines:
+            result = opcode_filter(opcode)
+            if result is None:
+                yield opcode
+            elif isinstance(result, LINE_CLASSES):
+                yield result
+            else:
+                for line in result:
+                    yield line
+        for line in self.flush():
+            yield line
+
+    def filter_layer(self, layer):
+        """filter a single layer in place, as done when a GCodeStream is consumed"""
+        self.parse_layer(layer, self.opcode_filter)
+
     def parse_gcode(self, gcode, opcode_filter):
-        for layer in gcode.all_layers:
-            self.parse_layer(layer, opcode_filter)
+        for layer_idx, layer in enumerate(progress_layers(gcode, self.name)):
+            if self.parse_layer(layer, opcode_filter):
+                gcode.mark_dirty(layer_idx)
+        tail = self.flush()
+        if tail:
+            gcode.all_layers[-1] += tail
+            gcode.mark_dirty(len(gcode.all_layers) - 1)
 
     def parse_layer(self, layer, opcode_filter):
+        """filter the lines of a layer in place, return whether the layer has been modified.
+
+        Replaced lines are set in place as they come, the lines expanded or dropped are spliced once the whole
+        layer has been filtered: lines kept cost nothing but the call to opcode_filter."""
         dirty_layer = False
-        new_layer = []
-        for opcode in layer:
-            opcode_filter_result = opcode_filter(opcode)
-
-            if opcode_filter_result is not None:
-                dirty_layer = True
-                try:
-                    new_layer += opcode_filter_result
-                except TypeError:
-                    new_layer.append(opcode_filter_result)
+        expansions = []
+        for line_idx, opcode in enumerate(layer):
+            result = opcode_filter(opcode)
+            if result is None:
+                continue
+            dirty_layer = True
+            if isinstance(result, LINE_CLASSES):
+                if result is not opcode:
+                    layer[line_idx] = result
             else:
-                new_layer.append(opcode)
+                expansions.append((line_idx, result))
 
-        if dirty_layer:
-            layer[:] = new_layer
+        if expansions:
+            splice(layer, expansions)
+        return dirty_layer
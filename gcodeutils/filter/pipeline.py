@@ -0,0 +1,106 @@
+"""Several filters applied in a single traversal of a program
+
+A FilterPipeline passes each line through the opcode_filter of each of its filters in turn, the lines
+returned by one filter being passed to the next one, so that a program filtered by several filters is
+walked, and its layers rebuilt, only once. Lines kept or replaced by a single line go through the pipeline
+without any list being built. Given a Stats, the time spent in each filter is recorded as a stage named after
+the filter, nested in the stage running the pipeline.
+"""
+
+from gcodeutils.filter.filter import LINE_CLASSES, GCodeFilter
+
+__author__ = 'olivier'
+
+
+def filter_lines(lines, opcode_filter):
+    """return the lines resulting of filtering each of lines with opcode_filter"""
+    filtered = []
+    for line in lines:
+        result = opcode_filter(line)
+        if result is None:
+            filtered.append(line)
+        elif isinstance(result, LINE_CLASSES):
+            filtered.append(result)
+        else:
+            filtered += result
+    return filtered
+
+
+class FilterPipeline(GCodeFilter):
+    """filter chaining the opcode filters of several GCodeFilters, in order.
+
+    Only filters working line by line through opcode_filter (and flush) can be chained, filters
+    overriding filter or parse_gcode walk the program on their own and have to be run separately."""
+
+    def __init__(self, *filters, **kwargs):
+        # Stats recording the time spent in each filter, None not to time them
+        self.stats = kwargs.pop('stats', None)
+        if kwargs:
+            raise TypeError("unexpected keyword arguments: %s" % ', '.join(sorted(kwargs)))
+        self.filters = []
+        self._opcode_filters = []
+        self._flushes = []
+        for gcode_filter in filters:
+            self.add(gcode_filter)
+
+    def add(self, gcode_filter):
+        """append a filter (or the filters of another pipeline) to the pipeline, return the pipeline"""
+        if isinstance(gcode_filter, FilterPipeline):
+            for chained_filter in gcode_filter.filters:
+                self.add(chained_filter)
+            return self
+        if not isinstance(gcode_filter, GCodeFilter):
+            raise TypeError("%s is not a GCodeFilter" % type(gcode_filter).__name__)
+        for method in ('filter', 'parse_gcode', 'parse_layer'):
+            if getattr(type(gcode_filter), method) != getattr(GCodeFilter, method):
+                raise ValueError("%s overrides %s and can't be chained" % (gcode_filter.name, method))
+        self.filters.append(gcode_filter)
+        if self.stats is None:
+            self._opcode_filters.append(gcode_filter.opcode_filter)
+            self._flushes.append(gcode_filter.flush)
+        else:
+            self._opcode_filters.append(self.stats.timed(gcode_filter.opcode_filter, gcode_filter.name, lines=1))
+            self._flushes.append(self.stats.timed(gcode_filter.flush, gcode_filter.name))
+        return self
+
+    def __len__(self):
+        return len(self.filters)
+
+    @property
+    def name(self):
+        return '+'.join(gcode_filter.name for gcode_filter in self.filters)
+
+    def opcode_filter(self, opcode):
+        line = opcode
+        # whether a filter returned a line, even the one it was given (modified in place)
+        replaced = False
+        opcode_filters = self._opcode_filters
+        for filter_idx, opcode_filter in enumerate(opcode_filters):
+            result = opcode_filter(line)
+            if result is None:
+                continue
+            if isinstance(result, LINE_CLASSES):
+                line = result
+                replaced = True
+                continue
+
+            # the line has been expanded or dropped, go on with a list of lines
+            lines = list(result)
+            for next_opcode_filter in opcode_filters[filter_idx + 1:]:
+                lines = filter_lines(lines, next_opcode_filter)
+            return lines
+
+        return line if replaced else None
+
+    def iter_filter(self, lines):
+        for gcode_filter in self.filters:
+            lines = gcode_filter.iter_filter(lines)
+        return lines
+
+    def flush(self):
+        # lines held back by a filter still go through the filters after it
+        tail = []
+        for opcode_filter, flush in zip(self._opcode_filters, self._flushes):
+            tail = filter_lines(tail, opcode_filter)
+            tail += flush()
+        return tail
@@ -2,16 +2,39 @@ from decimal import Decimal
 
 from gcodeutils.filter.filter import GCodeFilter
 from gcodeutils.gcoder import GCODE_SET_POSITION_COMMAND, GCODE_RELATIVE_POSITIONING_COMMAND, move_gcodes, split, Line, \
-    GCODE_ABSOLUTE_EXTRUSION_COMMAND, \
-    GCODE_RELATIVE_EXTRUSION_COMMAND, raw_to_line, unsplit
+    GCODE_ABSOLUTE_EXTRUSION_COMMAND, GCODE_INCHES_COMMAND, GCODE_MILLIMETERS_COMMAND, \
+    GCODE_RELATIVE_EXTRUSION_COMMAND, raw_to_line, patch
 
 __author__ = 'olivier'
 
 
 class GCodeToRelativeExtrusionFilter(GCodeFilter):
+    layer_local = True
+    state_attributes = ('relative_extrusion', 'current_extrusion_distance', 'imperial')
+
     def __init__(self):
         self.relative_extrusion = False
         self.current_extrusion_distance = Decimal()
+        # lines are parsed in millimeters, patched back in inches after a G20
+        self.imperial = False
+
+    def update_state(self, opcode):
+        command = opcode.command
+        if command == GCODE_RELATIVE_EXTRUSION_COMMAND:
+            self.relative_extrusion = True
+        elif command == GCODE_ABSOLUTE_EXTRUSION_COMMAND:
+            self.relative_extrusion = False
+        elif command == GCODE_INCHES_COMMAND:
+            self.imperial = True
+        elif command == GCODE_MILLIMETERS_COMMAND:
+            self.imperial = False
+        elif command == GCODE_SET_POSITION_COMMAND:
+            if opcode.e is not None:
+                self.current_extrusion_distance = Decimal(opcode.e)
+            elif opcode.x is None and opcode.y is None and opcode.z is None:
+                self.current_extrusion_distance = Decimal()
+        elif command in move_gcodes and not self.relative_extrusion and opcode.e is not None:
+            self.current_extrusion_distance = Decimal(opcode.e)
 
     def opcode_filter(self, opcode):
         if opcode.command == GCODE_RELATIVE_EXTRUSION_COMMAND:
@@ -22,6 +45,14 @@ class GCodeToRelativeExtrusionFilter(GCodeFilter):
             self.relative_extrusion = False
             return raw_to_line(GCODE_RELATIVE_EXTRUSION_COMMAND)
 
+        if opcode.command == GCODE_INCHES_COMMAND:
+            self.imperial = True
+            return
+
+        if opcode.command == GCODE_MILLIMETERS_COMMAND:
+            self.imperial = False
+            return
+
         if opcode.command == GCODE_SET_POSITION_COMMAND:
 
             # when setting position, if E is set, use it, but if there is parameter, consider E=0
@@ -38,5 +69,5 @@ class GCodeToRelativeExtrusionFilter(GCodeFilter):
             opcode.e, self.current_extrusion_distance = (
             opcode.e - float(self.current_extrusion_distance), Decimal(opcode.e))
             opcode.relative_e=True
-            unsplit(opcode)
+            patch(opcode, 'e', self.imperial)
             return opcode
@@ -1,8 +1,9 @@
 import logging
 
 from gcodeutils.filter.filter import GCodeFilter
-from gcodeutils.gcoder import move_gcodes, split, unsplit, GCODE_ABSOLUTE_POSITIONING_COMMAND, \
-    GCODE_RELATIVE_POSITIONING_COMMAND, GCODE_SET_POSITION_COMMAND, Line, raw_to_line
+from gcodeutils.gcoder import move_gcodes, patch, split, GCODE_ABSOLUTE_POSITIONING_COMMAND, \
+    GCODE_RELATIVE_POSITIONING_COMMAND, GCODE_SET_POSITION_COMMAND, GCODE_INCHES_COMMAND, \
+    GCODE_MILLIMETERS_COMMAND, Line, raw_to_line
 
 __author__ = 'olivier'
 
@@ -10,6 +11,9 @@ __author__ = 'olivier'
 class GCodeXYTranslateFilter(GCodeFilter):
     """filter translating moves in the X/Y plane"""
 
+    layer_local = True
+    state_attributes = ('translate_x', 'translate_y', 'first_move_after_home', 'absolute_distance_mode', 'imperial')
+
     def __init__(self, x=None, y=None, **kwargs):
         self.translate_x = x or 0.
         self.translate_y = y or 0.
@@ -18,6 +22,30 @@ class GCodeXYTranslateFilter(GCodeFilter):
 
         self.absolute_distance_mode = None  # None if when it is unknown
 
+        # lines are parsed in millimeters, patched back in inches after a G20
+        self.imperial = False
+
+    def update_state(self, opcode):
+        command = opcode.command
+        if command in move_gcodes:
+            if self.absolute_distance_mode is False:
+                self.first_move_after_home = False
+        elif command == GCODE_ABSOLUTE_POSITIONING_COMMAND:
+            self.absolute_distance_mode = True
+        elif command == GCODE_RELATIVE_POSITIONING_COMMAND:
+            self.absolute_distance_mode = False
+        elif command == GCODE_INCHES_COMMAND:
+            self.imperial = True
+        elif command == GCODE_MILLIMETERS_COMMAND:
+            self.imperial = False
+        elif command == GCODE_SET_POSITION_COMMAND:
+            # no coordinate given is equivalent to all 0
+            reset_all = opcode.x is None and opcode.y is None and opcode.z is None
+            if reset_all or opcode.x is not None:
+                self.translate_x = 0
+            if reset_all or opcode.y is not None:
+                self.translate_y = 0
+
     def generate_translation(self):
         return raw_to_line("G0 X%.4f Y%.4f" % (self.translate_x, self.translate_y))
 
@@ -40,14 +68,22 @@ class GCodeXYTranslateFilter(GCodeFilter):
             # at this point, we're an absolute move, we have to "hard patch" coordinate
             if opcode.x is not None and self.translate_x:
                 opcode.x += self.translate_x
-                unsplit(opcode)
 
             if opcode.y is not None and self.translate_y:
                 opcode.y += self.translate_y
-                unsplit(opcode)
+
+            patch(opcode, 'xy', self.imperial)
 
             return opcode
 
+        if opcode.command == GCODE_INCHES_COMMAND:
+            self.imperial = True
+            return
+
+        if opcode.command == GCODE_MILLIMETERS_COMMAND:
+            self.imperial = False
+            return
+
         if opcode.command == GCODE_ABSOLUTE_POSITIONING_COMMAND:
             self.absolute_distance_mode = True
             return
@@ -66,7 +102,7 @@ class GCodeXYTranslateFilter(GCodeFilter):
                 # the end of the program
                 self.translate_x = self.translate_y = 0
 
-                unsplit(opcode)
+                patch(opcode, 'xy', self.imperial)
                 return opcode
 
             if opcode.x is not None:
@@ -77,5 +113,5 @@ class GCodeXYTranslateFilter(GCodeFilter):
                 opcode.y -= self.translate_y
                 self.translate_y = 0
 
-            unsplit(opcode)
+            patch(opcode, 'xy', self.imperial)
             return opcode
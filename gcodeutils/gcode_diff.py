@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""report the semantic differences between two gcode programs"""
+from __future__ import print_function
+
+import argparse
+import io
+import itertools
+import logging
+import sys
+
+from gcodeutils.bgcode import is_bgcode
+from gcodeutils.compression import MAGIC_SIZE, detect_compression, open_gcode
+from gcodeutils.diff import format_difference, semantic_diff
+from gcodeutils.gcoder import GCode, tokenize
+from gcodeutils.mapped import MappedGCode
+
+__author__ = 'olivier'
+
+
+def load_gcode(filename):
+    """return the program of a file, memory mapped unless it is compressed or binary"""
+    with io.open(filename, 'rb') as gcode_file:
+        head = gcode_file.read(MAGIC_SIZE)
+    if detect_compression(head) is None and not is_bgcode(head):
+        return MappedGCode(filename)
+    with open_gcode(filename) as gcode_file:
+        return GCode(gcode_file, tokenizer=tokenize)
+
+
+def main():
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description='Report the semantic differences between two GCode programs')
+
+    parser.add_argument('file', help='Reference program filename.')
+    parser.add_argument('other_file', help='Program filename compared to the reference one.')
+    parser.add_argument('--max-differences', '-m', type=int, metavar='count',
+                        help='Stop after reporting this many differences.')
+
+    parser.add_argument('--verbose', '-v', action='count', default=1, help='Verbose mode')
+    parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
+
+    args = parser.parse_args()
+
+    # count verbose and quiet flags to determine logging level
+    args.verbose -= args.quiet
+
+    if args.verbose > 1:
+        logging.root.setLevel(logging.DEBUG)
+    elif args.verbose > 0:
+        logging.root.setLevel(logging.INFO)
+
+    logging.basicConfig(format="%(levelname)s:%(message)s")
+
+    gcode = load_gcode(args.file)
+    other = load_gcode(args.other_file)
+
+    differences = itertools.islice(semantic_diff(gcode, other), args.max_differences)
+    count = 0
+    for count, difference in enumerate(differences, 1):
+        print(format_difference(difference))
+
+    logging.info("%d difference(s) found" % count)
+    sys.exit(1 if count else 0)
+
+
+if __name__ == "__main__":
+    main()
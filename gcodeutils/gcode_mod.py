@@ -7,16 +7,19 @@ from __future__ import division
 import argparse
 import logging
 import sys
+from gcodeutils.filter.pipeline import FilterPipeline
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
 
 from gcodeutils.filter.translate import GCodeXYTranslateFilter
 
-from gcodeutils.visit.iterator import GCodeIterator
+from gcodeutils.visit.iterator import GCodeStreamIterator
 from gcodeutils.visit.pause_at_layer import PauseAtLayer
 
 __author__ = 'Olivier Jolly <olivier@pcedev.com>, Joe Friedrichsen <wireddown@users.noreply.github.com>'
 
-from gcodeutils.gcoder import GCode
+from gcodeutils.compression import GCodeFileType, carry_metadata, close_gcode
+from gcodeutils.gcoder import GCodeStream, tokenize
+from gcodeutils.stats import Stats, stage
 
 
 def main():
@@ -32,11 +35,18 @@ def main():
     parser.add_argument('-p', type=int, metavar='layer',
                         help='Pause the gcode program at layer <layer>.')
 
-    parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+    parser.add_argument('infile', nargs='?', type=GCodeFileType('r'), default='-',
                         help='Program filename to be modified. Defaults to standard input.')
-    parser.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout,
+    parser.add_argument('outfile', nargs='?', type=GCodeFileType('w'), default=sys.stdout,
                         help='Modified program. Defaults to standard output.')
 
+    parser.add_argument('--stats', metavar='json',
+                        help='Write the duration, lines and memory peak of each processing stage (including each '
+                             'filter, without memory peak) as JSON to this file, - for the standard error.')
+    parser.add_argument('--stats-memory', action='store_true',
+                        help='Trace the memory allocated by each stage in the statistics, which slows processing '
+                             'down a lot.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1,
                         help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
@@ -53,22 +63,44 @@ def main():
 
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
-    # read original GCode
-    gcode = GCode(args.infile.readlines())
+    stats = Stats(args.stats_memory) if args.stats else None
+    if stats is not None:
+        stats.start()
+
+    # read original GCode lazily, so that only the layer being modified is kept in memory
+    gcode = GCodeStream(args.infile, stats=stats, tokenizer=tokenize)
+
+    # filters are chained so that each line is filtered in a single pass
+    filters = FilterPipeline(stats=stats)
 
     if args.x is not None or args.y is not None:
-        GCodeXYTranslateFilter(**vars(args)).filter(gcode)
+        filters.add(GCodeXYTranslateFilter(**vars(args)))
 
     if args.e:
-        GCodeToRelativeExtrusionFilter().filter(gcode)
+        filters.add(GCodeToRelativeExtrusionFilter())
+
+    if filters:
+        gcode.add_filter(filters)
 
-    iterator = GCodeIterator(gcode)
     if args.p is not None:
+        iterator = GCodeStreamIterator(gcode)
         visitor = PauseAtLayer([args.p])
         iterator.accept(visitor)
 
-    # write back modified gcode
-    gcode.write(args.outfile)
+    # write back modified gcode, layers are read and modified on the fly (the write stage only counting the
+    # time spent outside of reading and modifying them)
+    carry_metadata(args.infile, args.outfile)
+    with stage(stats, 'write'):
+        try:
+            gcode.write(args.outfile)
+        finally:
+            close_gcode(args.outfile)
+            close_gcode(args.infile)
+
+    if stats is not None:
+        stats['write'].lines = stats['preprocess'].lines
+        stats.stop()
+        stats.save(args.stats)
 
 
 if __name__ == "__main__":
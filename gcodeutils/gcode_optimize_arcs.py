@@ -3,8 +3,11 @@ import logging
 import sys
 
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
-from gcodeutils.gcoder import GCode
+from gcodeutils.cache import parse_gcode
+from gcodeutils.compression import GCodeFileType, carry_metadata, close_gcode, open_gcode
 from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.parallel import filter_parallel
+from gcodeutils.stats import Stats, run_filter, stage
 
 __author__ = 'Eyck Jentzsch <eyck@jepemuc.de>'
 
@@ -13,12 +16,24 @@ def main():
     """command line entry point"""
     parser = argparse.ArgumentParser(description='Modify GCode program to account arcs and replace the G1 with G2/G3')
 
-    parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+    parser.add_argument('infile', nargs='?', default='-',
                         help='Program filename to be modified. Defaults to standard input.')
-    parser.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout,
+    parser.add_argument('outfile', nargs='?', type=GCodeFileType('w'), default=sys.stdout,
                         help='Modified program. Defaults to standard output.')
     parser.add_argument('--inplace', '-i', action='store_true', help='Modify file inplace')
 
+    parser.add_argument('--cache-dir', metavar='directory',
+                        help='Directory caching parsed programs to skip parsing on later runs.')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='processes',
+                        help='Number of processes filtering layers in parallel, 0 for as many as CPUs. '
+                             'Defaults to %(default)s.')
+    parser.add_argument('--stats', metavar='json',
+                        help='Write the duration, lines and memory peak of each processing stage as JSON to this '
+                             'file, - for the standard error.')
+    parser.add_argument('--stats-memory', action='store_true',
+                        help='Trace the memory allocated by each stage in the statistics, which slows processing '
+                             'down a lot.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1, help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
 
@@ -34,17 +49,38 @@ def main():
 
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
+    stats = Stats(args.stats_memory) if args.stats else None
+    if stats is not None:
+        stats.start()
+
     # read original GCode
-    gcode = GCode(args.infile.readlines())  # pylint: disable=redefined-outer-name
+    with stage(stats, 'read') as reading, open_gcode(args.infile) as infile:
+        raws = infile.readlines()
+        reading.lines += len(raws)
+    gcode = parse_gcode(raws, args.cache_dir, stats)  # pylint: disable=redefined-outer-name
 
     # First convert to relative extrusion
     # GCodeToRelativeExtrusionFilter().filter(gcode)
 
     # Then perform the stretching
-    GCodeArcOptimizerFilter().filter(gcode)
+    if args.jobs == 1:
+        run_filter(stats, GCodeArcOptimizerFilter(), gcode)
+    else:
+        with stage(stats, 'GCodeArcOptimizerFilter', len(gcode)):
+            filter_parallel(gcode, GCodeArcOptimizerFilter(), args.jobs or None)
 
     # write back modified gcode
-    gcode.write(open(args.infile.name, 'w') if args.inplace is True and args.infile != sys.stdin else args.outfile)
+    outfile = open_gcode(args.infile, 'w') if args.inplace is True and args.infile != '-' else args.outfile
+    carry_metadata(infile, outfile)
+    with stage(stats, 'write', len(gcode)):
+        try:
+            gcode.write(outfile)
+        finally:
+            close_gcode(outfile)
+
+    if stats is not None:
+        stats.stop()
+        stats.save(args.stats)
 
 
 if __name__ == "__main__":
@@ -3,7 +3,10 @@ import logging
 import sys
 
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
-from gcodeutils.gcoder import GCode
+from gcodeutils.cache import parse_gcode
+from gcodeutils.compression import GCodeFileType, carry_metadata, close_gcode
+from gcodeutils.parallel import filter_parallel
+from gcodeutils.stats import Stats, run_filter, stage
 from gcodeutils.stretch.stretch import Slic3rStretchFilter, CuraStretchFilter
 
 __author__ = 'olivier'
@@ -22,9 +25,9 @@ def main():
     """command line entry point"""
     parser = argparse.ArgumentParser(description='Modify GCode program to account for stretch and improve hole size')
 
-    parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+    parser.add_argument('infile', nargs='?', type=GCodeFileType('r'), default='-',
                         help='Program filename to be modified. Defaults to standard input.')
-    parser.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout,
+    parser.add_argument('outfile', nargs='?', type=GCodeFileType('w'), default=sys.stdout,
                         help='Modified program. Defaults to standard output.')
 
     parser.add_argument('--cross_limit_distance_over_edge_width', type=float, default=5.0,
@@ -47,6 +50,18 @@ def main():
                         help='Stretching stretch factor. This is the first setting you\'ll want to change to '
                              'modify the hole size')
 
+    parser.add_argument('--cache-dir', metavar='directory',
+                        help='Directory caching parsed programs to skip parsing on later runs.')
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='processes',
+                        help='Number of processes filtering layers in parallel, 0 for as many as CPUs. '
+                             'Defaults to %(default)s.')
+    parser.add_argument('--stats', metavar='json',
+                        help='Write the duration, lines and memory peak of each processing stage as JSON to this '
+                             'file, - for the standard error.')
+    parser.add_argument('--stats-memory', action='store_true',
+                        help='Trace the memory allocated by each stage in the statistics, which slows processing '
+                             'down a lot.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1,
                         help='Verbose mode')
     parser.add_argument('--quiet', '-q', action='count', default=0, help='Quiet mode')
@@ -63,20 +78,42 @@ def main():
 
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
+    stats = Stats(args.stats_memory) if args.stats else None
+    if stats is not None:
+        stats.start()
+
     # read original GCode
-    gcode = GCode(args.infile.readlines())  # pylint: disable=redefined-outer-name
+    with stage(stats, 'read') as reading:
+        raws = args.infile.readlines()
+        reading.lines += len(raws)
+    gcode = parse_gcode(raws, args.cache_dir, stats)  # pylint: disable=redefined-outer-name
 
     # First convert to relative extrusion
-    GCodeToRelativeExtrusionFilter().filter(gcode)
+    run_filter(stats, GCodeToRelativeExtrusionFilter(), gcode)
 
     # Then perform the stretching
     if is_cura_gcode(gcode):
-        CuraStretchFilter(**vars(args)).filter(gcode)
+        stretch_filter = CuraStretchFilter(**vars(args))
+    else:
+        stretch_filter = Slic3rStretchFilter(**vars(args))
+    if args.jobs == 1:
+        run_filter(stats, stretch_filter, gcode)
     else:
-        Slic3rStretchFilter(**vars(args)).filter(gcode)
+        with stage(stats, type(stretch_filter).__name__, len(gcode)):
+            filter_parallel(gcode, stretch_filter, args.jobs or None)
 
     # write back modified gcode
-    gcode.write(args.outfile)
+    carry_metadata(args.infile, args.outfile)
+    with stage(stats, 'write', len(gcode)):
+        try:
+            gcode.write(args.outfile)
+        finally:
+            close_gcode(args.outfile)
+            close_gcode(args.infile)
+
+    if stats is not None:
+        stats.stop()
+        stats.save(args.stats)
 
 
 if __name__ == "__main__":
@@ -10,7 +10,10 @@ import sys
 
 __author__ = 'Olivier Jolly <olivier@pcedev.com>'
 
-from gcoder import GCode  # pylint: disable=relative-import
+from gcodeutils.cache import parse_gcode
+from gcodeutils.compression import GCodeFileType, carry_metadata, close_gcode
+from gcodeutils.stats import Stats, stage
+from gcodeutils.writer import GCodeWriter
 
 
 class GCodeTempGradient(object):  # pylint: disable=too-many-instance-attributes
@@ -80,27 +83,27 @@ class GCodeTempGradient(object):  # pylint: disable=too-many-instance-attributes
         self._parse_gcode()
 
         # spit back the original GCode with temperature GCode injected accordingly to their Z
-        for layer_idx, layer in enumerate(self.gcode.all_layers):
+        with GCodeWriter(output_file) as writer:
+            for layer_idx, layer in enumerate(self.gcode.all_layers):
 
-            if layer:
-                self.current_z = layer[0].current_z
+                if layer:
+                    self.current_z = layer[0].current_z
 
-                if self.current_z and self.zmin <= self.current_z <= self.zmax:
+                    if self.current_z and self.zmin <= self.current_z <= self.zmax:
 
-                    raw_target_temp = self.get_temp_for_current_layer()
-                    if raw_target_temp is not None:
-                        target_temp = round(raw_target_temp, 1)
+                        raw_target_temp = self.get_temp_for_current_layer()
+                        if raw_target_temp is not None:
+                            target_temp = round(raw_target_temp, 1)
 
-                        # don't generate temperature change if same as last layer
-                        if target_temp != self.last_target_temperature:
-                            self.last_target_temperature = target_temp
+                            # don't generate temperature change if same as last layer
+                            if target_temp != self.last_target_temperature:
+                                self.last_target_temperature = target_temp
 
-                            logging.debug("target temp for layer #%d (height %.2fmm) is %.1f°C", layer_idx,
-                                          self.current_z, target_temp)
-                            print(self.generate_temperature_gcode(target_temp), file=output_file)
+                                logging.debug("target temp for layer #%d (height %.2fmm) is %.1f°C", layer_idx,
+                                              self.current_z, target_temp)
+                                writer.write_line(self.generate_temperature_gcode(target_temp))
 
-                for line in layer:
-                    print(line.raw, file=output_file)
+                    writer.write_layer(layer)
 
     def get_temp_for_current_layer(self):
         """return the target temperature for the current Z (as found in self.current_z)"""
@@ -151,9 +154,9 @@ def main():
                         help='End temperature for the gcode program. Usually lower than the initial temperature. '
                              'Make sure that your material can be still be extruded at this temperature '
                              'to avoid clogging your extruder.')
-    parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+    parser.add_argument('infile', nargs='?', type=GCodeFileType('r'), default='-',
                         help='Program filename to be modified. Defaults to standard input.')
-    parser.add_argument('outfile', nargs='?', type=argparse.FileType('w'), default=sys.stdout,
+    parser.add_argument('outfile', nargs='?', type=GCodeFileType('w'), default=sys.stdout,
                         help='Modified program with temperature gradient. Defaults to standard output.')
 
     parser.add_argument('--min_z_change', '-z', type=float, default=0.1,
@@ -173,6 +176,15 @@ def main():
                                           'gradient generation model. Defaults to %(default)s steps. This setting is '
                                           'not used when using the continuous gradient generation model.')
 
+    parser.add_argument('--cache-dir', metavar='directory',
+                        help='Directory caching parsed programs to skip parsing on later runs.')
+    parser.add_argument('--stats', metavar='json',
+                        help='Write the duration, lines and memory peak of each processing stage as JSON to this '
+                             'file, - for the standard error.')
+    parser.add_argument('--stats-memory', action='store_true',
+                        help='Trace the memory allocated by each stage in the statistics, which slows processing '
+                             'down a lot.')
+
     parser.add_argument('--verbose', '-v', action='count', default=1,
                         help='Verbose mode. It notably outputs the mapping between temperature and height if you have '
                              'troubles figuring it out.')
@@ -190,12 +202,29 @@ def main():
 
     logging.basicConfig(format="%(levelname)s:%(message)s")
 
+    stats = Stats(args.stats_memory) if args.stats else None
+    if stats is not None:
+        stats.start()
+
     # read original GCode
-    gcode = GCode(args.infile.readlines())
+    with stage(stats, 'read') as reading:
+        raws = args.infile.readlines()
+        reading.lines += len(raws)
+    gcode = parse_gcode(raws, args.cache_dir, stats)
 
     # Alter and write back modified GCode
     temp_gradient = args.gcode_grad_class(gcode=gcode, **vars(args))
-    temp_gradient.write(args.outfile)
+    carry_metadata(args.infile, args.outfile)
+    with stage(stats, 'write', len(gcode)):
+        try:
+            temp_gradient.write(args.outfile)
+        finally:
+            close_gcode(args.outfile)
+            close_gcode(args.infile)
+
+    if stats is not None:
+        stats.stop()
+        stats.save(args.stats)
 
 
 if __name__ == "__main__":
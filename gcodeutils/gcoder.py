@@ -19,18 +19,32 @@ from __future__ import print_function
 import sys
 import math
 import datetime
+import bisect
 import logging
 from array import array
+from collections import namedtuple
 
 import re
 
+from gcodeutils.stats import stage
+from gcodeutils.writer import GCodeWriter
+
 gcode_parsed_args = ["x", "y", "e", "f", "z", "i", "j"]
 gcode_parsed_nonargs = ["g", "t", "m", "n"]
 to_parse = "".join(gcode_parsed_args + gcode_parsed_nonargs)
+# characters of the numbers matched by gcode_exp
+number_characters = "0123456789.+-"
 gcode_exp = re.compile("\([^\(\)]*\)|^\(.*\)$|;.*|[/\*].*\n|([%s])([-+]?[0-9]*\.?[0-9]*)" % to_parse)
 gcode_strip_comment_exp = re.compile("\([^\(\)]*\)|;.*|[/\*].*\n")
 m114_exp = re.compile("\([^\(\)]*\)|[/\*].*\n|([XYZ]):?([-+]?[0-9]*\.?[0-9]*)")
 specific_exp = "(?:\([^\(\)]*\))|(?:;.*)|(?:[/\*].*\n)|(%s[-+]?[0-9]*\.?[0-9]*)"
+# layer height announced in comments by slicers, eg ";Layer height: 0.2" (Cura), "; layer_height = 0.2" (Slic3r),
+# ";   layerHeight,0.2" (Simplify3D) or "(<layerHeight> 0.2 </layerHeight>)" (Skeinforge)
+layer_height_hint_exp = re.compile("^[;(]\s*<?layer[ _]?height>?\s*[:=,]?\s*([0-9]*\.?[0-9]+)", re.IGNORECASE)
+# lines at the end of programs searched for the layer height hint before preprocessing, Slic3r and PrusaSlicer
+# writing their configuration there
+LAYER_HEIGHT_HINT_TAIL = 1000
+parameter_exp = re.compile("(?:\([^\(\)]*\))|(?:;.*)|(?:[/\*].*\n)|([A-Z])([-+]?[0-9]*\.?[0-9]*)")
 move_gcodes = ["G0", "G1", "G2", "G3"]
 linear_move_gcodes = ["G0", "G1"]
 gcode_possible_arguments = ['x', 'y', 'z', 'e', 'f', 'i', 'j']
@@ -38,10 +52,25 @@ gcode_possible_arguments = ['x', 'y', 'z', 'e', 'f', 'i', 'j']
 GCODE_ABSOLUTE_POSITIONING_COMMAND = 'G90'
 GCODE_RELATIVE_POSITIONING_COMMAND = 'G91'
 GCODE_SET_POSITION_COMMAND = 'G92'
+GCODE_INCHES_COMMAND = 'G20'
+GCODE_MILLIMETERS_COMMAND = 'G21'
 
 GCODE_ABSOLUTE_EXTRUSION_COMMAND = 'M82'
 GCODE_RELATIVE_EXTRUSION_COMMAND = 'M83'
 
+# machine state carried from line to line by GCode._preprocess
+GCodeState = namedtuple('GCodeState', ['imperial', 'relative', 'relative_e', 'current_tool', 'current_f',
+                                       'current_x', 'current_y', 'current_z', 'offset_x', 'offset_y', 'offset_z',
+                                       'current_e', 'offset_e', 'total_e', 'max_e'])
+
+# whole preprocessing state (machine state, dimensions, duration and layering) before the first line of a layer,
+# from which GCode._preprocess_layers can be resumed
+PreprocessSnapshot = namedtuple('PreprocessSnapshot', GCodeState._fields + (
+    'cur_layer_has_extrusion', 'xmin', 'ymin', 'xmax', 'ymax', 'xmin_e', 'ymin_e', 'xmax_e', 'ymax_e',
+    'lastx', 'lasty', 'lastz', 'laste', 'lastf', 'lastdx', 'lastdy', 'totalduration', 'layerbeginduration',
+    'layer_id', 'layer_line', 'last_layer_z', 'prev_z', 'prev_base_z', 'cur_z', 'cur_layer_state',
+    'est_layer_height', 'layer_height', 'zs_count'))
+
 
 class PyLine(object):
     __slots__ = ('x', 'y', 'z', 'e', 'f', 'i', 'j',
@@ -49,12 +78,18 @@ class PyLine(object):
                  'relative', 'relative_e',
                  'current_x', 'current_y', 'current_z', 'extruding',
                  'current_tool', 'current_f', 'current_e',
-                 'gcview_end_vertex')
+                 'gcview_end_vertex', 'parameters_memo')
 
     EQ_EPSILON = 1e-3
 
     def __init__(self, l=None):
         self.raw = l
+        # unset slots would be read through __getattr__, much slower than initialized ones
+        self.x = self.y = self.z = self.e = self.f = self.i = self.j = None
+        self.command = self.is_move = self.relative = self.relative_e = None
+        self.current_x = self.current_y = self.current_z = self.extruding = None
+        self.current_tool = self.current_f = self.current_e = None
+        self.gcview_end_vertex = self.parameters_memo = None
 
     def __getattr__(self, name):
         return None
@@ -119,7 +154,50 @@ Line = PyLine
 LightLine = PyLightLine
 
 
+def parameters(line):
+    """return a dict of the parameters of a line, the first value of each upper case letter outside comments
+    (None when the letter has no value), including the command one (eg {'M': 104., 'S': 200.}).
+
+    The result is memoized in the line until its raw representation changes."""
+    memo = line.parameters_memo
+    raw = line.raw
+    if memo is not None and memo[0] is raw:
+        return memo[1]
+    values = {}
+    for code, value in parameter_exp.findall(raw):
+        if code and code not in values:
+            try:
+                values[code] = float(value)
+            except ValueError:
+                values[code] = None
+    try:
+        line.parameters_memo = (raw, values)
+    except AttributeError:
+        # light lines have no room for the memo
+        pass
+    return values
+
+
+def parameter(line, code):
+    """return the value of a single letter parameter of a line, None if absent"""
+    return parameters(line).get(code)
+
+
+def parameter_values(lines, command, code):
+    """return the values of a parameter for all lines with the given command (eg all M104 S values), in a
+    single pass over lines"""
+    values = []
+    for line in lines:
+        if line.command == command:
+            value = parameters(line).get(code)
+            if value is not None:
+                values.append(value)
+    return values
+
+
 def find_specific_code(line, code):
+    if len(code) == 1:
+        return parameter(line, code)
     exp = specific_exp % code
     bits = [bit for bit in re.findall(exp, line.raw) if bit]
     if not bits:
@@ -129,11 +207,19 @@ def find_specific_code(line, code):
 
 
 def S(line):
-    return find_specific_code(line, "S")
+    return parameter(line, "S")
 
 
 def P(line):
-    return find_specific_code(line, "P")
+    return parameter(line, "P")
+
+
+def R(line):
+    return parameter(line, "R")
+
+
+def T(line):
+    return parameter(line, "T")
 
 
 def raw_to_line(raw):
@@ -171,6 +257,126 @@ def unsplit(line):
     line.raw = line.command + format.format(*arg)
 
 
+def _patched_value(value, original, code):
+    """format value with the number of decimals of the original word, unless it loses precision compared
+    to the unsplit formatting (also used for new words, without original)"""
+    precision = 5 if code == 'e' else 3
+    if original is None:
+        return "%.*f" % (precision, value)
+    decimals = len(original) - original.index('.') - 1 if '.' in original else 0
+    text = "%.*f" % (decimals, value)
+    if math.fabs(float(text) - value) > 0.5 * 10 ** -precision:
+        text = "%.*f" % (max(decimals, precision), value)
+    return text
+
+
+def checksum(text):
+    """return the checksum of a line sent to a printer, the xor of the characters preceding its *"""
+    result = 0
+    for character in bytearray(text.encode('ascii', 'replace')):
+        result ^= character
+    return result
+
+
+def _unsplit_changed(line, codes, imperial):
+    """regenerate line.raw with unsplit, unless neither its command nor its codes arguments differ from the
+    ones parsed from line.raw"""
+    original = Line(line.raw)
+    parse_coordinates(original, split(original), imperial)
+    if original.command != line.command or any(getattr(original, code) != getattr(line, code) for code in codes):
+        unsplit(line)
+
+
+def patch(line, codes=None, imperial=False):
+    """Minimal rewrite of line.raw after its command or arguments have been modified.
+
+    Only the numbers of the arguments whose value changed are rewritten, keeping their number of decimals;
+    arguments set to None are removed and new arguments are added after the last word. Comments, unknown
+    words and spacing are preserved. codes restricts the patched arguments to the given letters (eg 'xy'),
+    by default every argument is compared to its raw value. Words are located when patching, so that
+    parsing doesn't have to keep their positions for every line. Lines which can't be patched (non G
+    commands, parenthesis comments, tabs or glued words) are regenerated by unsplit, without line number nor
+    checksum, when their command or one of the codes arguments changed. The checksum (*NN) of a modified line is
+    computed again. imperial tells whether the line is in inches (G20), its arguments being in millimeters."""
+    if codes is None:
+        codes = gcode_possible_arguments
+    raw = line.raw
+    if not raw or line.command is None:
+        return
+    code_end = raw.find(';')
+    if code_end < 0:
+        code_end = len(raw)
+    code_part = raw[:code_end].rstrip()
+    if line.command[0] != 'G' or '(' in code_part or '\t' in code_part:
+        _unsplit_changed(line, codes, imperial)
+        return
+    checksum_start = code_part.find('*')
+    if checksum_start < 0:
+        words_part = code_part
+    else:
+        words_part = code_part[:checksum_start].rstrip()
+        checksum_separator = code_part[len(words_part):checksum_start]
+    # single space separators, repeated spaces giving empty words, so that joining words restores the spacing
+    words = words_part.split(' ')
+
+    first = 0
+    while first < len(words) and (not words[first] or words[first][0] in 'Nn'):
+        first += 1
+    if first == len(words) or words[first][0] not in 'Gg' or not words[first][1:].isdigit():
+        _unsplit_changed(line, codes, imperial)
+        return
+    changed = False
+    if words[first][0].upper() + words[first][1:] != line.command:
+        words[first] = line.command
+        changed = True
+
+    indexes = {}
+    for index in range(first + 1, len(words)):
+        word = words[index]
+        if word and word[0].lower() in codes:
+            indexes[word[0].lower()] = index
+
+    unit_factor = 25.4 if imperial else 1
+    for code in codes:
+        value = getattr(line, code)
+        index = indexes.get(code)
+        if index is None:
+            if value is not None:
+                words.append(code.upper() + _patched_value(value / unit_factor, None, code))
+                changed = True
+            continue
+        if value is None:
+            words[index] = None
+            changed = True
+            continue
+        original = words[index][1:]
+        try:
+            if unit_factor * float(original) == value:
+                continue
+        except ValueError:
+            # glued words, eg X10Y20
+            _unsplit_changed(line, codes, imperial)
+            return
+        words[index] = words[index][0] + _patched_value(value / unit_factor, original, code)
+        changed = True
+
+    if changed:
+        patched = " ".join(word for word in words if word is not None)
+        if checksum_start >= 0:
+            patched += checksum_separator
+            patched += '*%d' % checksum(patched)
+        line.raw = patched + raw[len(code_part):]
+
+
+def layer_height_hint(lines):
+    """return the first positive layer height announced by a slicer comment of lines, None if there is none"""
+    for line in lines:
+        hint = layer_height_hint_exp.match(line.raw)
+        if hint and float(hint.group(1)) > 0:
+            return float(hint.group(1))
+    return None
+
+
 def parse_coordinates(line, split_raw, imperial=False, force=False):
     # Not a G-line, we don't want to parse its arguments
     if line.command is None:
@@ -184,22 +390,97 @@ def parse_coordinates(line, split_raw, imperial=False, force=False):
             setattr(line, code, unit_factor * float(bit[1]))
 
 
+def tokenize(line, imperial=False):
+    """Single pass equivalent of split followed by parse_coordinates.
+
+    Well formed lines (upper case words separated by spaces, with an optional ';' comment) are handled
+    by splitting the raw line once and converting the argument words straight into the line attributes.
+    Anything else (parenthesis comments, line numbers, lower case, glued words, imperial units) goes
+    through split and parse_coordinates, as do words whose number isn't plain decimal (eg X1e3, which split reads
+    as X1 E3)."""
+    raw = line.raw
+    words = raw.split(';', 1)[0].split()
+    if not words:
+        line.is_move = False
+        return
+    command = words[0]
+    if imperial or '(' in raw or command[0] not in 'GMT' or not command[1:].isdigit():
+        parse_coordinates(line, split(line), imperial)
+        return
+    line.command = command
+    line.is_move = command in move_gcodes
+    if command[0] != 'G':
+        return
+    try:
+        for word in words[1:]:
+            value = word[1:]
+            # python floats also accept exponents, inf, nan and underscores
+            if value.strip(number_characters):
+                raise ValueError(word)
+            code = word[0]
+            if code == 'X':
+                line.x = float(value)
+            elif code == 'Y':
+                line.y = float(value)
+            elif code == 'E':
+                line.e = float(value)
+            elif code == 'Z':
+                line.z = float(value)
+            elif code == 'F':
+                line.f = float(value)
+            elif code == 'I':
+                line.i = float(value)
+            elif code == 'J':
+                line.j = float(value)
+            elif code in to_parse:
+                raise ValueError(word)
+    except ValueError:
+        for bit in gcode_possible_arguments:
+            setattr(line, bit, None)
+        parse_coordinates(line, split(line), imperial)
+
+
 class Layer(list):
-    __slots__ = ("duration", "z")
+    __slots__ = ("duration", "z", "state", "snapshot")
 
     def __init__(self, lines, z=None):
         super(Layer, self).__init__(lines)
         self.z = z
+        # GCodeState before the first line of the layer, when recorded
+        self.state = None
+        # PreprocessSnapshot before the first line of the layer, when recorded
+        self.snapshot = None
+
+    def spatial_index(self, start=None, cell_size=None):
+        """return a grid index of the moves of the layer (see gcodeutils.spatial), the toolhead being at the
+        (x, y) start position before its first line, by default the one of the recorded state if any"""
+        from gcodeutils.spatial import DEFAULT_CELL_SIZE, LayerSpatialIndex
+        if start is None and self.state is not None:
+            start = (self.state.current_x, self.state.current_y)
+        return LayerSpatialIndex(self, start, cell_size or DEFAULT_CELL_SIZE)
+
+    def preprocess(self, home_pos=None, tokenizer=None):
+        """preprocess the lines of the layer on their own (positions, modes and extrusion of each line), starting
+        from its recorded state rather than replaying the previous layers, return the GCodeState after its last
+        line"""
+        if self.state is None:
+            raise ValueError("the state before the layer has not been recorded")
+        parser = GCode(deferred=True, tokenizer=tokenizer)
+        parser.home_pos = home_pos
+        parser._set_state(self.state)
+        if self:
+            parser._preprocess(self)
+        return parser._get_state()
 
 
 class GCode(object):
     line_class = Line
+    # function parsing a line in place given the imperial mode (eg tokenize, to be wrapped in a
+    # staticmethod when set in a subclass), None to use split and parse_coordinates
+    tokenizer = None
 
-    lines = None
     layers = None
     all_layers = None
-    layer_idxs = None
-    line_idxs = None
     append_layer = None
     append_layer_id = None
 
@@ -249,6 +530,15 @@ class GCode(object):
     height = None
 
     est_layer_height = None
+    # layer height to use rather than estimating est_layer_height from the z of the first layers, either
+    # given or, with slicer_hints, found in a slicer comment: in the last LAYER_HEIGHT_HINT_TAIL lines of the
+    # program, searched before preprocessing (except for streams), or in a comment preceding the first layers
+    layer_height = None
+    slicer_hints = False
+    # Stats recording the parse and preprocess stages, see gcodeutils.stats
+    stats = None
+    # Progress reporting parsing, preprocessing and filtering, see gcodeutils.progress
+    progress = None
 
     # abs_x is the current absolute X in machine current coordinate system
     # (after the various G92 transformations) and can be used to store the
@@ -297,8 +587,116 @@ class GCode(object):
 
     layers_count = property(_get_layers_count)
 
+    # lines and their (layer index, line index in layer) are global indexes of all_layers, rebuilt when
+    # accessed after layers have been edited, so that editing many layers stays linear
+    _lines = None
+    _layer_idxs = None
+    _line_idxs = None
+    _indexes_dirty = False
+
+    # index of the first layer whose lines have been modified since they were preprocessed
+    _first_dirty_layer = None
+    _zs_added = None
+
+    def invalidate_indexes(self):
+        """to be called after modifying all_layers, so that lines, layer_idxs and line_idxs get rebuilt"""
+        self._indexes_dirty = True
+
+    def mark_dirty(self, layer_idx=0):
+        """to be called after modifying the lines of a layer: indexes get rebuilt lazily and refresh
+        preprocesses the lines again from this layer onward"""
+        if self._first_dirty_layer is None or layer_idx < self._first_dirty_layer:
+            self._first_dirty_layer = layer_idx
+        self.invalidate_indexes()
+
+    def refresh(self):
+        """recompute what preprocessing derives from the lines (positions and extrusion of lines, layers, layers
+        count, dimensions, filament length and duration) after layers have been marked dirty.
+
+        Preprocessing resumes from the snapshot recorded at the start of the first dirty layer, in the tail of
+        the previous layer, the layers before that one being kept as they are; it starts over when no snapshot
+        is available (first layer, layers not built by preprocessing)."""
+        first_dirty_layer = self._first_dirty_layer
+        if first_dirty_layer is None:
+            return
+        self._first_dirty_layer = None
+
+        append_lines = list(self.append_layer)
+        resume_layer = min(first_dirty_layer, self.append_layer_id - 1)
+        if resume_layer > 0 and self.all_layers[resume_layer].snapshot is not None:
+            lines = [line for layer in self.all_layers[resume_layer:self.append_layer_id] for line in layer]
+        else:
+            resume_layer = None
+            lines = [line for layer in self.all_layers[:self.append_layer_id] for line in layer]
+            # start over from the initial state
+            self._set_state(GCodeState._make(getattr(type(self), name) for name in GCodeState._fields))
+            self.est_layer_height = type(self).est_layer_height
+
+        if lines:
+            self._preprocess(lines, build_layers=True, resume_layer=resume_layer)
+        else:
+            self.prepare(home_pos=self.home_pos)
+        if append_lines:
+            self._preprocess(append_lines)
+            self.append_layer.extend(append_lines)
+        self.invalidate_indexes()
+
+    def _rebuild_indexes(self):
+        lines = []
+        layer_idxs = array('I')
+        line_idxs = array('I')
+        for layer_idx, layer in enumerate(self.all_layers):
+            lines.extend(layer)
+            layer_idxs.extend(array('I', [layer_idx]) * len(layer))
+            line_idxs.extend(range(len(layer)))
+        self._lines = lines
+        self._layer_idxs = layer_idxs
+        self._line_idxs = line_idxs
+        self._indexes_dirty = False
+
+    def _get_lines(self):
+        if self._indexes_dirty:
+            self._rebuild_indexes()
+        return self._lines
+
+    def _set_lines(self, lines):
+        self._lines = lines
+
+    lines = property(_get_lines, _set_lines)
+
+    def _get_layer_idxs(self):
+        if self._indexes_dirty:
+            self._rebuild_indexes()
+        return self._layer_idxs
+
+    def _set_layer_idxs(self, layer_idxs):
+        self._layer_idxs = layer_idxs
+
+    layer_idxs = property(_get_layer_idxs, _set_layer_idxs)
+
+    def _get_line_idxs(self):
+        if self._indexes_dirty:
+            self._rebuild_indexes()
+        return self._line_idxs
+
+    def _set_line_idxs(self, line_idxs):
+        self._line_idxs = line_idxs
+
+    line_idxs = property(_get_line_idxs, _set_line_idxs)
+
     def __init__(self, data=None, home_pos=None,
-                 layer_callback=None, deferred=False, line_callback=None):
+                 layer_callback=None, deferred=False, line_callback=None, tokenizer=None,
+                 layer_height=None, slicer_hints=None, stats=None, progress=None):
+        if tokenizer is not None:
+            self.tokenizer = tokenizer
+        if layer_height is not None:
+            self.layer_height = layer_height
+        if slicer_hints is not None:
+            self.slicer_hints = slicer_hints
+        if stats is not None:
+            self.stats = stats
+        if progress is not None:
+            self.progress = progress
         if not deferred:
             self.prepare(data, home_pos, layer_callback, line_callback)
 
@@ -306,11 +704,22 @@ class GCode(object):
         self.home_pos = home_pos
         if data:
             line_class = self.line_class
-            self.lines = [line_class(l2) for l2 in
-                          (l.strip() for l in data)
-                          if l2]
-            self._preprocess(build_layers=True,
-                             layer_callback=layer_callback, line_callback=line_callback)
+            with stage(self.stats, 'parse') as parsing:
+                if self.progress is None:
+                    self.lines = [line_class(l2) for l2 in
+                                  (l.strip() for l in data)
+                                  if l2]
+                else:
+                    self.lines = []
+                    for batch in self.progress.iter_batches(data, 'parse', len(data) if hasattr(data, '__len__')
+                                                            else None):
+                        self.lines.extend(line_class(l2) for l2 in (l.strip() for l in batch) if l2)
+                parsing.lines += len(self.lines)
+            if self.slicer_hints and self.layer_height is None:
+                self.layer_height = layer_height_hint(self.lines[-LAYER_HEIGHT_HINT_TAIL:])
+            with stage(self.stats, 'preprocess', len(self.lines)):
+                self._preprocess(build_layers=True,
+                                 layer_callback=layer_callback, line_callback=line_callback)
         else:
             self.lines = []
             self.append_layer_id = 0
@@ -327,64 +736,32 @@ class GCode(object):
     def __iter__(self):
         return self.lines.__iter__()
 
+    @staticmethod
+    def _command_lines(commands):
+        """return non move lines for the non empty commands"""
+        glines = []
+        for command in commands:
+            command = command.strip()
+            if command:
+                gline = Line(command)
+                # Split to get command
+                split(gline)
+                # Force is_move to False
+                gline.is_move = False
+                glines.append(gline)
+        return glines
+
     def prepend_to_layer(self, commands, layer_idx):
-        # Prepend commands in reverse order
-        commands = [c.strip() for c in commands[::-1] if c.strip()]
-        layer = self.all_layers[layer_idx]
-        # Find start index to append lines
-        # and end index to append new indices
-        start_index = self.layer_idxs.index(layer_idx)
-        for i in range(start_index, len(self.layer_idxs)):
-            if self.layer_idxs[i] != layer_idx:
-                end_index = i
-                break
-        else:
-            end_index = i + 1
-        end_line = self.line_idxs[end_index - 1]
-        for i, command in enumerate(commands):
-            gline = Line(command)
-            # Split to get command
-            split(gline)
-            # Force is_move to False
-            gline.is_move = False
-            # Insert gline at beginning of layer
-            layer.insert(0, gline)
-            # Insert gline at beginning of list
-            self.lines.insert(start_index, gline)
-            # Update indices arrays & global gcodes list
-            self.layer_idxs.insert(end_index + i, layer_idx)
-            self.line_idxs.insert(end_index + i, end_line + i + 1)
-        return commands[::-1]
+        glines = self._command_lines(commands)
+        self.all_layers[layer_idx][0:0] = glines
+        self.mark_dirty(layer_idx)
+        return [gline.raw for gline in glines]
 
     def rewrite_layer(self, commands, layer_idx):
-        # Prepend commands in reverse order
-        commands = [c.strip() for c in commands[::-1] if c.strip()]
-        layer = self.all_layers[layer_idx]
-        # Find start index to append lines
-        # and end index to append new indices
-        start_index = self.layer_idxs.index(layer_idx)
-        for i in range(start_index, len(self.layer_idxs)):
-            if self.layer_idxs[i] != layer_idx:
-                end_index = i
-                break
-        else:
-            end_index = i + 1
-        self.layer_idxs = self.layer_idxs[:start_index] + array('I', len(commands) * [layer_idx]) + self.layer_idxs[
-                                                                                                    end_index:]
-        self.line_idxs = self.line_idxs[:start_index] + array('I', range(len(commands))) + self.line_idxs[end_index:]
-        del self.lines[start_index:end_index]
-        del layer[:]
-        for i, command in enumerate(commands):
-            gline = Line(command)
-            # Split to get command
-            split(gline)
-            # Force is_move to False
-            gline.is_move = False
-            # Insert gline at beginning of layer
-            layer.insert(0, gline)
-            # Insert gline at beginning of list
-            self.lines.insert(start_index, gline)
-        return commands[::-1]
+        glines = self._command_lines(commands)
+        self.all_layers[layer_idx][:] = glines
+        self.mark_dirty(layer_idx)
+        return [gline.raw for gline in glines]
 
     def append(self, command, store=True):
         command = command.strip()
@@ -393,17 +770,49 @@ class GCode(object):
         gline = Line(command)
         self._preprocess([gline])
         if store:
-            self.lines.append(gline)
             self.append_layer.append(gline)
-            self.layer_idxs.append(self.append_layer_id)
-            self.line_idxs.append(len(self.append_layer))
+            if not self._indexes_dirty:
+                self._lines.append(gline)
+                self._layer_idxs.append(self.append_layer_id)
+                self._line_idxs.append(len(self.append_layer) - 1)
         return gline
 
     def _preprocess(self, lines=None, build_layers=False,
-                    layer_callback=None, line_callback=None):
+                    layer_callback=None, line_callback=None, resume_layer=None):
         """Checks for imperial/relativeness settings and tool changes"""
+        layers = self._preprocess_layers(lines, build_layers, layer_callback, line_callback,
+                                         resume_layer=resume_layer)
+        if build_layers and self.progress is not None:
+            layers = self.progress.iter_layers(layers, 'preprocess', len(lines or self.lines))
+        for _ in layers:
+            pass
+
+    def _get_state(self):
+        return GCodeState._make(getattr(self, name) for name in GCodeState._fields)
+
+    def _set_state(self, state):
+        for name, value in zip(GCodeState._fields, state):
+            setattr(self, name, value)
+
+    def _preprocess_layers(self, lines=None, build_layers=False,
+                           layer_callback=None, line_callback=None, keep_layers=True, record_states=False,
+                           resume_layer=None):
+        """Generator doing the actual preprocessing of _preprocess, yielding layers as soon as they are complete.
+
+        When keep_layers is False, neither the layers nor the line indexes are stored in self, so that
+        lines can be consumed lazily and forgotten once their layer has been handled by the caller.
+        When record_states is True, the GCodeState before the first line of each layer is stored in its
+        state attribute, so that the layer can be preprocessed again on its own.
+        Layers built and kept also get the PreprocessSnapshot before their first line, so that building
+        layers can be resumed from the layer of index resume_layer, given the lines from this layer onward:
+        the previous layers are kept and the line indexes are left to be rebuilt lazily."""
         if not lines:
             lines = self.lines
+        if resume_layer is not None:
+            resume_layers = self.all_layers
+            resume_zs_added = self._zs_added
+            resume = resume_layers[resume_layer].snapshot
+            self._set_state(resume[:len(GCodeState._fields)])
         imperial = self.imperial
         relative = self.relative
         relative_e = self.relative_e
@@ -456,10 +865,21 @@ class GCode(object):
             layerbeginduration = 0.0
 
             # Initialize layers
-            all_layers = self.all_layers = []
             all_zs = self.all_zs = set()
-            layer_idxs = self.layer_idxs = []
-            line_idxs = self.line_idxs = []
+            # z added to all_zs, in order
+            zs_added = self._zs_added = []
+            record_snapshots = keep_layers
+            record_states = record_states or record_snapshots
+            build_indexes = keep_layers and resume_layer is None
+            if keep_layers:
+                all_layers = self.all_layers = []
+            if build_indexes:
+                layer_idxs = self.layer_idxs = []
+                line_idxs = self.line_idxs = []
+            # sorted z of the layers built so far, used to estimate the layer height
+            layer_zs = []
+            layer_height = self.layer_height
+            slicer_hints = self.slicer_hints
 
             layer_id = 0
             layer_line = 0
@@ -470,51 +890,101 @@ class GCode(object):
             cur_z = None
             cur_lines = []
 
+            if record_states:
+                cur_layer_state = (imperial, relative, relative_e, current_tool, current_f,
+                                   current_x, current_y, current_z, offset_x, offset_y, offset_z,
+                                   current_e, offset_e, total_e, max_e)
+            cur_layer_snapshot = None
+
+            if resume_layer is not None:
+                (cur_layer_has_extrusion, xmin, ymin, xmax, ymax, xmin_e, ymin_e, xmax_e, ymax_e,
+                 lastx, lasty, lastz, laste, lastf, lastdx, lastdy, totalduration, layerbeginduration,
+                 layer_id, layer_line, last_layer_z, prev_z, prev_base_z, cur_z, cur_layer_state,
+                 self.est_layer_height, layer_height, zs_count) = resume[len(GCodeState._fields):]
+                self.layer_height = layer_height
+                # keep the layers before the one being built when the snapshot was taken, its lines being
+                # given back to it
+                previous_layers = resume_layers[:resume_layer]
+                all_layers.extend(previous_layers[:layer_id])
+                for layer in previous_layers[layer_id:]:
+                    cur_lines.extend(layer)
+                if layer_id < resume_layer:
+                    cur_layer_snapshot = previous_layers[layer_id].snapshot
+                zs_added.extend(resume_zs_added[:zs_count])
+                all_zs.update(zs_added)
+                if self.est_layer_height is None and layer_height is None:
+                    layer_zs = sorted(layer.z for layer in all_layers if layer.z is not None)
+
         if self.line_class != Line:
             get_line = lambda l: Line(l.raw)
         else:
             get_line = lambda l: l
+        tokenizer = self.tokenizer
+        split_raw = None
         for true_line in lines:
             # # Parse line
             # Use a heavy copy of the light line to preprocess
             line = get_line(true_line)
-            split_raw = split(line)
-            if line.command:
+            if tokenizer is None:
+                split_raw = split(line)
+            else:
+                tokenizer(line, imperial)
+            command = line.command
+            if command:
+                is_move = line.is_move
                 # Update properties
-                if line.is_move:
+                if is_move:
                     line.relative = relative
                     line.relative_e = relative_e
                     line.current_tool = current_tool
-                elif line.command == "G20":
+                elif command == "G20":
                     imperial = True
-                elif line.command == "G21":
+                elif command == "G21":
                     imperial = False
-                elif line.command == "G90":
+                elif command == "G90":
                     relative = False
                     relative_e = False
-                elif line.command == "G91":
+                elif command == "G91":
                     relative = True
                     relative_e = True
-                elif line.command == "M82":
+                elif command == "M82":
                     relative_e = False
-                elif line.command == "M83":
+                elif command == "M83":
                     relative_e = True
-                elif line.command[0] == "T":
-                    current_tool = int(line.command[1:])
+                elif command[0] == "T":
+                    current_tool = int(command[1:])
 
-                if line.command[0] == "G":
+                if tokenizer is None and command[0] == "G":
                     parse_coordinates(line, split_raw, imperial)
+                # arguments read once, as locals
+                line_x = line.x
+                line_y = line.y
+                line_z = line.z
+                line_e = line.e
+                line_f = line.f
+
+                # layers only start on lines with a Z, record the state before them
+                if record_states and line_z is not None:
+                    line_state = (imperial, relative, relative_e, current_tool, current_f,
+                                  current_x, current_y, current_z, offset_x, offset_y, offset_z,
+                                  current_e, offset_e, total_e, max_e)
+                    if record_snapshots:
+                        line_snapshot = line_state + (
+                            cur_layer_has_extrusion, xmin, ymin, xmax, ymax, xmin_e, ymin_e, xmax_e, ymax_e,
+                            lastx, lasty, lastz, laste, lastf, lastdx, lastdy, totalduration, layerbeginduration,
+                            layer_id, layer_line, last_layer_z, prev_z, prev_base_z, cur_z, cur_layer_state,
+                            self.est_layer_height, layer_height, len(zs_added))
 
                 # Compute current position
-                if line.is_move:
-                    x = line.x
-                    y = line.y
-                    z = line.z
+                if is_move:
+                    x = line_x
+                    y = line_y
+                    z = line_z
 
-                    if line.f is not None:
-                        current_f = line.f
+                    if line_f is not None:
+                        current_f = line_f
 
-                    if line.relative:
+                    if relative:
                         x = current_x + (x or 0)
                         y = current_y + (y or 0)
                         z = current_z + (z or 0)
@@ -527,22 +997,22 @@ class GCode(object):
                     if y is not None: current_y = y
                     if z is not None: current_z = z
 
-                elif line.command == "G28":
-                    home_all = not any([line.x, line.y, line.z])
-                    if home_all or line.x is not None:
+                elif command == "G28":
+                    home_all = not any([line_x, line_y, line_z])
+                    if home_all or line_x is not None:
                         offset_x = 0
                         current_x = self.home_x
-                    if home_all or line.y is not None:
+                    if home_all or line_y is not None:
                         offset_y = 0
                         current_y = self.home_y
-                    if home_all or line.z is not None:
+                    if home_all or line_z is not None:
                         offset_z = 0
                         current_z = self.home_z
 
-                elif line.command == "G92":
-                    if line.x is not None: offset_x = current_x - line.x
-                    if line.y is not None: offset_y = current_y - line.y
-                    if line.z is not None: offset_z = current_z - line.z
+                elif command == "G92":
+                    if line_x is not None: offset_x = current_x - line_x
+                    if line_y is not None: offset_y = current_y - line_y
+                    if line_z is not None: offset_z = current_z - line_z
 
                 line.current_x = current_x
                 line.current_y = current_y
@@ -550,49 +1020,58 @@ class GCode(object):
                 line.current_f=current_f
 
                 # # Process extrusion
-                if line.e is not None:
-                    if line.is_move:
-                        if line.relative_e:
-                            line.extruding = line.e > 0
-                            total_e += line.e
-                            current_e += line.e
+                if line_e is not None:
+                    if is_move:
+                        if relative_e:
+                            extruding = line.extruding = line_e > 0
+                            total_e += line_e
+                            current_e += line_e
                         else:
-                            new_e = line.e + offset_e
-                            line.extruding = new_e > current_e
+                            new_e = line_e + offset_e
+                            extruding = line.extruding = new_e > current_e
                             total_e += new_e - current_e
                             current_e = new_e
-                        max_e = max(max_e, total_e)
-                        cur_layer_has_extrusion |= line.extruding
-                    elif line.command == "G92":
-                        offset_e = line.e #current_e - line.e
+                        if total_e > max_e:
+                            max_e = total_e
+                        cur_layer_has_extrusion |= extruding
+                    elif command == "G92":
+                        offset_e = line_e #current_e - line.e
                 line.current_e = current_e
                 # # Create layers and perform global computations
                 if build_layers:
                     # Update bounding box
-                    if line.is_move:
+                    if is_move:
                         if line.extruding:
-                            if line.current_x is not None:
-                                xmin_e = min(xmin_e, line.current_x)
-                                xmax_e = max(xmax_e, line.current_x)
-                            if line.current_y is not None:
-                                ymin_e = min(ymin_e, line.current_y)
-                                ymax_e = max(ymax_e, line.current_y)
+                            if current_x is not None:
+                                if current_x < xmin_e:
+                                    xmin_e = current_x
+                                if current_x > xmax_e:
+                                    xmax_e = current_x
+                            if current_y is not None:
+                                if current_y < ymin_e:
+                                    ymin_e = current_y
+                                if current_y > ymax_e:
+                                    ymax_e = current_y
                         if max_e <= 0:
-                            if line.current_x is not None:
-                                xmin = min(xmin, line.current_x)
-                                xmax = max(xmax, line.current_x)
-                            if line.current_y is not None:
-                                ymin = min(ymin, line.current_y)
-                                ymax = max(ymax, line.current_y)
+                            if current_x is not None:
+                                if current_x < xmin:
+                                    xmin = current_x
+                                if current_x > xmax:
+                                    xmax = current_x
+                            if current_y is not None:
+                                if current_y < ymin:
+                                    ymin = current_y
+                                if current_y > ymax:
+                                    ymax = current_y
 
                     # Compute duration
-                    if line.command == "G0" or line.command == "G1":
-                        x = line.x if line.x is not None else lastx
-                        y = line.y if line.y is not None else lasty
-                        z = line.z if line.z is not None else lastz
-                        e = line.e if line.e is not None else laste
+                    if command == "G0" or command == "G1":
+                        x = line_x if line_x is not None else lastx
+                        y = line_y if line_y is not None else lasty
+                        z = line_z if line_z is not None else lastz
+                        e = line_e if line_e is not None else laste
                         # mm/s vs mm/m => divide by 60
-                        f = line.f / 60.0 if line.f is not None else lastf
+                        f = line_f / 60.0 if line_f is not None else lastf
 
                         # given last feedrate and current feedrate calculate the
                         # distance needed to achieve current feedrate.
@@ -616,10 +1095,10 @@ class GCode(object):
 
                         currenttravel = math.hypot(dx, dy)
                         if currenttravel == 0:
-                            if line.z is not None:
-                                currenttravel = abs(line.z) if line.relative else abs(line.z - lastz)
-                            elif line.e is not None:
-                                currenttravel = abs(line.e) if line.relative_e else abs(line.e - laste)
+                            if line_z is not None:
+                                currenttravel = abs(line_z) if relative else abs(line_z - lastz)
+                            elif line_e is not None:
+                                currenttravel = abs(line_e) if relative_e else abs(line_e - laste)
                         # Feedrate hasn't changed, no acceleration/decceleration planned
                         if f == lastf:
                             moveduration = currenttravel / f if f != 0 else 0.
@@ -647,21 +1126,21 @@ class GCode(object):
                         lastz = z
                         laste = e
                         lastf = f
-                    elif line.command == "G4":
+                    elif command == "G4":
                         moveduration = P(line)
                         if moveduration:
                             moveduration /= 1000.0
                             totalduration += moveduration
 
                     # FIXME : looks like this needs to be tested with "lift Z on move"
-                    if line.z is not None:
-                        if line.command == "G92":
-                            cur_z = line.z
-                        elif line.is_move:
-                            if line.relative and cur_z is not None:
-                                cur_z += line.z
+                    if line_z is not None:
+                        if command == "G92":
+                            cur_z = line_z
+                        elif is_move:
+                            if relative and cur_z is not None:
+                                cur_z += line_z
                             else:
-                                cur_z = line.z
+                                cur_z = line_z
 
                     # FIXME: the logic behind this code seems to work, but it might be
                     # broken
@@ -669,9 +1148,10 @@ class GCode(object):
                         if prev_z is not None and last_layer_z is not None:
                             offset = self.est_layer_height if self.est_layer_height else 0.01
                             if abs(prev_z - last_layer_z) < offset:
-                                if self.est_layer_height is None:
-                                    zs = sorted([l.z for l in all_layers if l.z is not None])
-                                    heights = [round(zs[i + 1] - zs[i], 3) for i in range(len(zs) - 1)]
+                                if self.est_layer_height is None and layer_height is not None:
+                                    self.est_layer_height = layer_height
+                                elif self.est_layer_height is None:
+                                    heights = [round(z2 - z1, 3) for z1, z2 in zip(layer_zs, layer_zs[1:])]
                                     heights = [height for height in heights if height]
                                     if len(heights) >= 2:
                                         self.est_layer_height = heights[1]
@@ -687,25 +1167,42 @@ class GCode(object):
 
                         if base_z != prev_base_z:
                             new_layer = Layer(cur_lines, base_z)
+                            if record_states:
+                                new_layer.state = GCodeState._make(cur_layer_state)
+                                cur_layer_state = line_state
+                            if record_snapshots:
+                                new_layer.snapshot = cur_layer_snapshot
+                                cur_layer_snapshot = PreprocessSnapshot._make(line_snapshot)
                             new_layer.duration = totalduration - layerbeginduration
                             layerbeginduration = totalduration
-                            all_layers.append(new_layer)
+                            if keep_layers:
+                                all_layers.append(new_layer)
+                            if base_z is not None and self.est_layer_height is None and layer_height is None:
+                                bisect.insort(layer_zs, base_z)
                             if cur_layer_has_extrusion and prev_z not in all_zs:
                                 all_zs.add(prev_z)
+                                zs_added.append(prev_z)
                             cur_lines = []
                             cur_layer_has_extrusion = False
                             layer_id += 1
                             layer_line = 0
                             last_layer_z = base_z
                             if layer_callback is not None:
-                                layer_callback(self, len(all_layers) - 1)
+                                layer_callback(self, layer_id - 1)
+                            yield new_layer
 
                         prev_base_z = base_z
 
+            elif build_layers and slicer_hints and layer_height is None:
+                hint = layer_height_hint_exp.match(line.raw)
+                if hint and float(hint.group(1)) > 0:
+                    layer_height = self.layer_height = float(hint.group(1))
+
             if build_layers:
                 cur_lines.append(true_line)
-                layer_idxs.append(layer_id)
-                line_idxs.append(layer_line)
+                if build_indexes:
+                    layer_idxs.append(layer_id)
+                    line_idxs.append(layer_line)
                 layer_line += 1
                 prev_z = cur_z
 
@@ -737,18 +1234,30 @@ class GCode(object):
         if build_layers:
             if cur_lines:
                 new_layer = Layer(cur_lines, prev_z)
+                if record_states:
+                    new_layer.state = GCodeState._make(cur_layer_state)
+                if record_snapshots:
+                    new_layer.snapshot = cur_layer_snapshot
                 new_layer.duration = totalduration - layerbeginduration
                 layerbeginduration = totalduration
-                all_layers.append(new_layer)
+                if keep_layers:
+                    all_layers.append(new_layer)
                 if cur_layer_has_extrusion and prev_z not in all_zs:
                     all_zs.add(prev_z)
-
-            self.append_layer_id = len(all_layers)
-            self.append_layer = Layer([])
-            self.append_layer.duration = 0
-            all_layers.append(self.append_layer)
-            self.layer_idxs = array('I', layer_idxs)
-            self.line_idxs = array('I', line_idxs)
+                    zs_added.append(prev_z)
+                yield new_layer
+
+            if keep_layers:
+                self.append_layer_id = len(all_layers)
+                self.append_layer = Layer([])
+                self.append_layer.duration = 0
+                all_layers.append(self.append_layer)
+            if build_indexes:
+                self.layer_idxs = array('I', layer_idxs)
+                self.line_idxs = array('I', line_idxs)
+                self._indexes_dirty = False
+            elif keep_layers:
+                self.invalidate_indexes()
 
             # Compute bounding box
             all_zs = self.all_zs.union(set([zmin])).difference(set([None]))
@@ -783,38 +1292,47 @@ class GCode(object):
     def estimate_duration(self):
         return self.layers_count, self.duration
 
+    def parameter_values(self, command, code):
+        """return the values of a parameter for all lines with the given command (eg 'M104', 'S')"""
+        return parameter_values(self, command, code)
+
+    def plan_durations(self, limits=None):
+        """estimate the duration of each layer and of the whole program with the look-ahead motion planner
+        (see gcodeutils.planner), starting with the given MachineLimits, and return the later"""
+        from gcodeutils.planner import MotionPlanner
+        return MotionPlanner(limits).apply(self)
+
+    def spatial_index(self, layer_idx, cell_size=None):
+        """return a grid index of the moves of a layer (see gcodeutils.spatial), starting from the position
+        reached by the previous layers"""
+        start = None
+        for layer in reversed(self.all_layers[:layer_idx]):
+            for line in reversed(layer):
+                if line.current_x is not None:
+                    start = (line.current_x, line.current_y)
+                    break
+            if start is not None:
+                break
+        return self.all_layers[layer_idx].spatial_index(start, cell_size)
+
+    def to_arrays(self):
+        """return a columnar, NumPy backed, representation of the program (see gcodeutils.columnar)"""
+        from gcodeutils.columnar import ColumnarGCode
+        return ColumnarGCode(self)
+
     def write(self, output_file=sys.stdout):
         """write the gcode program to a file like object"""
-        for layer in self.all_layers:
-            for line in layer:
-                print(line.raw, file=output_file)
+        with GCodeWriter(output_file) as writer:
+            for layer in self.all_layers:
+                writer.write_layer(layer)
 
     def diff(self, other):
+        """return a description of every difference between the meaningful lines of two programs, with their
+        layer and line positions (see gcodeutils.diff), None if there is none"""
         if not isinstance(other, GCode):
             raise ValueError
-
-        meaningful_lines1 = self.comment_stripper_generator()
-        meaningful_lines2 = other.comment_stripper_generator()
-
-        for line_number, (l1, l2) in enumerate(zip(meaningful_lines1, meaningful_lines2)):
-            # checking the raw representation of lines is a bit naive
-            # that will have to evolve as required
-            if l1 != l2:
-                return "First difference after {} meaningful lines: '{}' vs '{}' ".format(line_number, l1.raw, l2.raw)
-
-        # check that generators are empty
-        # that's probably more contrived than it should be
-        try:
-            l1 = next(meaningful_lines1)
-            return "Remaining line(s) for self: '{}'".format(l1)
-        except StopIteration:
-            try:
-                l2 = next(meaningful_lines2)
-                return "Remaining line(s) for other: '{}'".format(l2)
-            except StopIteration:
-                pass
-
-        return None
+        from gcodeutils.diff import format_difference, semantic_diff
+        return "\n".join(format_difference(difference) for difference in semantic_diff(self, other)) or None
 
     def __eq__(self, other):
         if not isinstance(other, GCode):
@@ -854,6 +1372,150 @@ class LightGCode(GCode):
     line_class = LightLine
 
 
+class GCodeStream(GCode):
+    """GCode program parsed lazily out of an iterable of raw lines (typically a file object).
+
+    Lines go through the same preprocessing as in GCode (relative modes, offsets, current position, extrusion
+    and tool) but only the layer being handled is kept in memory. Layer processors (usually filters, see
+    add_filter) are applied to each layer before it is handed over, so that a program can be modified and
+    written back with a memory footprint bounded by its biggest layer.
+
+    Lines being parsed lazily, the preprocess stage recorded by stats includes their parsing, each layer
+    processor being recorded in a stage of its own. Each layer carries the GCodeState before its first line
+    (Layer.state), from which it can be preprocessed again on its own.
+
+    Only the layer being streamed can be modified (prepend_to_layer, rewrite_layer), lines appended before the
+    stream has been consumed are handed over in a last layer, as the append layer of GCode.
+
+    A stream can only be consumed once."""
+
+    def __init__(self, data, home_pos=None, layer_callback=None, line_callback=None, tokenizer=None,
+                 stats=None, progress=None):
+        if tokenizer is not None:
+            self.tokenizer = tokenizer
+        if stats is not None:
+            self.stats = stats
+        if progress is not None:
+            self.progress = progress
+        self.home_pos = home_pos
+        self.data = data
+        self.layer_callback = layer_callback
+        self.line_callback = line_callback
+        self.layer_processors = []
+        self.layer_processor_names = []
+        self.current_layer = None
+        self.current_layer_idx = None
+        # lines appended, handed over once the program has been streamed
+        self.appended = []
+
+    def add_layer_processor(self, processor, name=None):
+        """register a callable to be called with each layer, in order, before it is handed over, name being
+        the stage recording it in stats (by default the name of the callable)"""
+        self.layer_processors.append(processor)
+        self.layer_processor_names.append(name or getattr(processor, '__name__', type(processor).__name__))
+
+    def add_filter(self, gcode_filter):
+        """register a GCodeFilter to be applied to each layer"""
+        self.add_layer_processor(gcode_filter.filter_layer, gcode_filter.name)
+
+    def layers(self):
+        """generate the layers of the program, processed by the registered layer processors"""
+        if self.data is None:
+            raise RuntimeError("GCode stream has already been consumed")
+
+        data, self.data = self.data, None
+        line_class = self.line_class
+        lines = (line_class(l2) for l2 in (l.strip() for l in data) if l2)
+        layers = self._preprocess_layers(lines, build_layers=True, layer_callback=self.layer_callback,
+                                         line_callback=self.line_callback, keep_layers=False, record_states=True)
+        stats = self.stats
+        progress = self.progress
+        processors = list(zip(self.layer_processors, self.layer_processor_names))
+        if progress is not None:
+            progress.start('stream', len(data) if hasattr(data, '__len__') else None)
+
+        self.current_layer_idx = 0
+        while True:
+            with stage(stats, 'preprocess') as preprocessing:
+                self.current_layer = next(layers, None)
+            if self.current_layer is None:
+                break
+            preprocessing.lines += len(self.current_layer)
+            if progress is not None:
+                # counted before being processed, as processors may add or remove lines
+                layer_lines = len(self.current_layer)
+                layer_bytes = sum(len(line.raw) + 1 for line in self.current_layer)
+            for processor, name in processors:
+                with stage(stats, name, len(self.current_layer)):
+                    processor(self.current_layer)
+            yield self.current_layer
+            if progress is not None:
+                progress.update(layer_lines, layer_bytes, 1)
+            self.current_layer_idx += 1
+        while self.appended:
+            # preprocessed in the state at the end of the program, stored once it has been preprocessed
+            self.current_layer = Layer(self.appended)
+            self.appended = []
+            self.current_layer.state = self._get_state()
+            self.current_layer.duration = 0
+            with stage(stats, 'preprocess', len(self.current_layer)):
+                self._preprocess(self.current_layer)
+            for processor, name in processors:
+                with stage(stats, name, len(self.current_layer)):
+                    processor(self.current_layer)
+            yield self.current_layer
+            self.current_layer_idx += 1
+        self.current_layer = None
+        if progress is not None:
+            progress.finish()
+
+    def __iter__(self):
+        for layer in self.layers():
+            for line in layer:
+                yield line
+
+    def __len__(self):
+        raise TypeError("GCode stream has no length")
+
+    def prepend_to_layer(self, commands, layer_idx):
+        if layer_idx != self.current_layer_idx or self.current_layer is None:
+            raise ValueError("only the layer being streamed can be modified")
+
+        glines = self._command_lines(commands)
+        self.current_layer[0:0] = glines
+        return [gline.raw for gline in glines]
+
+    def rewrite_layer(self, commands, layer_idx):
+        if layer_idx != self.current_layer_idx or self.current_layer is None:
+            raise ValueError("only the layer being streamed can be modified")
+
+        glines = self._command_lines(commands)
+        self.current_layer[:] = glines
+        return [gline.raw for gline in glines]
+
+    def append(self, command, store=True):
+        """append a command at the end of the program, to be preprocessed and handed over in a last layer once
+        the program has been streamed. Without store, the command is preprocessed right away instead, in the
+        state at the end of the program only once the stream has been consumed"""
+        command = command.strip()
+        if not command:
+            return
+        gline = Line(command)
+        if not store:
+            self._preprocess([gline])
+            return gline
+        if self.data is None and self.current_layer is None:
+            raise RuntimeError("GCode stream has already been consumed")
+        self.appended.append(gline)
+        return gline
+
+    def write(self, output_file=sys.stdout):
+        """consume the stream, writing the processed gcode program to a file like object"""
+        with GCodeWriter(output_file) as writer:
+            for layer in self.layers():
+                writer.write_layer(layer)
+
+
 def main():
     if len(sys.argv) < 2:
         print("usage: %s filename.gcode" % sys.argv[0])
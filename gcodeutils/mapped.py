@@ -0,0 +1,262 @@
+"""Memory mapped GCode program, parsing lines lazily
+
+MappedGCode only keeps the byte offset of each line of the file and, for each layer, the machine state
+before its first line. Layers are parsed on demand, when their lines are accessed, so that opening a big
+file to query its layers count, duration or dimensions doesn't require millions of line objects.
+"""
+
+import bisect
+import itertools
+import mmap
+import sys
+from array import array
+
+try:
+    from collections.abc import MutableSequence, Sequence
+except ImportError:  # python 2
+    from collections import MutableSequence, Sequence
+
+from gcodeutils.gcoder import GCode, Layer, Line, tokenize
+from gcodeutils.writer import GCodeWriter
+
+__author__ = 'olivier'
+
+ENCODING = 'utf-8'
+
+
+class MappedLayer(MutableSequence):
+    """layer of a MappedGCode, whose lines are parsed from the mapped file the first time they are accessed.
+
+    Once loaded, the layer behaves as a regular Layer and is written back from its lines; unload drops the
+    parsed lines (and any modification) so that the layer is read from the file again."""
+
+    def __init__(self, gcode, start, count, z, duration, state):
+        self.gcode = gcode
+        # index of the first line of the layer in gcode.line_offsets and number of lines
+        self.start = start
+        self.count = count
+        self.z = z
+        self.duration = duration
+        self.state = state
+        self._layer = None
+
+    @property
+    def loaded(self):
+        return self._layer is not None
+
+    def load(self):
+        """return the parsed Layer, parsing it if needed"""
+        if self._layer is None:
+            self._layer = self.gcode.parse_layer_lines(self)
+        return self._layer
+
+    def unload(self):
+        self._layer = None
+
+    def __len__(self):
+        if self._layer is None:
+            return self.count
+        return len(self._layer)
+
+    def __getitem__(self, index):
+        return self.load()[index]
+
+    def __setitem__(self, index, value):
+        self.load()[index] = value
+
+    def __delitem__(self, index):
+        del self.load()[index]
+
+    def insert(self, index, value):
+        self.load().insert(index, value)
+
+    def __iter__(self):
+        return iter(self.load())
+
+
+class MappedLines(Sequence):
+    """lines of a MappedGCode, read from their layer when accessed: an accessed line is parsed along with its
+    layer (which is kept, as when accessing the lines of the layer), iterating parses layers without keeping them"""
+
+    def __init__(self, gcode):
+        self.gcode = gcode
+
+    def __len__(self):
+        return len(self.gcode)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("line index out of range")
+        layer_idx, line_idx = self.gcode.idxs(index)
+        return self.gcode.all_layers[layer_idx][line_idx]
+
+    def __iter__(self):
+        return iter(self.gcode)
+
+
+class MappedGCode(GCode):
+    """GCode program read from a memory mapped file.
+
+    Opening the file preprocesses it once to index line offsets, layers and their states, and to compute
+    the global values (layers_count, duration, dimensions, filament_length) without keeping any line.
+    all_layers holds MappedLayer objects which can be filtered and written back like regular layers;
+    unmodified layers are copied from the file without being parsed again.
+
+    lines is a MappedLines view of the layers, and after layers have been edited only the index of the first
+    line of each layer is rebuilt, so that no layer is parsed to access lines or indexes."""
+
+    tokenizer = staticmethod(tokenize)
+
+    def __init__(self, filename, home_pos=None, layer_callback=None, tokenizer=None):
+        if tokenizer is not None:
+            self.tokenizer = tokenizer
+        self.home_pos = home_pos
+        try:
+            self.line_offsets = array('Q')
+        except ValueError:  # python 2
+            self.line_offsets = array('L')
+        self.layer_starts = []
+        # index of the first line of the append layer
+        self.append_layer_start = 0
+
+        self._file = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            self._mmap = b''
+
+        lines = self._read_lines()
+        first_line = next(lines, None)
+        if first_line is None:
+            # same empty program as GCode
+            self.prepare(home_pos=home_pos)
+            return
+
+        self.all_layers = []
+        start = 0
+        for layer in self._preprocess_layers(itertools.chain([first_line], lines), build_layers=True,
+                                             layer_callback=layer_callback,
+                                             keep_layers=False, record_states=True):
+            self.all_layers.append(MappedLayer(self, start, len(layer), layer.z, layer.duration, layer.state))
+            self.layer_starts.append(start)
+            start += len(layer)
+        self.append_layer_start = start
+        self.lines = MappedLines(self)
+
+        self.append_layer_id = len(self.all_layers)
+        self.append_layer = Layer([])
+        self.append_layer.duration = 0
+        self.all_layers.append(self.append_layer)
+
+    def _read_lines(self):
+        """generate a Line for each non blank line of the file, recording its offset"""
+        data = self._mmap
+        find = data.find
+        size = len(data)
+        offsets = self.line_offsets
+        pos = 0
+        while pos < size:
+            end = find(b'\n', pos)
+            if end < 0:
+                end = size
+            text = data[pos:end].strip()
+            if text:
+                offsets.append(pos)
+                yield Line(text.decode(ENCODING))
+            pos = end + 1
+
+    def raw_lines(self, start, count):
+        """generate the stripped text of count lines starting at the given line index"""
+        data = self._mmap
+        find = data.find
+        for offset in self.line_offsets[start:start + count]:
+            offset = int(offset)
+            end = find(b'\n', offset)
+            if end < 0:
+                end = len(data)
+            yield data[offset:end].strip().decode(ENCODING)
+
+    def parse_layer_lines(self, mapped_layer):
+        """parse the lines of a MappedLayer, starting from its recorded state, into a Layer"""
+        layer = Layer([Line(raw) for raw in self.raw_lines(mapped_layer.start, mapped_layer.count)], mapped_layer.z)
+        layer.duration = mapped_layer.duration
+        layer.state = mapped_layer.state
+        layer.preprocess(self.home_pos, self.tokenizer)
+        return layer
+
+    def refresh(self):
+        """mapped layers are preprocessed when loaded, edited layers can't be preprocessed again"""
+        raise NotImplementedError("MappedGCode layers can't be preprocessed again, unload them instead")
+
+    def close(self):
+        if self._mmap:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _rebuild_indexes(self):
+        """rebuild the index of the first line of each layer, from the lengths of the layers so that those
+        which aren't loaded aren't parsed"""
+        self.layer_starts = []
+        start = 0
+        for layer in self.all_layers[:self.append_layer_id]:
+            self.layer_starts.append(start)
+            start += len(layer)
+        self.append_layer_start = start
+        self._indexes_dirty = False
+
+    def __len__(self):
+        if self._indexes_dirty:
+            self._rebuild_indexes()
+        return self.append_layer_start + len(self.append_layer)
+
+    def __iter__(self):
+        """iterate over all lines, layers which aren't loaded are parsed without being kept"""
+        for layer in self.all_layers:
+            if isinstance(layer, MappedLayer) and not layer.loaded:
+                layer = self.parse_layer_lines(layer)
+            for line in layer:
+                yield line
+
+    def comment_stripper_generator(self):
+        """return only non comment lines"""
+        for line in self:
+            if line.command is not None:
+                yield line
+
+    def idxs(self, i):
+        if self._indexes_dirty:
+            self._rebuild_indexes()
+        if i >= self.append_layer_start:
+            return self.append_layer_id, i - self.append_layer_start
+        layer_idx = bisect.bisect_right(self.layer_starts, i) - 1
+        return layer_idx, i - self.layer_starts[layer_idx]
+
+    def append(self, command, store=True):
+        command = command.strip()
+        if not command:
+            return
+        gline = Line(command)
+        self._preprocess([gline])
+        if store:
+            self.append_layer.append(gline)
+        return gline
+
+    def write(self, output_file=sys.stdout):
+        """write the gcode program to a file like object, copying the layers that haven't been loaded"""
+        with GCodeWriter(output_file) as writer:
+            for layer in self.all_layers:
+                if isinstance(layer, MappedLayer) and not layer.loaded:
+                    writer.write_lines(list(self.raw_lines(layer.start, layer.count)))
+                else:
+                    writer.write_layer(layer)
@@ -0,0 +1,176 @@
+"""Parallel parsing and filtering of a GCode file
+
+The file is split into byte ranges, aligned on line ends, which are tokenized in a pool of processes.
+Tokenizing doesn't depend on the machine state (except for imperial units, handled afterwards), so the
+workers can work independently; the state carried from line to line (positions, offsets, relative modes,
+extrusion, layers) is then computed by the regular sequential preprocessing of GCode, which skips the
+tokenizing already done by the workers.
+
+Layer local filters (whose layer_local attribute is set, such as the arc optimizer and the stretch filters)
+are applied to each layer in a pool of processes, given the state of the filter at the start of the layer,
+and the filtered layers put back in order.
+"""
+
+import multiprocessing
+import os
+
+from gcodeutils.cache import LINE_ATTRIBUTES
+from gcodeutils.gcoder import GCode, Line, gcode_possible_arguments, tokenize
+
+__author__ = 'olivier'
+
+ENCODING = 'utf-8'
+
+# don't bother splitting files in chunks smaller than this
+MIN_CHUNK_SIZE = 1 << 20
+
+# layers given at once to a worker by filter_parallel
+LAYERS_PER_TASK = 4
+
+TOKEN_ATTRIBUTES = ['command', 'is_move'] + gcode_possible_arguments
+
+
+def chunk_ranges(filename, chunk_size):
+    """return a list of (start, end) byte ranges of about chunk_size bytes splitting the file, each one ending
+    at the end of a line"""
+    size = os.path.getsize(filename)
+    ranges = []
+    with open(filename, 'rb') as gcode_file:
+        start = 0
+        while start < size:
+            gcode_file.seek(min(start + chunk_size, size))
+            gcode_file.readline()
+            end = min(gcode_file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def tokenize_chunk(args):
+    """tokenize the non blank lines of a byte range of a file, assuming metric units.
+
+    return a list of (raw, command, is_move, x, y, z, e, f, i, j) tuples"""
+    filename, start, end = args
+    with open(filename, 'rb') as gcode_file:
+        gcode_file.seek(start)
+        data = gcode_file.read(end - start).decode(ENCODING)
+
+    tokens = []
+    for raw in data.split('\n'):
+        raw = raw.strip()
+        if raw:
+            line = Line(raw)
+            tokenize(line)
+            tokens.append((raw,) + tuple(getattr(line, attribute) for attribute in TOKEN_ATTRIBUTES))
+    return tokens
+
+
+def line_from_tokens(tokens):
+    line = Line(tokens[0])
+    for attribute, value in zip(TOKEN_ATTRIBUTES, tokens[1:]):
+        if value is not None:
+            setattr(line, attribute, value)
+    return line
+
+
+def tokenized(line, imperial=False):
+    """tokenizer hook for lines already tokenized by tokenize_chunk"""
+    if imperial:
+        # workers assumed metric units, parse the line again with the right unit
+        for attribute in gcode_possible_arguments:
+            setattr(line, attribute, None)
+        tokenize(line, imperial)
+
+
+def parse_parallel(filename, processes=None, home_pos=None, layer_callback=None, line_callback=None,
+                   chunk_size=None):
+    """parse a GCode file using a pool of processes (as many as CPUs by default) to tokenize its lines.
+
+    return the same GCode as GCode(open(filename)) would"""
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunk_size is None:
+        # a few chunks per process to even out their load
+        chunk_size = max(os.path.getsize(filename) // (processes * 4), MIN_CHUNK_SIZE)
+    ranges = [(filename, start, end) for start, end in chunk_ranges(filename, chunk_size)]
+
+    if processes > 1 and len(ranges) > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            chunks = pool.map(tokenize_chunk, ranges)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [tokenize_chunk(args) for args in ranges]
+
+    gcode = GCode(deferred=True)
+    gcode.lines = [line_from_tokens(tokens) for chunk in chunks for tokens in chunk]
+    if not gcode.lines:
+        gcode.prepare(home_pos=home_pos)
+        return gcode
+
+    gcode.home_pos = home_pos
+    gcode.tokenizer = tokenized
+    try:
+        gcode._preprocess(build_layers=True, layer_callback=layer_callback, line_callback=line_callback)
+    finally:
+        del gcode.tokenizer
+    return gcode
+
+
+def line_values(line):
+    """return the attributes of a line as a tuple, lines themselves can't be pickled"""
+    return tuple(getattr(line, attribute) for attribute in LINE_ATTRIBUTES)
+
+
+def line_from_values(values):
+    line = Line()
+    for attribute, value in zip(LINE_ATTRIBUTES, values):
+        if value is not None:
+            setattr(line, attribute, value)
+    return line
+
+
+def filter_layers(args):
+    """filter layers, given as lists of line values with the state of the filter at their start, return the
+    filtered layers as lists of line values"""
+    gcode_filter, layers = args
+    filtered = []
+    for values, state in layers:
+        layer = [line_from_values(line) for line in values]
+        gcode_filter.filter_layer_from(layer, state)
+        filtered.append([line_values(line) for line in layer])
+    return filtered
+
+
+def filter_parallel(gcode, gcode_filter, processes=None):
+    """filter gcode in place, as gcode_filter.filter(gcode) would, the layers being filtered in a pool of
+    processes (as many as CPUs by default) when the filter is layer local"""
+    if not getattr(gcode_filter, 'layer_local', False):
+        gcode_filter.filter(gcode)
+        return
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    layers = gcode.all_layers
+    states = gcode_filter.layer_states(gcode)
+    layer_idxs = [layer_idx for layer_idx, layer in enumerate(layers) if layer]
+    if processes > 1 and len(layer_idxs) > 1:
+        tasks = ((gcode_filter, [([line_values(line) for line in layers[layer_idx]], states[layer_idx])
+                                 for layer_idx in layer_idxs[start:start + LAYERS_PER_TASK]])
+                 for start in range(0, len(layer_idxs), LAYERS_PER_TASK))
+        pool = multiprocessing.Pool(processes)
+        try:
+            # tasks are consumed and results handed over in order, as they come
+            filtered_idxs = iter(layer_idxs)
+            for filtered in pool.imap(filter_layers, tasks):
+                for values in filtered:
+                    layers[next(filtered_idxs)][:] = [line_from_values(line) for line in values]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for layer_idx in layer_idxs:
+            gcode_filter.filter_layer_from(layers[layer_idx], states[layer_idx])
+    gcode.mark_dirty()
@@ -0,0 +1,372 @@
+"""Look-ahead trapezoidal motion planner estimating the duration of GCode programs
+
+Moves are planned like a firmware (Marlin style) planner with an unbounded look-ahead buffer: each move
+follows a trapezoidal velocity profile bounded by its feedrate and by the per axis maximum feedrates and
+accelerations, junction speeds between consecutive moves being limited by junction deviation or by
+classic jerk. Motion settings are updated along the program by M201, M203, M204 and M205.
+
+The backward and forward passes of the planner are recurrences of the form w[i] = min(c[i], w[i+1] + d[i])
+on squared speeds, which are solved with cumulative minimums over prefix sums so that they can be
+vectorized with NumPy. NumPy is optional, a pure python implementation being used when it is missing.
+"""
+
+import datetime
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gcodeutils.gcoder import P, S, parameters
+
+__author__ = 'olivier'
+
+AXES = 'XYZE'
+
+# commands changing the motion settings
+LIMITS_COMMANDS = frozenset(['M201', 'M203', 'M204', 'M205'])
+
+# commands waiting for the planned moves to be completed, so that the next move starts from rest
+SYNCHRONIZING_COMMANDS = frozenset(['G4', 'G28', 'G29', 'M0', 'M1', 'M109', 'M190', 'M400', 'M600'])
+
+
+class MachineLimits(object):
+    """firmware motion settings, defaulting to Marlin ones (speeds in mm/s, accelerations in mm/s^2).
+
+    Junction speeds are computed with junction deviation (in mm) when it is set, with classic jerk
+    (max_jerk, in mm/s) otherwise."""
+
+    def __init__(self, max_feedrate=(300., 300., 5., 25.), max_acceleration=(3000., 3000., 100., 10000.),
+                 acceleration=3000., retract_acceleration=3000., travel_acceleration=3000.,
+                 max_jerk=(10., 10., 0.3, 5.), junction_deviation=None):
+        self.max_feedrate = list(max_feedrate)
+        self.max_acceleration = list(max_acceleration)
+        self.acceleration = acceleration
+        self.retract_acceleration = retract_acceleration
+        self.travel_acceleration = travel_acceleration
+        self.max_jerk = list(max_jerk)
+        self.junction_deviation = junction_deviation
+
+    def copy(self):
+        return MachineLimits(self.max_feedrate, self.max_acceleration, self.acceleration,
+                             self.retract_acceleration, self.travel_acceleration, self.max_jerk,
+                             self.junction_deviation)
+
+    def update(self, line):
+        """apply a M201/M203/M204/M205 line, return whether the settings changed"""
+        command = line.command
+        if command not in LIMITS_COMMANDS:
+            return False
+        values = parameters(line)
+        changed = False
+
+        if command in ('M201', 'M203', 'M205'):
+            settings = {'M201': self.max_acceleration, 'M203': self.max_feedrate, 'M205': self.max_jerk}[command]
+            for axis, code in enumerate(AXES):
+                if values.get(code) is not None:
+                    settings[axis] = values[code]
+                    changed = True
+        if command == 'M204':
+            if values.get('S') is not None:
+                self.acceleration = self.travel_acceleration = values['S']
+            if values.get('P') is not None:
+                self.acceleration = values['P']
+            if values.get('R') is not None:
+                self.retract_acceleration = values['R']
+            if values.get('T') is not None:
+                self.travel_acceleration = values['T']
+            changed = True
+        if command == 'M205' and values.get('J') is not None:
+            self.junction_deviation = values['J'] or None
+            changed = True
+        return changed
+
+
+class Moves(object):
+    """columns of the moves of a program, as extracted by extract_moves"""
+
+    def __init__(self):
+        self.dx = array('d')
+        self.dy = array('d')
+        self.dz = array('d')
+        self.de = array('d')
+        # requested feedrate in mm/s, 0 when unknown
+        self.feedrate = array('d')
+        # index of the MachineLimits in effect in limits
+        self.limits_idx = array('i')
+        # whether the machine is at rest before the move
+        self.stop_before = array('b')
+        self.layer = array('i')
+        self.limits = []
+        # dwell durations of each layer
+        self.layer_dwell = []
+
+    def __len__(self):
+        return len(self.dx)
+
+
+def arc_length(line, x, y, dx, dy):
+    """length in the X/Y plane of a G2/G3 arc starting at (x, y)"""
+    i = line.i or 0.
+    j = line.j or 0.
+    radius = math.hypot(i, j)
+    start_angle = math.atan2(-j, -i)
+    end_angle = math.atan2(dy - j, dx - i)
+    angle = end_angle - start_angle
+    if line.command == 'G2':
+        angle = -angle
+    if angle <= 0:
+        angle += 2 * math.pi
+    return radius * angle
+
+
+def extract_moves(gcode, limits=None):
+    """return the Moves of a parsed GCode program, starting with the given MachineLimits"""
+    moves = Moves()
+    limits = limits.copy() if limits is not None else MachineLimits()
+    moves.limits.append(limits)
+
+    last_x = last_y = last_z = 0.
+    e_position = 0.
+    stop = True
+    for layer_idx, layer in enumerate(gcode.all_layers):
+        dwell = 0.
+        for line in layer:
+            command = line.command
+            if not command:
+                continue
+
+            if line.is_move:
+                x = line.current_x
+                y = line.current_y
+                z = line.current_z
+                dx = x - last_x
+                dy = y - last_y
+                dz = z - last_z
+                if line.e is None:
+                    de = 0.
+                elif line.relative_e:
+                    de = line.e
+                else:
+                    de = line.e - e_position
+                e_position = e_position + de
+
+                if command in ('G2', 'G3') and (line.i or line.j):
+                    # plan arcs as a single move of the same length along their chord
+                    length = math.hypot(dx, dy)
+                    if length:
+                        factor = arc_length(line, last_x, last_y, dx, dy) / length
+                        dx *= factor
+                        dy *= factor
+
+                if dx or dy or dz or de:
+                    moves.dx.append(dx)
+                    moves.dy.append(dy)
+                    moves.dz.append(dz)
+                    moves.de.append(de)
+                    moves.feedrate.append((line.current_f or 0.) / 60.)
+                    moves.limits_idx.append(len(moves.limits) - 1)
+                    moves.stop_before.append(stop)
+                    moves.layer.append(layer_idx)
+                    stop = False
+            else:
+                if command == 'G92' and line.e is not None:
+                    e_position = line.e
+                elif command == 'G4':
+                    if P(line):
+                        dwell += P(line) / 1000.
+                    elif S(line):
+                        dwell += S(line)
+                elif command in LIMITS_COMMANDS:
+                    # moves already extracted keep the settings they were planned with
+                    new_limits = limits.copy()
+                    if new_limits.update(line):
+                        limits = new_limits
+                        moves.limits.append(limits)
+                if command in SYNCHRONIZING_COMMANDS:
+                    stop = True
+
+            if line.current_x is not None:
+                last_x = line.current_x
+                last_y = line.current_y
+                last_z = line.current_z
+        moves.layer_dwell.append(dwell)
+    return moves
+
+
+def trapezoid_time(length, entry, exit, nominal, acceleration):
+    """duration of a move with a trapezoidal (or triangular) velocity profile"""
+    accelerate = (nominal * nominal - entry * entry) / (2 * acceleration)
+    decelerate = (nominal * nominal - exit * exit) / (2 * acceleration)
+    cruise = length - accelerate - decelerate
+    if cruise >= 0:
+        return (2 * nominal - entry - exit) / acceleration + cruise / nominal
+    peak = math.sqrt(max(acceleration * length + (entry * entry + exit * exit) / 2, entry * entry, exit * exit))
+    return (2 * peak - entry - exit) / acceleration
+
+
+def plan_python(moves):
+    """return the duration of each move, planned in pure python"""
+    count = len(moves)
+    lengths = []
+    units = []
+    nominals = []
+    accelerations = []
+    for i in range(count):
+        limits = moves.limits[moves.limits_idx[i]]
+        delta = (moves.dx[i], moves.dy[i], moves.dz[i], moves.de[i])
+        length = math.sqrt(delta[0] * delta[0] + delta[1] * delta[1] + delta[2] * delta[2]) or abs(delta[3])
+        norm = math.sqrt(sum(d * d for d in delta))
+
+        nominal = moves.feedrate[i] if moves.feedrate[i] > 0 else float('inf')
+        if not (delta[0] or delta[1] or delta[2]):
+            acceleration = limits.retract_acceleration
+        elif delta[3] > 0:
+            acceleration = limits.acceleration
+        else:
+            acceleration = limits.travel_acceleration
+        for axis in range(4):
+            if delta[axis]:
+                ratio = length / abs(delta[axis])
+                nominal = min(nominal, limits.max_feedrate[axis] * ratio)
+                acceleration = min(acceleration, limits.max_acceleration[axis] * ratio)
+
+        lengths.append(length)
+        units.append([d / norm for d in delta])
+        nominals.append(nominal)
+        accelerations.append(acceleration)
+
+    # maximum squared entry speeds, with an extra resting exit after the last move
+    caps = [0.] * (count + 1)
+    for i in range(1, count):
+        if moves.stop_before[i]:
+            continue
+        limits = moves.limits[moves.limits_idx[i]]
+        previous, current = units[i - 1], units[i]
+        speed = min(nominals[i - 1], nominals[i])
+        if limits.junction_deviation is not None:
+            cos_theta = -sum(p * c for p, c in zip(previous, current))
+            if cos_theta > 0.999999:
+                speed = 0.
+            elif cos_theta > -0.999999:
+                sin_theta_d2 = math.sqrt(0.5 * (1. - cos_theta))
+                speed = min(speed, math.sqrt(accelerations[i] * limits.junction_deviation * sin_theta_d2 /
+                                             (1. - sin_theta_d2)))
+        else:
+            for axis in range(4):
+                change = speed * abs(current[axis] - previous[axis])
+                if change > limits.max_jerk[axis]:
+                    speed *= limits.max_jerk[axis] / change
+        caps[i] = speed * speed
+
+    # backward pass: decelerate in time for the next entry speed
+    speeds = caps[:]
+    for i in range(count - 1, -1, -1):
+        speeds[i] = min(speeds[i], speeds[i + 1] + 2 * accelerations[i] * lengths[i])
+    # forward pass: accelerate from the previous entry speed
+    for i in range(count):
+        speeds[i + 1] = min(speeds[i + 1], speeds[i] + 2 * accelerations[i] * lengths[i])
+
+    return [trapezoid_time(lengths[i], math.sqrt(speeds[i]), math.sqrt(speeds[i + 1]), nominals[i],
+                           accelerations[i]) for i in range(count)]
+
+
+def plan_numpy(moves):
+    """return the duration of each move, planned with NumPy"""
+    count = len(moves)
+    deltas = numpy.array([numpy.frombuffer(column, dtype=numpy.float64)
+                          for column in (moves.dx, moves.dy, moves.dz, moves.de)])
+    limits_idx = numpy.frombuffer(moves.limits_idx, dtype=numpy.intc)
+
+    def limit(getter):
+        return numpy.array([getter(limits) for limits in moves.limits], dtype=numpy.float64)[limits_idx]
+
+    max_feedrate = limit(lambda limits: limits.max_feedrate)
+    max_acceleration = limit(lambda limits: limits.max_acceleration)
+    max_jerk = limit(lambda limits: limits.max_jerk)
+    junction_deviation = limit(lambda limits: numpy.nan if limits.junction_deviation is None
+                               else limits.junction_deviation)
+
+    xyz_length = numpy.sqrt((deltas[:3] ** 2).sum(axis=0))
+    e_only = xyz_length == 0
+    lengths = numpy.where(e_only, numpy.abs(deltas[3]), xyz_length)
+    units = deltas / numpy.sqrt((deltas ** 2).sum(axis=0))
+
+    feedrate = numpy.frombuffer(moves.feedrate, dtype=numpy.float64)
+    nominals = numpy.where(feedrate > 0, feedrate, numpy.inf)
+    accelerations = numpy.where(e_only, limit(lambda limits: limits.retract_acceleration),
+                                numpy.where(deltas[3] > 0, limit(lambda limits: limits.acceleration),
+                                            limit(lambda limits: limits.travel_acceleration)))
+    with numpy.errstate(divide='ignore'):
+        ratios = lengths / numpy.abs(deltas)
+    nominals = numpy.minimum(nominals, (max_feedrate.T * ratios).min(axis=0))
+    accelerations = numpy.minimum(accelerations, (max_acceleration.T * ratios).min(axis=0))
+
+    # junction speeds between moves i - 1 and i
+    previous, current = units[:, :-1], units[:, 1:]
+    speeds = numpy.minimum(nominals[:-1], nominals[1:])
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        cos_theta = -(previous * current).sum(axis=0)
+        sin_theta_d2 = numpy.sqrt(0.5 * (1. - numpy.clip(cos_theta, -1., 1.)))
+        deviation_speeds = numpy.sqrt(accelerations[1:] * junction_deviation[1:] * sin_theta_d2 /
+                                      (1. - sin_theta_d2))
+        deviation_speeds[cos_theta <= -0.999999] = numpy.inf
+        deviation_speeds[cos_theta > 0.999999] = 0.
+        changes = speeds * numpy.abs(current - previous)
+        # axes not changing speed don't limit the junction, even with a zero max jerk
+        jerk_factors = numpy.minimum(1., numpy.where(changes > 0, max_jerk[1:].T / changes, numpy.inf).min(axis=0))
+    speeds = numpy.where(numpy.isnan(junction_deviation[1:]), speeds * jerk_factors,
+                         numpy.minimum(speeds, deviation_speeds))
+
+    caps = numpy.zeros(count + 1)
+    caps[1:count] = numpy.where(numpy.frombuffer(moves.stop_before, dtype=numpy.int8)[1:] != 0, 0., speeds ** 2)
+
+    # both passes as cumulative minimums over the prefix sums of the squared speed changes
+    distances = numpy.concatenate(([0.], numpy.cumsum(2 * accelerations * lengths)))
+    backward = numpy.minimum.accumulate((caps + distances)[::-1])[::-1] - distances
+    forward = numpy.minimum.accumulate(backward - distances) + distances
+    entries = numpy.sqrt(numpy.maximum(forward, 0.))
+
+    entry, exit = entries[:-1], entries[1:]
+    accelerate = (nominals ** 2 - entry ** 2) / (2 * accelerations)
+    decelerate = (nominals ** 2 - exit ** 2) / (2 * accelerations)
+    cruise = lengths - accelerate - decelerate
+    peak = numpy.sqrt(numpy.maximum(accelerations * lengths + (entry ** 2 + exit ** 2) / 2,
+                                    numpy.maximum(entry, exit) ** 2))
+    return numpy.where(cruise >= 0,
+                       (2 * nominals - entry - exit) / accelerations + numpy.maximum(cruise, 0.) / nominals,
+                       (2 * peak - entry - exit) / accelerations)
+
+
+class MotionPlanner(object):
+    """estimate the duration of GCode programs, starting with the given MachineLimits"""
+
+    def __init__(self, limits=None, use_numpy=True):
+        self.limits = limits
+        self.use_numpy = use_numpy and numpy is not None
+
+    def layer_durations(self, gcode):
+        """return the duration in seconds of each layer of gcode"""
+        moves = extract_moves(gcode, self.limits)
+        durations = list(moves.layer_dwell)
+        if not len(moves):
+            return durations
+
+        if self.use_numpy:
+            layers = numpy.frombuffer(moves.layer, dtype=numpy.intc)
+            move_durations = numpy.bincount(layers, weights=plan_numpy(moves), minlength=len(durations))
+            return [dwell + float(duration) for dwell, duration in zip(durations, move_durations)]
+
+        for layer_idx, duration in zip(moves.layer, plan_python(moves)):
+            durations[layer_idx] += duration
+        return durations
+
+    def apply(self, gcode):
+        """set the duration of each layer of gcode and its total duration, return the later"""
+        durations = self.layer_durations(gcode)
+        for layer, duration in zip(gcode.all_layers, durations):
+            layer.duration = duration
+        gcode.duration = datetime.timedelta(seconds=int(sum(durations)))
+        return gcode.duration
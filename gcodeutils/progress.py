@@ -0,0 +1,115 @@
+"""Throttled progress reporting of GCode processing
+
+Rather than calling back for every line (as line_callback does), parsing, preprocessing and filters count
+the lines, bytes and layers they handle in batches, and a Progress calls its callback with a
+ProgressReport at most every every_lines lines or every_seconds seconds, whichever comes first, as well as
+at the end of each stage. Programs without a Progress don't count anything.
+"""
+
+from __future__ import division
+
+import time
+from collections import namedtuple
+from itertools import islice
+
+__author__ = 'olivier'
+
+# raw lines parsed between two progress checks
+PARSE_BATCH = 4096
+
+# stage is the name of the running stage (parse, preprocess, stream or the class name of a filter), lines,
+# bytes and layers are counted since the start of the stage, total_lines is None when unknown, elapsed is
+# the number of seconds since the start of the stage, eta the estimated number of seconds until its end
+# (None when the total is unknown) and done whether this is the last report of the stage
+ProgressReport = namedtuple('ProgressReport', ['stage', 'lines', 'total_lines', 'bytes', 'layers', 'elapsed',
+                                               'eta', 'done'])
+
+
+class Progress(object):
+    """call callback with a ProgressReport at most every every_lines lines or every_seconds seconds of each
+    stage, and at its end"""
+
+    def __init__(self, callback, every_lines=10000, every_seconds=0.5):
+        self.callback = callback
+        self.every_lines = every_lines
+        self.every_seconds = every_seconds
+        self.stage = None
+        self.total_lines = None
+        self.lines = 0
+        self.bytes = 0
+        self.layers = 0
+        self._start = None
+        self._next_lines = None
+        self._next_time = None
+
+    def start(self, stage, total_lines=None):
+        """start counting a new stage, of total_lines lines when known"""
+        self.stage = stage
+        self.total_lines = total_lines
+        self.lines = 0
+        self.bytes = 0
+        self.layers = 0
+        self._start = time.time()
+        self._next_lines = self.every_lines
+        self._next_time = self._start + self.every_seconds
+
+    def update(self, lines=0, bytes=0, layers=0):  # pylint: disable=redefined-builtin
+        """count lines, bytes and layers handled by the running stage, reporting if it's time to"""
+        self.lines += lines
+        self.bytes += bytes
+        self.layers += layers
+        if self.lines >= self._next_lines:
+            self.report()
+        else:
+            now = time.time()
+            if now >= self._next_time:
+                self.report(now=now)
+
+    def finish(self):
+        """report the end of the running stage"""
+        self.report(done=True)
+        self.stage = None
+
+    def report(self, done=False, now=None):
+        if now is None:
+            now = time.time()
+        self._next_lines = self.lines + self.every_lines
+        self._next_time = now + self.every_seconds
+        elapsed = now - self._start
+        if done:
+            eta = 0.
+        elif self.total_lines and self.lines:
+            eta = elapsed * max(0, self.total_lines - self.lines) / self.lines
+        else:
+            eta = None
+        self.callback(ProgressReport(self.stage, self.lines, self.total_lines, self.bytes, self.layers, elapsed,
+                                     eta, done))
+
+    def iter_layers(self, layers, stage, total_lines=None):
+        """generate layers, counting each as handled by stage once the caller is done with it"""
+        self.start(stage, total_lines)
+        for layer in layers:
+            yield layer
+            self.update(len(layer), layers=1)
+        self.finish()
+
+    def iter_batches(self, data, stage, total_lines=None):
+        """generate lists of raw lines out of data, counting each as handled by stage (lines and bytes) once
+        the caller is done with it"""
+        self.start(stage, total_lines)
+        data = iter(data)
+        while True:
+            batch = list(islice(data, PARSE_BATCH))
+            if not batch:
+                break
+            yield batch
+            self.update(len(batch), sum(map(len, batch)))
+        self.finish()
+
+
+def progress_layers(gcode, stage):
+    """return the layers of a GCode program, counted as handled by stage in its progress if it has one"""
+    layers = gcode.all_layers
+    if gcode.progress is None:
+        return layers
+    return gcode.progress.iter_layers(layers, stage, sum(len(layer) for layer in layers))
@@ -0,0 +1,236 @@
+"""Spatial index of the toolpath of a layer
+
+The moves of a layer are cut into straight segments in the X/Y plane (arcs being approximated by chords)
+and bucketed into a uniform grid of square cells, each segment being registered in every cell it crosses.
+Range and nearest queries then only measure the segments of the cells around the queried point instead of
+walking every line of the layer.
+"""
+
+import math
+from collections import namedtuple
+
+__author__ = 'olivier'
+
+# mm, side of the grid cells, of the order of the length of extrusion moves
+DEFAULT_CELL_SIZE = 5.0
+
+# radian, maximum angle swept by each of the chords approximating an arc
+ARC_STEP = math.pi / 16
+
+# straight part of the toolpath, produced by the move at index line of the layer
+Segment = namedtuple('Segment', ['line', 'x0', 'y0', 'x1', 'y1', 'extruding'])
+
+
+def arc_points(line, x, y):
+    """return the points, after (x, y), of the chords approximating the G2/G3 arc of line starting at (x, y)"""
+    end_x = line.current_x
+    end_y = line.current_y
+    center_x = x + (line.i or 0.)
+    center_y = y + (line.j or 0.)
+    radius = math.hypot(x - center_x, y - center_y)
+    if not radius:
+        return [(end_x, end_y)]
+    start_angle = math.atan2(y - center_y, x - center_x)
+    angle = math.atan2(end_y - center_y, end_x - center_x) - start_angle
+    if line.command == 'G2':
+        angle = -angle
+    if angle <= 0:
+        angle += 2 * math.pi
+    count = int(math.ceil(angle / ARC_STEP))
+    step = angle / count if line.command == 'G3' else -angle / count
+    points = [(center_x + radius * math.cos(start_angle + k * step),
+               center_y + radius * math.sin(start_angle + k * step)) for k in range(1, count)]
+    points.append((end_x, end_y))
+    return points
+
+
+def layer_segments(layer, start=None):
+    """return the Segments of the moves of a layer, the toolhead being at the (x, y) start position before its
+    first line (by default the position of its first move, whose segment is then a single point)"""
+    segments = []
+    if start is None:
+        x = y = None
+    else:
+        x, y = start
+    for line_idx, line in enumerate(layer):
+        if line.current_x is None:
+            continue
+        if line.is_move:
+            if x is None:
+                x, y = line.current_x, line.current_y
+            extruding = bool(line.extruding)
+            if line.command in ('G2', 'G3') and (line.i or line.j):
+                points = arc_points(line, x, y)
+            else:
+                points = [(line.current_x, line.current_y)]
+            for next_x, next_y in points:
+                segments.append(Segment(line_idx, x, y, next_x, next_y, extruding))
+                x, y = next_x, next_y
+        x, y = line.current_x, line.current_y
+    return segments
+
+
+def point_segment_distance(x, y, segment):
+    """distance from (x, y) to the closest point of segment"""
+    dx = segment.x1 - segment.x0
+    dy = segment.y1 - segment.y0
+    length2 = dx * dx + dy * dy
+    if length2:
+        t = ((x - segment.x0) * dx + (y - segment.y0) * dy) / length2
+        t = min(1., max(0., t))
+    else:
+        t = 0.
+    return math.hypot(segment.x0 + t * dx - x, segment.y0 + t * dy - y)
+
+
+def segment_in_rectangle(segment, xmin, ymin, xmax, ymax):
+    """whether some part of segment lies inside the rectangle, clipping it as Liang-Barsky does"""
+    x0, y0 = segment.x0, segment.y0
+    dx = segment.x1 - x0
+    dy = segment.y1 - y0
+    t0, t1 = 0., 1.
+    for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+        if not p:
+            if q < 0:
+                return False
+        else:
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+def _ring_cells(column, row, ring):
+    """generate the cells at the given Chebyshev distance of (column, row)"""
+    if not ring:
+        yield column, row
+        return
+    for ring_column in range(column - ring, column + ring + 1):
+        yield ring_column, row - ring
+        yield ring_column, row + ring
+    for ring_row in range(row - ring + 1, row + ring):
+        yield column - ring, ring_row
+        yield column + ring, ring_row
+
+
+class LayerSpatialIndex(object):
+    """uniform grid index of the Segments of a layer.
+
+    Queries return the indices, in the layer, of the lines whose moves match, in increasing order. The index
+    describes the layer when it was built and has to be built again once the layer is modified."""
+
+    def __init__(self, layer, start=None, cell_size=DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError("cell size must be positive")
+        self.cell_size = float(cell_size)
+        self.segments = layer_segments(layer, start)
+        self.cells = {}
+        self._build()
+
+    def _build(self):
+        cells = self.cells
+        scale = 1. / self.cell_size
+        floor = math.floor
+        for segment_idx, segment in enumerate(self.segments):
+            x0, y0, x1, y1 = segment.x0 * scale, segment.y0 * scale, segment.x1 * scale, segment.y1 * scale
+            if x0 > x1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            column = int(floor(x0))
+            last_column = int(floor(x1))
+            slope = (y1 - y0) / (x1 - x0) if last_column != column else 0.
+            while True:
+                # part of the segment within this column of cells
+                column_y0 = y0 if column == int(floor(x0)) else y0 + (column - x0) * slope
+                column_y1 = y1 if column == last_column else y0 + (column + 1 - x0) * slope
+                if column_y0 > column_y1:
+                    column_y0, column_y1 = column_y1, column_y0
+                for row in range(int(floor(column_y0)), int(floor(column_y1)) + 1):
+                    cell = cells.get((column, row))
+                    if cell is None:
+                        cells[column, row] = [segment_idx]
+                    else:
+                        cell.append(segment_idx)
+                if column == last_column:
+                    break
+                column += 1
+
+    def __len__(self):
+        return len(self.segments)
+
+    def _cell_range(self, xmin, ymin, xmax, ymax):
+        scale = 1. / self.cell_size
+        return (int(math.floor(xmin * scale)), int(math.floor(ymin * scale)),
+                int(math.floor(xmax * scale)), int(math.floor(ymax * scale)))
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        """return the indices of the segments registered in the cells overlapping the rectangle"""
+        first_column, first_row, last_column, last_row = self._cell_range(xmin, ymin, xmax, ymax)
+        cells = self.cells
+        candidates = set()
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > len(cells):
+            # the rectangle covers more cells than there are occupied ones
+            for (column, row), cell in cells.items():
+                if first_column <= column <= last_column and first_row <= row <= last_row:
+                    candidates.update(cell)
+        else:
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    cell = cells.get((column, row))
+                    if cell is not None:
+                        candidates.update(cell)
+        return candidates
+
+    def segments_within(self, x, y, distance):
+        """return the Segments passing within distance of (x, y)"""
+        segments = self.segments
+        return [segments[segment_idx]
+                for segment_idx in sorted(self._candidates(x - distance, y - distance, x + distance, y + distance))
+                if point_segment_distance(x, y, segments[segment_idx]) <= distance]
+
+    def within(self, x, y, distance):
+        """return the indices of the lines whose moves pass within distance of (x, y)"""
+        return sorted(set(segment.line for segment in self.segments_within(x, y, distance)))
+
+    def in_rectangle(self, xmin, ymin, xmax, ymax):
+        """return the indices of the lines whose moves cross the rectangle"""
+        segments = self.segments
+        return sorted(set(segments[segment_idx].line
+                          for segment_idx in self._candidates(xmin, ymin, xmax, ymax)
+                          if segment_in_rectangle(segments[segment_idx], xmin, ymin, xmax, ymax)))
+
+    def nearest(self, x, y, max_distance=None):
+        """return (line index, distance) of the move passing the closest to (x, y), None if there is no move
+        (within max_distance)"""
+        if not self.cells:
+            return None
+        columns = [column for column, _ in self.cells]
+        rows = [row for _, row in self.cells]
+        column, row = self._cell_range(x, y, x, y)[:2]
+        # rings of cells beyond this one can't hold any segment
+        last_ring = max(column - min(columns), max(columns) - column, row - min(rows), max(rows) - row)
+        if max_distance is not None:
+            last_ring = min(last_ring, int(math.ceil(max_distance / self.cell_size)))
+
+        segments = self.segments
+        best = None
+        seen = set()
+        for ring in range(max(0, last_ring) + 1):
+            if best is not None and best[1] <= (ring - 1) * self.cell_size:
+                # segments of this ring and beyond are farther than the best one
+                break
+            for cell in _ring_cells(column, row, ring):
+                for segment_idx in self.cells.get(cell, ()):
+                    if segment_idx in seen:
+                        continue
+                    seen.add(segment_idx)
+                    segment = segments[segment_idx]
+                    distance = point_segment_distance(x, y, segment)
+                    if best is None or (distance, segment.line) < (best[1], best[0]):
+                        best = (segment.line, distance)
+        if best is None or (max_distance is not None and best[1] > max_distance):
+            return None
+        return best
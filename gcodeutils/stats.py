@@ -0,0 +1,225 @@
+"""Per-stage timing and memory statistics of GCode processing
+
+Stats records, for each stage of a job (reading, parsing, preprocessing, each filter, writing), the time
+spent in it, how many times it ran, the number of lines it handled and, when memory is traced, the peak
+of the memory allocated by Python while it ran. Tracing memory with tracemalloc slows parsing down by an
+order of magnitude, so it is off by default, the peak resident memory of the process being reported instead.
+Time spent in a stage nested in another one is only counted in the nested stage, so that the stage times
+add up to the duration of the job.
+
+GCode and GCodeStream accept a Stats to record their parse and preprocess stages, command line tools write
+their statistics as JSON with --stats.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+__author__ = 'olivier'
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def peak_rss():
+    """return the peak resident memory of the process in bytes, None when it isn't available"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Stage(object):
+    """statistics of a stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.
+        self.calls = 0
+        self.lines = 0
+        # bytes, None when memory isn't traced
+        self.peak_memory = None
+
+    @property
+    def lines_per_second(self):
+        if not self.lines or not self.seconds:
+            return None
+        return self.lines / self.seconds
+
+    def to_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'calls': self.calls, 'lines': self.lines,
+                'lines_per_second': self.lines_per_second, 'peak_memory': self.peak_memory}
+
+
+class Stats(object):
+    """statistics of the stages of a job, in the order they first ran.
+
+    With trace_memory, tracemalloc is started by start (if it isn't tracing already) and stopped by stop.
+    The peak of a stage is reset when it starts on python 3.9 and later, before that it is the peak since
+    tracing started."""
+
+    def __init__(self, trace_memory=False):
+        self.stages = []
+        self._stages = {}
+        # stages running, innermost last, with the time spent in their nested stages
+        self._running = []
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self._tracing = False
+        self._start = None
+        self.seconds = None
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._start = _clock()
+
+    def stop(self):
+        if self._start is not None:
+            self.seconds = _clock() - self._start
+            self._start = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __getitem__(self, name):
+        return self._stages[name]
+
+    def __contains__(self, name):
+        return name in self._stages
+
+    def _stage(self, name):
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = Stage(name)
+            self.stages.append(stage)
+        return stage
+
+    def _tracing_memory(self):
+        return self.trace_memory and tracemalloc.is_tracing()
+
+    def _update_peaks(self):
+        """fold the peak since the last reset into the running stages"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for stage, _ in self._running:
+            stage.peak_memory = max(stage.peak_memory or 0, peak)
+
+    @contextmanager
+    def stage(self, name, lines=0):
+        """context in which the named stage runs, handling lines (which can be added to the lines of the
+        yielded Stage)"""
+        stage = self._stage(name)
+        stage.lines += lines
+        tracing = self._tracing_memory()
+        if tracing:
+            self._update_peaks()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        running = [stage, 0.]
+        self._running.append(running)
+        start = _clock()
+        try:
+            yield stage
+        finally:
+            elapsed = _clock() - start
+            if tracing:
+                self._update_peaks()
+            self._running.pop()
+            stage.seconds += elapsed - running[1]
+            stage.calls += 1
+            if self._running:
+                self._running[-1][1] += elapsed
+
+    def timed(self, function, name, lines=0):
+        """return function wrapped to add the time spent in each of its calls, and lines, to the named stage,
+        nested in the running stage. Cheaper than running a stage for each call, for functions called for each
+        line, but their memory peak isn't recorded."""
+        running = self._running
+        timed_stage = []
+
+        def timed_function(*args):
+            start = _clock()
+            try:
+                return function(*args)
+            finally:
+                elapsed = _clock() - start
+                if not timed_stage:
+                    timed_stage.append(self._stage(name))
+                stage = timed_stage[0]
+                stage.seconds += elapsed
+                stage.calls += 1
+                stage.lines += lines
+                if running:
+                    running[-1][1] += elapsed
+
+        return timed_function
+
+    def run_filter(self, gcode_filter, gcode):
+        """filter gcode, timed as a stage named after the filter"""
+        with self.stage(getattr(gcode_filter, 'name', type(gcode_filter).__name__), len(gcode)):
+            gcode_filter.filter(gcode)
+
+    def to_dict(self):
+        peaks = [stage.peak_memory for stage in self.stages if stage.peak_memory is not None]
+        return {'seconds': self.seconds if self.seconds is not None else sum(stage.seconds for stage in self.stages),
+                'peak_memory': max(peaks) if peaks else None,
+                'peak_rss': peak_rss(),
+                'stages': [stage.to_dict() for stage in self.stages]}
+
+    def write(self, output_file):
+        """write the statistics as JSON to a file like object"""
+        json.dump(self.to_dict(), output_file, indent=2, sort_keys=True)
+        output_file.write('\n')
+
+    def save(self, filename):
+        """write the statistics as JSON to filename, '-' standing for the standard error"""
+        if filename == '-':
+            self.write(sys.stderr)
+        else:
+            with open(filename, 'w') as output_file:
+                self.write(output_file)
+
+
+class _NoStage(object):
+    """Stage of jobs without statistics, whatever is recorded is dropped"""
+
+    def __init__(self):
+        self.lines = 0
+
+
+@contextmanager
+def _no_stage():
+    yield _NoStage()
+
+
+def stage(stats, name, lines=0):
+    """return the context of a stage of stats, a context recording nothing when stats is None"""
+    if stats is None:
+        return _no_stage()
+    return stats.stage(name, lines)
+
+
+def run_filter(stats, gcode_filter, gcode):
+    """filter gcode, as a stage of stats unless it is None"""
+    if stats is None:
+        gcode_filter.filter(gcode)
+    else:
+        stats.run_filter(gcode_filter, gcode)
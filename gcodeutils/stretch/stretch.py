@@ -94,7 +94,8 @@ import zlib
 
 import re
 
-from gcodeutils.gcoder import split, Line, parse_coordinates, unsplit, linear_move_gcodes
+from gcodeutils.gcoder import split, GCode, Line, parse_coordinates, unsplit, linear_move_gcodes
+from gcodeutils.progress import progress_layers
 from .vector3 import Vector3
 
 __author__ = 'Enrique Perez (perez_enrique@yahoo.com)'
@@ -298,6 +299,10 @@ class StretchRepository:
 class StretchFilter:
     """A class to stretch a skein of extrusions."""
 
+    # loops being looked ahead and behind within their layer only, layers can be stretched independently
+    # (see gcodeutils.parallel.filter_parallel)
+    layer_local = True
+
     EXTRUSION_ON_MARKER = 'stretch-extrusion-on'
     EXTRUSION_OFF_MARKER = 'stretch-extrusion-off'
     LOOP_START_MARKER = 'stretch-loop-start'
@@ -327,12 +332,50 @@ class StretchFilter:
 
         self.setup_filter()
 
-        for self.current_layer_index, current_layer in enumerate(self.gcode.all_layers):
-            self.current_layer = current_layer[:]
-            for self.line_number_in_layer, line in enumerate(self.current_layer):
-                gcode_line = self.parse_line(line)
-                parse_coordinates(gcode_line, split(gcode_line))
-                self.gcode.all_layers[self.current_layer_index][self.line_number_in_layer] = gcode_line
+        for self.current_layer_index, current_layer in enumerate(progress_layers(self.gcode, type(self).__name__)):
+            self.stretch_layer(current_layer)
+        self.gcode.mark_dirty()
+
+    def stretch_layer(self, layer):
+        """stretch the lines of a layer in place"""
+        self.current_layer = layer[:]
+        for self.line_number_in_layer, line in enumerate(self.current_layer):
+            gcode_line = self.parse_line(line)
+            parse_coordinates(gcode_line, split(gcode_line))
+            layer[self.line_number_in_layer] = gcode_line
+
+    def layer_states(self, gcode):
+        """mark the loops of gcode and return the state of the filter at the start of each of its layers,
+        following the loops without stretching them"""
+        self.gcode = gcode
+        self.setup_filter()
+        self.gcode = self.current_layer = None
+
+        states = []
+        for layer in gcode.all_layers:
+            states.append((self.isLoop, self.thread_maximum_absolute_stretch, self.oldLocation,
+                           self.feedRateMinute))
+            for line in layer:
+                self.update_loop(line)
+                if line.command in linear_move_gcodes and self.isLoop and (line.x is not None or line.y is not None):
+                    self.oldLocation = get_location_from_line(self.oldLocation, line)
+                    self.feedRateMinute = line.f or self.feedRateMinute
+        return states
+
+    def filter_layer_from(self, layer, state):
+        """stretch a layer of a program prepared by layer_states, starting from the state returned for it"""
+        self.isLoop, self.thread_maximum_absolute_stretch, self.oldLocation, self.feedRateMinute = state
+        self.stretch_layer(layer)
+
+    def iter_filter(self, lines):
+        """generate the stretched lines of an iterable of lines. Stretching needs the whole program (its edge
+        width may only be given at its end, and loops are looked ahead and behind), so the lines are buffered
+        and parsed again into a GCode before being stretched"""
+        gcode = GCode([line.raw for line in lines])
+        self.filter(gcode)
+        for layer in gcode.all_layers:
+            for line in layer:
+                yield line
 
     def get_cross_limited_stretch(self, crossLimitedStretch, crossLineIterator, locationComplex):
         """Get cross limited relative stretch for a location."""
@@ -472,8 +515,16 @@ class StretchFilter:
 
     def parse_line(self, line):
         """Parse a gcode line and add it to the stretch skein."""
+        self.update_loop(line)
+
+        # handle move command if in loop
+        if line.command in linear_move_gcodes and self.isLoop and (line.x is not None or line.y is not None):
+            return self.stretch_line(line)
 
-        # check for loop markers
+        return line
+
+    def update_loop(self, line):
+        """check for loop markers"""
         if self.is_inner_edge_begin(line):
             self.isLoop = True
             self.thread_maximum_absolute_stretch = self.edgeInsideAbsoluteStretch
@@ -487,12 +538,6 @@ class StretchFilter:
             self.isLoop = False
             self.set_stretch_to_path()
 
-        # handle move command if in loop
-        if line.command in linear_move_gcodes and self.isLoop and (line.x is not None or line.y is not None):
-            return self.stretch_line(line)
-
-        return line
-
     def set_stretch_to_path(self):
         """Set the thread stretch to path stretch and is loop false."""
         self.isLoop = False
@@ -1,15 +1,41 @@
 import os
 
-from gcodeutils.gcoder import GCode
+from gcodeutils.gcoder import GCode, GCodeStream
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 __author__ = 'olivier'
 
 
+def gcode_file_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+def raw_lines(filename):
+    with open(gcode_file_path(filename)) as gcode:
+        return gcode.readlines()
+
+
 def open_gcode_file(filename):
-    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)) as gcode:
+    with open(gcode_file_path(filename)) as gcode:
         return GCode(gcode.readlines())
 
 
+def open_gcode_stream(filename):
+    with open(gcode_file_path(filename)) as gcode:
+        return GCodeStream(gcode.readlines())
+
+
 def gcode_eq(lhs, rhs):
     if not lhs == rhs:
         raise AssertionError(lhs.diff(rhs))
+
+
+def written(gcode):
+    """return what gcode.write writes"""
+    output = StringIO()
+    gcode.write(output)
+    return output.getvalue()
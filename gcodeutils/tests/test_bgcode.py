@@ -0,0 +1,180 @@
+import io
+import os
+import random
+import shutil
+import tempfile
+
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.bgcode import ASCII, DEFLATE, GCODE_BLOCK_SIZE, HEATSHRINK_11_4, HEATSHRINK_12_4, MEATPACK, \
+    MEATPACK_COMMENTS, NO_COMPRESSION, PNG, BGCodeReader, BGCodeWriter, Thumbnail, bgcode_reader, \
+    heatshrink_compress, heatshrink_decompress, is_bgcode, meatpack_decode, meatpack_encode
+from gcodeutils.compression import carry_metadata, open_gcode
+from gcodeutils.gcoder import GCode
+from gcodeutils.tests import gcode_file_path, open_gcode_file
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'skeinforge_square.gcode', 'slic3r_square.gcode']
+
+work_dir = None
+
+
+def setup_module():
+    global work_dir
+    work_dir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(work_dir)
+
+
+def fixture_text(filename):
+    with io.open(gcode_file_path(filename)) as gcode_file:
+        return gcode_file.read()
+
+
+def encoded(text, **kwargs):
+    output = io.BytesIO()
+    writer = BGCodeWriter(output, **kwargs)
+    # keep the data once the writer closes its file
+    output.close = lambda: None
+    writer.write(text)
+    writer.close()
+    return output.getvalue()
+
+
+def test_heatshrink():
+    # 'a' as a literal, then 3 bytes back referenced at offset 1
+    eq_(heatshrink_decompress(b'\xb0\x80\x08', 8, 4), b'aaaa')
+    random_generator = random.Random(3)
+    for window_bits in (8, 11, 12):
+        for size in (0, 1, 2, 17, 5000):
+            data = bytes(bytearray(random_generator.choice(b'G1 X0.5\n') for _ in range(size)))
+            eq_(heatshrink_decompress(heatshrink_compress(data, window_bits, 4), window_bits, 4), data)
+    data = fixture_text('cura_square.gcode').encode('utf-8') * 10
+    ok_(len(heatshrink_compress(data, 12, 4)) < len(data) / 2)
+
+
+def test_meatpack():
+    # G1, X1 and a newline padded with a newline
+    eq_(meatpack_decode(b'\xff\xff\xfb\xff\xff\xf7\x1d\x1e\xcc'), b'G1 X1\n')
+    # Y isn't packed and follows its byte
+    eq_(meatpack_decode(b'\xff\xff\xfb\xff\xff\xf7\x1d\x2fY\xcc'), b'G1 Y2\n')
+    eq_(meatpack_encode('G1 X1\n'), b'\xff\xff\xfb\xff\xff\xf7\x1d\x1e\xcc')
+    # packing disabled
+    eq_(meatpack_decode(b'G1 X1\n'), b'G1 X1\n')
+
+    text = 'G1 X10.5 Y-2 E.3 ; move\n; comment\nM104 S200\nT0\n\nG28\n'
+    eq_(meatpack_decode(meatpack_encode(text)).decode('utf-8'),
+        'G1 X10.5 Y-2 E.3; move\n; comment\nM104 S200\nT0\nG28\n')
+    eq_(meatpack_decode(meatpack_encode(text, keep_comments=False)).decode('utf-8'),
+        'G1 X10.5 Y-2 E.3\nM104 S200\nT0\nG28\n')
+
+
+def check_round_trip(filename, compression, gcode_encoding):
+    data = encoded(fixture_text(filename), compression=compression, gcode_encoding=gcode_encoding)
+    ok_(is_bgcode(data))
+    reader = io.TextIOWrapper(io.BufferedReader(BGCodeReader(io.BytesIO(data))), encoding='utf-8')
+    eq_(GCode(reader), open_gcode_file(filename))
+
+
+def test_round_trip():
+    for filename in FIXTURES:
+        for compression in (NO_COMPRESSION, DEFLATE, HEATSHRINK_11_4, HEATSHRINK_12_4):
+            for gcode_encoding in (ASCII, MEATPACK, MEATPACK_COMMENTS):
+                check_round_trip(filename, compression, gcode_encoding)
+
+
+def test_blocks():
+    text = ''.join('G1 X%d Y%d E%d\n' % (index % 200, index % 100, index) for index in range(20000))
+    data = encoded(text)
+    reader = io.TextIOWrapper(io.BufferedReader(BGCodeReader(io.BytesIO(data))), encoding='utf-8')
+    eq_(reader.read(), text)
+
+
+def test_metadata():
+    thumbnail = Thumbnail(PNG, 16, 16, b'\x89PNG not really')
+    data = encoded('G28\n', printer_metadata={'printer_model': 'MK4'}, print_metadata={'estimated time': '1m'},
+                   slicer_metadata={'layer_height': '0.2'}, thumbnails=[thumbnail])
+    reader = BGCodeReader(io.BytesIO(data))
+    eq_(dict(reader.file_metadata), {'Producer': 'gcodeutils'})
+    eq_(dict(reader.printer_metadata), {'printer_model': 'MK4'})
+    eq_(dict(reader.print_metadata), {'estimated time': '1m'})
+    eq_(dict(reader.slicer_metadata), {'layer_height': '0.2'})
+    eq_(reader.thumbnails, [thumbnail])
+    eq_(reader.read(), b'G28\n')
+
+
+@raises(ValueError)
+def test_checksum():
+    data = bytearray(encoded('G28\n'))
+    data[-6] ^= 1
+    BGCodeReader(io.BytesIO(bytes(data))).read()
+
+
+def test_open_gcode():
+    path = os.path.join(work_dir, 'cura_square.bgcode')
+    gcode = open_gcode_file('cura_square.gcode')
+    output_file = open_gcode(path, 'w')
+    ok_(isinstance(output_file, BGCodeWriter))
+    gcode.write(output_file)
+    output_file.close()
+    with io.open(path, 'rb') as raw_file:
+        ok_(is_bgcode(raw_file.read(4)))
+    with open_gcode(path) as input_file:
+        eq_(GCode(input_file), gcode)
+
+
+# file laid out as PrusaSlicer writes them (metadata, two PNG thumbnails, deflate and heatshrink compressed
+# GCode blocks), encoded by hand following the libbgcode specification rather than by BGCodeWriter
+SLICED_FIXTURE = 'prusaslicer_mk4.bgcode'
+
+
+def check_sliced_metadata(reader):
+    eq_(dict(reader.file_metadata), {'Producer': 'PrusaSlicer 2.6.1+win64'})
+    eq_('MK4', reader.printer_metadata['printer_model'])
+    eq_(12, len(reader.printer_metadata))
+    eq_('3', reader.print_metadata['total layers count'])
+    eq_('0x0,250x0,250x210,0x210', reader.slicer_metadata['bed_shape'])
+    eq_([(PNG, 16, 16), (PNG, 313, 173)], [thumbnail[:3] for thumbnail in reader.thumbnails])
+    for thumbnail in reader.thumbnails:
+        ok_(thumbnail.data.startswith(b'\x89PNG'))
+
+
+def test_sliced_file():
+    with open_gcode(gcode_file_path(SLICED_FIXTURE)) as input_file:
+        eq_(';TYPE:Custom\n; printing object prusaslicer_mk4\n' + fixture_text('simple3.gcode'), input_file.read())
+        check_sliced_metadata(bgcode_reader(input_file))
+
+
+def test_metadata_carried():
+    path = os.path.join(work_dir, 'rewritten.bgcode')
+    input_file = open_gcode(gcode_file_path(SLICED_FIXTURE))
+    # as command line tools do, the output is opened before the input is read
+    output_file = open_gcode(path, 'w')
+    gcode = GCode(input_file)
+    input_file.close()
+    ok_(carry_metadata(input_file, output_file))
+    gcode.write(output_file)
+    output_file.close()
+
+    with open_gcode(path) as rewritten:
+        eq_(GCode(rewritten), gcode)
+        reader = bgcode_reader(rewritten)
+        check_sliced_metadata(reader)
+        eq_(bgcode_reader(open_gcode(gcode_file_path(SLICED_FIXTURE))).thumbnails, reader.thumbnails)
+
+
+def test_metadata_not_carried():
+    with open_gcode(gcode_file_path('simple3.gcode')) as input_file:
+        ok_(not carry_metadata(input_file, BGCodeWriter(io.BytesIO())))
+    with open_gcode(gcode_file_path(SLICED_FIXTURE)) as input_file:
+        ok_(not carry_metadata(input_file, io.StringIO()))
+
+
+@raises(ValueError)
+def test_metadata_already_written():
+    writer = BGCodeWriter(io.BytesIO())
+    writer.write('G28\n' * GCODE_BLOCK_SIZE)
+    writer.copy_metadata(BGCodeReader(io.BytesIO(encoded('G28\n'))))
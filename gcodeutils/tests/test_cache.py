@@ -0,0 +1,125 @@
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.cache import GCodeCache, dump_gcode, load_gcode, parse_gcode
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.gcoder import Line
+from gcodeutils.tests import open_gcode_file, gcode_eq, raw_lines
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'skeinforge_square.gcode',
+            'empty_for_good.gcode']
+
+cache_dir = None
+
+
+def setup_module():
+    global cache_dir
+    cache_dir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(cache_dir)
+
+
+def check_same_gcode(gcode, loaded):
+    gcode_eq(gcode, loaded)
+    eq_(len(gcode.all_layers), len(loaded.all_layers))
+    eq_(gcode.append_layer_id, loaded.append_layer_id)
+    for layer, loaded_layer in zip(gcode.all_layers, loaded.all_layers):
+        eq_(layer.z, loaded_layer.z)
+        eq_(layer.state, loaded_layer.state)
+        eq_(layer.snapshot, loaded_layer.snapshot)
+        eq_([(line.raw, line.current_x, line.current_y, line.current_z, line.current_e, line.extruding)
+             for line in layer],
+            [(line.raw, line.current_x, line.current_y, line.current_z, line.current_e, line.extruding)
+             for line in loaded_layer])
+    eq_(list(gcode.layer_idxs), list(loaded.layer_idxs))
+    eq_(list(gcode.line_idxs), list(loaded.line_idxs))
+    eq_(gcode.all_zs, loaded.all_zs)
+    eq_(gcode.duration, loaded.duration)
+    eq_(gcode.filament_length, loaded.filament_length)
+    eq_((gcode.xmin, gcode.xmax, gcode.ymin, gcode.ymax, gcode.zmin, gcode.zmax),
+        (loaded.xmin, loaded.xmax, loaded.ymin, loaded.ymax, loaded.zmin, loaded.zmax))
+
+
+def test_serialization():
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        check_same_gcode(gcode, load_gcode(dump_gcode(gcode)))
+
+
+def test_loaded_gcode_can_be_modified():
+    gcode = open_gcode_file('simple3.gcode')
+    loaded = load_gcode(dump_gcode(gcode))
+
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+    GCodeToRelativeExtrusionFilter().filter(loaded)
+    gcode_eq(gcode, loaded)
+    eq_(gcode.append("G1 X10 E1").current_e, loaded.append("G1 X10 E1").current_e)
+
+
+def test_loaded_layers_preprocessed_again():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    loaded = load_gcode(dump_gcode(gcode))
+    layer = loaded.all_layers[3]
+    eq_(gcode.all_layers[4].state, layer.preprocess())
+
+    # refreshing resumes from the snapshot of the first modified layer
+    layer[0:0] = [Line('G92 E0')]
+    loaded.mark_dirty(3)
+    loaded.refresh()
+    gcode.all_layers[3][0:0] = [Line('G92 E0')]
+    gcode.mark_dirty(3)
+    gcode.refresh()
+    check_same_gcode(gcode, loaded)
+
+
+def test_appended_lines():
+    gcode = open_gcode_file('simple3.gcode')
+    gcode.append("G1 X10 E1")
+    loaded = load_gcode(dump_gcode(gcode))
+    check_same_gcode(gcode, loaded)
+    eq_(['G1 X10 E1'], [line.raw for line in loaded.append_layer])
+    eq_(len(loaded.lines), sum(len(layer) for layer in loaded.all_layers))
+
+
+@raises(ValueError)
+def test_pickle_not_loaded():
+    load_gcode(zlib.compress(pickle.dumps({'version': 3})))
+
+
+def test_cache_hit():
+    lines = raw_lines('cura_square.gcode')
+    cache = GCodeCache(cache_dir)
+    key = cache.key(lines)
+
+    ok_(cache.load(key) is None)
+    check_same_gcode(open_gcode_file('cura_square.gcode'), cache.parse(lines))
+    ok_(os.path.exists(cache.path(key)))
+    check_same_gcode(open_gcode_file('cura_square.gcode'), parse_gcode(lines, cache_dir))
+
+    # the cached program isn't altered by modifications of the returned one
+    GCodeToRelativeExtrusionFilter().filter(cache.parse(lines))
+    check_same_gcode(open_gcode_file('cura_square.gcode'), cache.parse(lines))
+
+
+def test_key():
+    lines = raw_lines('simple3.gcode')
+    eq_(GCodeCache.key(lines), GCodeCache.key([line + '  ' for line in lines]))
+    ok_(GCodeCache.key(lines) != GCodeCache.key(lines[:-1]))
+    ok_(GCodeCache.key(lines) != GCodeCache.key(lines, home_pos=(1, 2, 3)))
+
+
+def test_eviction():
+    cache = GCodeCache(tempfile.mkdtemp(dir=cache_dir), max_size=1)
+    cache.parse(raw_lines('simple3.gcode'))
+    cache.parse(raw_lines('cura_square.gcode'))
+    # only the most recent entry is kept, even if over the size limit
+    eq_([cache.key(raw_lines('cura_square.gcode')) + '.gcache'], os.listdir(cache.directory))
@@ -0,0 +1,48 @@
+from unittest import SkipTest
+
+from nose.tools import eq_, assert_almost_equal
+
+from gcodeutils.tests import open_gcode_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'olivier'
+
+
+def setup_module():
+    if numpy is None:
+        raise SkipTest("NumPy is not available")
+
+
+def test_columns_match_lines():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    columns = gcode.to_arrays()
+
+    lines = [line for layer in gcode.all_layers for line in layer]
+    eq_(len(lines), len(columns))
+    eq_([line.command for line in lines], [columns.commands[code] if code >= 0 else None
+                                           for code in columns.command])
+    for line, x in zip(lines, columns.x):
+        eq_(line.x is None, bool(numpy.isnan(x)))
+    eq_(len(gcode.all_layers), columns.layers_count)
+
+
+def test_vectorized_statistics():
+    gcode = open_gcode_file('simple3.gcode')
+    columns = gcode.to_arrays()
+
+    assert_almost_equal(gcode.filament_length, columns.filament_length())
+    xmin, xmax, ymin, ymax, _, _ = columns.bounding_box()
+    assert_almost_equal(gcode.xmin, xmin)
+    assert_almost_equal(gcode.xmax, xmax)
+    assert_almost_equal(gcode.ymin, ymin)
+    assert_almost_equal(gcode.ymax, ymax)
+
+    stats = columns.layer_stats()
+    eq_(sum(len(layer) for layer in gcode.all_layers), stats['lines'].sum())
+    assert_almost_equal(gcode.current_e, stats['extruded'].sum())
+    eq_(int(columns.command_mask('G1').sum()),
+        sum(1 for layer in gcode.all_layers for line in layer if line.command == 'G1'))
@@ -0,0 +1,107 @@
+import gzip
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.compression import GZIP, XZ, ZSTD, BackgroundCompressingWriter, GCodeFileType, \
+    available_compressions, compression_from_filename, detect_compression, open_gcode
+from gcodeutils.gcoder import GCode
+from gcodeutils.tests import gcode_file_path, open_gcode_file
+
+__author__ = 'olivier'
+
+EXTENSIONS = {GZIP: '.gz', XZ: '.xz', ZSTD: '.zst'}
+
+work_dir = None
+
+
+def setup_module():
+    global work_dir
+    work_dir = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(work_dir)
+
+
+def fixture_text(filename):
+    with io.open(gcode_file_path(filename)) as gcode_file:
+        return gcode_file.read()
+
+
+def test_detection():
+    eq_(compression_from_filename('part.gcode.gz'), GZIP)
+    eq_(compression_from_filename('PART.GCODE.XZ'), XZ)
+    eq_(compression_from_filename('part.gcode.zst'), ZSTD)
+    eq_(compression_from_filename('part.gcode'), None)
+    eq_(detect_compression(gzip.compress(b'G28') if hasattr(gzip, 'compress') else b'\x1f\x8b\x08'), GZIP)
+    eq_(detect_compression(b'G28\n'), None)
+    eq_(detect_compression(b''), None)
+
+
+def test_round_trip():
+    gcode = open_gcode_file('cura_square.gcode')
+    for compression in available_compressions() + [None]:
+        path = os.path.join(work_dir, 'cura_square.gcode' + EXTENSIONS.get(compression, ''))
+        output_file = open_gcode(path, 'w')
+        eq_(isinstance(output_file, BackgroundCompressingWriter), compression is not None)
+        gcode.write(output_file)
+        output_file.close()
+
+        with io.open(path, 'rb') as raw_file:
+            eq_(detect_compression(raw_file.read(6)), compression)
+        with open_gcode(path) as input_file:
+            eq_(GCode(input_file), gcode)
+
+
+def test_small_writes():
+    path = os.path.join(work_dir, 'small.gcode.gz')
+    text = fixture_text('simple1.gcode')
+    with open_gcode(path, 'w') as output_file:
+        for line in text.splitlines(True):
+            output_file.write(line)
+        output_file.flush()
+    with open_gcode(path) as input_file:
+        eq_(input_file.read(), text)
+
+
+@raises(ValueError)
+def test_write_after_close():
+    output_file = open_gcode(os.path.join(work_dir, 'closed.gcode.gz'), 'w')
+    output_file.close()
+    output_file.write(u"G28\n")
+
+
+def test_file_type():
+    file_type = GCodeFileType('w')
+    eq_(file_type('-'), sys.stdout)
+    try:
+        GCodeFileType('r')(os.path.join(work_dir, 'missing.gcode'))
+    except Exception as e:
+        ok_('missing.gcode' in str(e))
+    else:
+        raise AssertionError("missing file opened")
+
+
+def test_command_line():
+    """compressed program on standard input, compressed output file"""
+    path = os.path.join(work_dir, 'translated.gcode.gz')
+    with io.open(gcode_file_path('simple1.gcode'), 'rb') as gcode_file:
+        compressed = gzip.compress(gcode_file.read()) if hasattr(gzip, 'compress') else None
+    if compressed is None:  # python 2
+        return
+    process = subprocess.Popen([sys.executable, '-m', 'gcodeutils.gcode_mod', '-x', '10', '-', path],
+                               stdin=subprocess.PIPE)
+    process.communicate(compressed)
+    eq_(process.returncode, 0)
+
+    with open_gcode(path) as input_file:
+        translated = GCode(input_file)
+    reference = open_gcode_file('simple1.gcode')
+    eq_(len(translated), len(reference))
+    eq_(translated.xmin, reference.xmin + 10)
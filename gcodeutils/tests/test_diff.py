@@ -0,0 +1,52 @@
+from nose.tools import eq_
+
+from gcodeutils.diff import ADDED, CHANGED, REMOVED, semantic_diff
+from gcodeutils.gcoder import GCode
+from gcodeutils.mapped import MappedGCode
+from gcodeutils.tests import gcode_file_path, open_gcode_file
+
+__author__ = 'olivier'
+
+PROGRAM = ["G28", "G90", "G1 Z0.2 F7800", "G1 X1 Y1 E1", "G1 X2 Y1 E2 ; perimeter", "G1 Z0.4",
+           "G1 X1 Y2 E3", "G1 X2 Y2 E4", "G1 Z0.6", "G1 X3 Y3 E5"]
+
+
+def differences(lines, other_lines):
+    return [(difference.kind, difference.layer, difference.line, difference.other_layer, difference.other_line)
+            for difference in semantic_diff(GCode(lines), GCode(other_lines))]
+
+
+def test_same_programs():
+    for filename in ['cura_square.gcode', 'slic3r_square.gcode', 'arc_raw_1.gcode']:
+        eq_(list(semantic_diff(open_gcode_file(filename), open_gcode_file(filename))), [])
+    eq_(open_gcode_file('simple1.gcode').diff(open_gcode_file('simple1_equivalent.gcode')), None)
+
+
+def test_comments_and_tolerance():
+    other = list(PROGRAM)
+    # within EQ_EPSILON, but quantized differently
+    other[4] = "G1 X2.0006 Y1.0 E2 ; outer perimeter"
+    other.insert(6, "; comment")
+    eq_(differences(PROGRAM, other), [])
+
+
+def test_every_difference():
+    other = list(PROGRAM)
+    other[3] = "G1 X1.5 Y1 E1"
+    del other[7]
+    other.append("G1 X4 Y4 E6")
+    eq_(differences(PROGRAM, other),
+        [(CHANGED, 1, 1, 1, 1), (REMOVED, 2, 2, None, None), (ADDED, None, None, 3, 2)])
+
+
+def test_diff_message():
+    message = open_gcode_file('simple1.gcode').diff(open_gcode_file('simple1_slightly_different.gcode'))
+    eq_(message, "layer 0 line 1 vs layer 0 line 1: 'G0 X0' vs 'G0 X0.01'")
+
+
+def test_mapped():
+    gcode = open_gcode_file('simple2.gcode')
+    with MappedGCode(gcode_file_path('simple1.gcode')) as mapped:
+        eq_(list(semantic_diff(mapped, gcode)), list(semantic_diff(open_gcode_file('simple1.gcode'), gcode)))
+        # layers are compared without being kept
+        eq_([layer for layer in mapped.all_layers[:-1] if layer.loaded], [])
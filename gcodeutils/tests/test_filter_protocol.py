@@ -0,0 +1,80 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.filter import DROP, SPLICE_LIMIT, GCodeFilter
+from gcodeutils.gcoder import Layer, Line, raw_to_line, tokenize
+
+__author__ = 'olivier'
+
+
+class IndexedFilter(GCodeFilter):
+    """filter handling each line according to its X"""
+
+    def opcode_filter(self, opcode):
+        x = int(opcode.x)
+        if x % 5 == 1:
+            return DROP
+        if x % 5 == 2:
+            opcode.y = 1.
+            return opcode
+        if x % 5 == 3:
+            return parsed_line('G1 X%d Y2' % x)
+        if x % 5 == 4:
+            return [opcode, raw_to_line('M117 %d' % x)]
+
+
+def parsed_line(raw):
+    line = Line(raw)
+    tokenize(line)
+    return line
+
+
+def numbered_layer(count):
+    return Layer([parsed_line('G1 X%d' % x) for x in range(count)])
+
+
+def raws_and_y(lines):
+    return [(line.raw, line.y) for line in lines]
+
+
+def expected_raws(count):
+    raws = []
+    for x in range(count):
+        if x % 5 == 0:
+            raws.append(('G1 X%d' % x, None))
+        elif x % 5 == 2:
+            raws.append(('G1 X%d' % x, 1.))
+        elif x % 5 == 3:
+            raws.append(('G1 X%d Y2' % x, 2.))
+        elif x % 5 == 4:
+            raws += [('G1 X%d' % x, None), ('M117 %d' % x, None)]
+    return raws
+
+
+def check_parse_layer(count):
+    layer = numbered_layer(count)
+    kept = [line for line in layer if int(line.x) % 5 == 0]
+    gcode_filter = IndexedFilter()
+
+    ok_(gcode_filter.parse_layer(layer, gcode_filter.opcode_filter))
+    eq_(expected_raws(count), raws_and_y(layer))
+    # kept lines are the very same objects
+    eq_(kept, [line for line in layer if line.x is not None and int(line.x) % 5 == 0])
+
+
+def test_parse_layer():
+    # spliced at each expansion
+    check_parse_layer(10)
+    # rebuilt at once
+    check_parse_layer(10 * SPLICE_LIMIT)
+
+
+def test_kept_layer_untouched():
+    layer = numbered_layer(20)
+    lines = list(layer)
+    gcode_filter = IndexedFilter()
+    ok_(not gcode_filter.parse_layer(layer, lambda opcode: None))
+    eq_(lines, list(layer))
+
+
+def test_iter_filter():
+    eq_(expected_raws(12), raws_and_y(IndexedFilter().iter_filter(numbered_layer(12))))
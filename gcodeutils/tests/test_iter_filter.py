@@ -0,0 +1,67 @@
+from nose.tools import eq_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.pipeline import FilterPipeline
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.stretch.stretch import Slic3rStretchFilter, SkeinforgeStretchFilter
+from gcodeutils.tests import open_gcode_file, open_gcode_stream, written
+from gcodeutils.writer import GCodeWriter
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+__author__ = 'olivier'
+
+
+def written_lines(lines):
+    output = StringIO()
+    with GCodeWriter(output) as writer:
+        writer.write_iter(lines)
+    return output.getvalue()
+
+
+def check_iter_filter(filename, make_filter):
+    gcode = open_gcode_file(filename)
+    make_filter().filter(gcode)
+
+    eq_(written(gcode), written_lines(make_filter().iter_filter(open_gcode_stream(filename))))
+
+
+def test_translate():
+    check_iter_filter('simple1.gcode', lambda: GCodeXYTranslateFilter(x=1.5, y=-2))
+
+
+def test_relative_extrusion():
+    check_iter_filter('simple3.gcode', GCodeToRelativeExtrusionFilter)
+
+
+def test_arc_optimizer():
+    for filename in ('arc_raw_1.gcode', 'arc_raw_2.gcode', 'arc_raw_4.gcode'):
+        check_iter_filter(filename, GCodeArcOptimizerFilter)
+
+
+def test_stretch():
+    check_iter_filter('slic3r_square.gcode', Slic3rStretchFilter)
+    check_iter_filter('skeinforge_model1_prestretch.gcode', SkeinforgeStretchFilter)
+
+
+def test_pipeline():
+    check_iter_filter('arc_raw_1.gcode', lambda: FilterPipeline(GCodeXYTranslateFilter(x=3),
+                                                                GCodeToRelativeExtrusionFilter(),
+                                                                GCodeArcOptimizerFilter()))
+
+
+def test_lazy():
+    consumed = []
+
+    def lines():
+        for line in open_gcode_stream('arc_raw_1.gcode'):
+            consumed.append(line)
+            yield line
+
+    filtered = FilterPipeline(GCodeXYTranslateFilter(x=3), GCodeToRelativeExtrusionFilter()).iter_filter(lines())
+    next(filtered)
+    eq_(1, len(consumed))
@@ -0,0 +1,53 @@
+from nose.tools import eq_
+
+from gcodeutils.gcoder import GCode, layer_height_hint_exp
+
+__author__ = 'olivier'
+
+# z 0.705 is too close to the previous layer to be a layer on its own, which requires a layer height
+PROGRAM = [";Layer height: 0.25",
+           "G1 Z0.3", "G1 X1 E1", "G1 Z0.5", "G1 X2 E2", "G1 Z0.7", "G1 X3 E3",
+           "G1 Z0.705", "G1 X4 E4", "G1 Z0.9", "G1 X5 E5"]
+
+
+def layer_zs(gcode):
+    return [layer.z for layer in gcode.all_layers if layer.z is not None]
+
+
+def test_estimated_layer_height():
+    gcode = GCode(PROGRAM)
+    eq_(0.2, gcode.est_layer_height)
+    eq_([0.3, 0.5, 0.7, 0.6, 0.9], layer_zs(gcode))
+
+
+def test_explicit_layer_height():
+    gcode = GCode(PROGRAM, layer_height=0.25)
+    eq_(0.25, gcode.est_layer_height)
+    eq_([0.3, 0.5, 0.7, 0.5, 0.9], layer_zs(gcode))
+
+
+def test_slicer_layer_height_hint():
+    gcode = GCode(PROGRAM, slicer_hints=True)
+    eq_(0.25, gcode.layer_height)
+    eq_(0.25, gcode.est_layer_height)
+    eq_([0.3, 0.5, 0.7, 0.5, 0.9], layer_zs(gcode))
+
+
+def test_slicer_layer_height_hint_at_end():
+    # Slic3r and PrusaSlicer write their configuration at the end of the program
+    program = PROGRAM[1:] + ["; avoid_crossing_perimeters = 0", "; first_layer_height = 0.3", "; layer_height = 0.25"]
+    gcode = GCode(program, slicer_hints=True)
+    eq_(0.25, gcode.layer_height)
+    eq_(0.25, gcode.est_layer_height)
+    eq_([0.3, 0.5, 0.7, 0.5, 0.9], layer_zs(gcode))
+
+
+def test_layer_height_hints():
+    for comment, height in [(";Layer height: 0.1", "0.1"),
+                            ("; layer_height = 0.2", "0.2"),
+                            (";   layerHeight,0.25", "0.25"),
+                            ("(<layerHeight> 0.4 </layerHeight>)", "0.4")]:
+        eq_(height, layer_height_hint_exp.match(comment).group(1))
+
+    for comment in ["; first_layer_height = 0.3", ";LAYER:5", "G1 Z0.2 ; layer height 0.2"]:
+        eq_(None, layer_height_hint_exp.match(comment))
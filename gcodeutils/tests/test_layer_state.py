@@ -0,0 +1,98 @@
+import pickle
+
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, GCodeState, Layer, Line
+from gcodeutils.tests import open_gcode_file, open_gcode_stream, written
+
+__author__ = 'olivier'
+
+
+def preprocessed(layer):
+    return [(line.current_x, line.current_y, line.current_z, line.current_e, line.current_f, line.relative,
+             line.relative_e, line.extruding) for line in layer]
+
+
+def test_layer_preprocessed_on_its_own():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    for layer_idx, layer in enumerate(gcode.all_layers[:-1]):
+        ok_(isinstance(layer.state, GCodeState))
+        expected = preprocessed(layer)
+        copy = Layer([Line(line.raw) for line in layer], layer.z)
+        copy.state = layer.state
+        end_state = copy.preprocess()
+        eq_(expected, preprocessed(copy))
+        if layer_idx + 1 < len(gcode.all_layers) - 1:
+            eq_(gcode.all_layers[layer_idx + 1].state, end_state)
+
+
+def test_stream_states():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    eq_([layer.state for layer in gcode.all_layers[:-1]],
+        [layer.state for layer in open_gcode_stream('arc_raw_1.gcode').layers()])
+
+
+@raises(ValueError)
+def test_state_not_recorded():
+    Layer([Line('G1 X1')]).preprocess()
+
+
+def test_filter_state():
+    translate = GCodeXYTranslateFilter(x=1, y=2)
+    eq_((1, 2, False, None, False), translate.get_state())
+    translate.set_state((3., 4., False, True, False))
+    eq_(3., translate.translate_x)
+    eq_((3., 4., False, True, False), pickle.loads(pickle.dumps(translate.get_state())))
+
+
+def check_layer_states(filename, make_filter):
+    gcode = open_gcode_file(filename)
+    sequential = make_filter()
+    expected = []
+    for layer in gcode.all_layers:
+        expected.append(sequential.get_state())
+        sequential.filter_layer(layer)
+
+    gcode = open_gcode_file(filename)
+    raws = written(gcode)
+    gcode_filter = make_filter()
+    eq_(expected, gcode_filter.layer_states(gcode))
+    # neither the program nor the filter have changed
+    eq_(raws, written(gcode))
+    eq_(make_filter().get_state(), gcode_filter.get_state())
+
+
+def test_layer_states():
+    check_layer_states('arc_raw_1.gcode', lambda: GCodeXYTranslateFilter(x=1, y=2))
+    check_layer_states('arc_raw_1.gcode', GCodeToRelativeExtrusionFilter)
+    check_layer_states('simple3.gcode', GCodeToRelativeExtrusionFilter)
+
+
+def test_layer_states_mode_changes():
+    program = ["G90", "M82", "G1 Z0.2 F600", "G1 X1 Y1 E1", "G92 E0", "G1 X2 E0.5",
+               "G1 Z0.4", "G1 X3 E1.5", "M83", "G1 X4 E0.5", "G92 X0", "G1 X1 Y2",
+               "G1 Z0.6", "M82", "G92", "G1 X5 E2", "G91", "G1 X1 E1",
+               "G1 Z0.2", "G90", "G92 Y3 E4", "G1 X2 Y5 E5"]
+    for make_filter in (lambda: GCodeXYTranslateFilter(x=1, y=2), GCodeToRelativeExtrusionFilter):
+        sequential = make_filter()
+        expected = []
+        for layer in GCode(program).all_layers:
+            expected.append(sequential.get_state())
+            sequential.filter_layer(layer)
+        eq_(expected, make_filter().layer_states(GCode(program)))
+        # the state changes from layer to layer
+        ok_(len(set(map(repr, expected))) > 2)
+
+
+def test_layer_filtered_from_state():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    states = GCodeToRelativeExtrusionFilter().layer_states(gcode)
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+
+    # any layer gets filtered as it is in the whole program
+    for layer_idx in reversed(range(len(states))):
+        layer = open_gcode_file('arc_raw_1.gcode').all_layers[layer_idx]
+        GCodeToRelativeExtrusionFilter().filter_layer_from(layer, states[layer_idx])
+        eq_([line.raw for line in gcode.all_layers[layer_idx]], [line.raw for line in layer])
@@ -0,0 +1,92 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.mapped import MappedGCode
+from gcodeutils.tests import gcode_file_path, open_gcode_file, gcode_eq, written
+from gcodeutils.visit.iterator import GCodeIterator
+from gcodeutils.visit.pause_at_layer import PauseAtLayer
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'skeinforge_square.gcode',
+            'slic3r_square.gcode', 'empty_for_good.gcode']
+
+
+def check_same_as_gcode(filename):
+    gcode = open_gcode_file(filename)
+    with MappedGCode(gcode_file_path(filename)) as mapped:
+        eq_(len(gcode), len(mapped))
+        eq_(gcode.layers_count, mapped.layers_count)
+        eq_(gcode.all_zs, mapped.all_zs)
+        eq_(gcode.duration, mapped.duration)
+        eq_(gcode.filament_length, mapped.filament_length)
+        eq_((gcode.xmin, gcode.xmax, gcode.ymin, gcode.ymax, gcode.zmin, gcode.zmax),
+            (mapped.xmin, mapped.xmax, mapped.ymin, mapped.ymax, mapped.zmin, mapped.zmax))
+        # nothing has been parsed to answer the above
+        ok_(not any(layer.loaded for layer in mapped.all_layers[:-1]))
+
+        eq_(len(gcode.all_layers), len(mapped.all_layers))
+        for layer, mapped_layer in zip(gcode.all_layers, mapped.all_layers):
+            eq_(layer.z, mapped_layer.z)
+            eq_(getattr(layer, 'duration', None), getattr(mapped_layer, 'duration', None))
+            eq_([(line.raw, line.current_x, line.current_y, line.current_z, line.current_e) for line in layer],
+                [(line.raw, line.current_x, line.current_y, line.current_z, line.current_e)
+                 for line in mapped_layer])
+
+        for i in range(len(gcode)):
+            eq_(gcode.idxs(i), mapped.idxs(i))
+
+        gcode_eq(gcode, mapped)
+        eq_(written(gcode), written(mapped))
+
+
+def test_same_as_gcode():
+    for filename in FIXTURES:
+        check_same_as_gcode(filename)
+
+
+def test_write_unloaded():
+    with MappedGCode(gcode_file_path('simple3.gcode')) as mapped:
+        eq_(written(open_gcode_file('simple3.gcode')), written(mapped))
+        ok_(not any(layer.loaded for layer in mapped.all_layers[:-1]))
+
+
+def test_filtered():
+    gcode = open_gcode_file('simple3.gcode')
+    GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+
+    with MappedGCode(gcode_file_path('simple3.gcode')) as mapped:
+        GCodeXYTranslateFilter(x=1, y=2).filter(mapped)
+        GCodeToRelativeExtrusionFilter().filter(mapped)
+        eq_(written(gcode), written(mapped))
+
+
+def test_pause_at_layer():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    GCodeIterator(gcode, digits_of_precision=3).accept(PauseAtLayer(pause_layer_list=[2]))
+
+    with MappedGCode(gcode_file_path('arc_raw_1.gcode')) as mapped:
+        GCodeIterator(mapped, digits_of_precision=3).accept(PauseAtLayer(pause_layer_list=[2]))
+        eq_(written(gcode), written(mapped))
+
+
+def test_lines_after_edit():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    gcode.prepend_to_layer(['M117 layer 3'], 3)
+
+    with MappedGCode(gcode_file_path('arc_raw_1.gcode')) as mapped:
+        mapped.prepend_to_layer(['M117 layer 3'], 3)
+        eq_(len(gcode), len(mapped))
+        eq_(len(gcode.lines), len(mapped.lines))
+        for i in range(len(gcode)):
+            eq_(gcode.idxs(i), mapped.idxs(i))
+        # indexes are rebuilt without parsing the layers which haven't been edited
+        eq_([3], [layer_idx for layer_idx, layer in enumerate(mapped.all_layers[:-1]) if layer.loaded])
+
+        start = mapped.layer_starts[3]
+        eq_(gcode.lines[start].raw, mapped.lines[start].raw)
+        eq_([line.raw for line in gcode.lines[start - 1:start + 2]],
+            [line.raw for line in mapped.lines[start - 1:start + 2]])
+        eq_([line.raw for line in gcode.lines], [line.raw for line in mapped.lines])
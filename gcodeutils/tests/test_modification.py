@@ -1,7 +1,16 @@
+from nose.tools import eq_, raises
+
 from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
 from gcodeutils.gcode_mod import GCodeXYTranslateFilter
+from gcodeutils.gcode_tempcal import GCodeTempGradient
+from gcodeutils.gcoder import GCode
 from gcodeutils.tests import open_gcode_file, gcode_eq
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 __author__ = 'olivier'
 
 
@@ -39,3 +48,65 @@ def test_trivial_relative_extrusion():
     GCodeToRelativeExtrusionFilter().filter(gcode)
 
     gcode_eq(gcode_oracle, gcode)
+
+
+def check_indexes(gcode):
+    eq_([line for layer in gcode.all_layers for line in layer], gcode.lines)
+    eq_([(layer_idx, line_idx) for layer_idx, layer in enumerate(gcode.all_layers) for line_idx in range(len(layer))],
+        [gcode.idxs(i) for i in range(len(gcode))])
+
+
+def test_prepend_to_layer():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    lines_count = len(gcode)
+
+    for layer_idx in range(len(gcode.all_layers)):
+        eq_(["M117 layer", "M400"], gcode.prepend_to_layer(["M117 layer", " ", "M400"], layer_idx))
+
+    for layer in gcode.all_layers:
+        eq_(["M117 layer", "M400"], [line.raw for line in layer[:2]])
+        eq_(False, layer[0].is_move)
+    eq_(lines_count + 2 * len(gcode.all_layers), len(gcode))
+    check_indexes(gcode)
+
+
+def test_rewrite_layer():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+
+    eq_(["G1 X1", "G1 X2"], gcode.rewrite_layer(["G1 X1", "G1 X2"], 1))
+
+    eq_(["G1 X1", "G1 X2"], [line.raw for line in gcode.all_layers[1]])
+    check_indexes(gcode)
+
+
+def test_append_after_edit():
+    gcode = open_gcode_file('simple1.gcode')
+    gcode.append("M400")
+    check_indexes(gcode)
+    gcode.prepend_to_layer(["M117 start"], 0)
+    gcode.append("M84")
+    check_indexes(gcode)
+    eq_(["M400", "M84"], [line.raw for line in gcode.append_layer])
+
+
+def test_filtered_indexes():
+    gcode = open_gcode_file('simple1.gcode')
+    GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+    check_indexes(gcode)
+
+
+class FailingTempGradient(GCodeTempGradient):
+    def get_temp_for_current_layer(self):
+        if self.current_z > 0.5:
+            raise RuntimeError("no temperature at %.1fmm" % self.current_z)
+        return 200
+
+
+@raises(RuntimeError)
+def test_temp_gradient_flushed_on_error():
+    gcode = GCode(["G1 Z0.2 X1 E1", "G1 Z0.4 X2 E2", "G1 Z0.6 X3 E3", "G1 Z0.8 X4 E4"])
+    output_file = StringIO()
+    try:
+        FailingTempGradient(gcode, start_temp=200, end_temp=220, min_z_change=0.1).write(output_file)
+    finally:
+        eq_("M104 S200.0\nG1 Z0.2 X1 E1\nG1 Z0.4 X2 E2\n", output_file.getvalue())
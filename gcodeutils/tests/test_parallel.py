@@ -0,0 +1,87 @@
+from nose.tools import eq_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.pipeline import FilterPipeline
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.parallel import chunk_ranges, filter_parallel, line_from_values, line_values, parse_parallel
+from gcodeutils.stretch.stretch import CuraStretchFilter, Slic3rStretchFilter, SkeinforgeStretchFilter
+from gcodeutils.tests import open_gcode_file, gcode_file_path, gcode_eq, written
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'skeinforge_square.gcode',
+            'slic3r_square.gcode', 'empty_for_good.gcode']
+
+
+def test_chunk_ranges():
+    filename = gcode_file_path('simple3.gcode')
+    with open(filename, 'rb') as gcode_file:
+        data = gcode_file.read()
+
+    ranges = chunk_ranges(filename, 100)
+    eq_(0, ranges[0][0])
+    eq_(len(data), ranges[-1][1])
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        eq_(end, start)
+        eq_(b'\n', data[end - 1:end])
+
+
+def check_same_as_gcode(filename, processes):
+    gcode = open_gcode_file(filename)
+    parsed = parse_parallel(gcode_file_path(filename), processes=processes, chunk_size=512)
+
+    gcode_eq(gcode, parsed)
+    eq_(len(gcode.all_layers), len(parsed.all_layers))
+    for layer, parsed_layer in zip(gcode.all_layers, parsed.all_layers):
+        eq_(layer.z, parsed_layer.z)
+        eq_([(line.raw, line.current_x, line.current_y, line.current_z, line.current_e, line.extruding)
+             for line in layer],
+            [(line.raw, line.current_x, line.current_y, line.current_z, line.current_e, line.extruding)
+             for line in parsed_layer])
+    eq_(list(gcode.layer_idxs), list(parsed.layer_idxs))
+    eq_(list(gcode.line_idxs), list(parsed.line_idxs))
+    eq_(gcode.all_zs, parsed.all_zs)
+    eq_(gcode.duration, parsed.duration)
+    eq_(gcode.filament_length, parsed.filament_length)
+    # the parsed program tokenizes appended lines as usual
+    eq_(10., parsed.append("G1 X10").x)
+
+
+def test_same_as_gcode():
+    for filename in FIXTURES:
+        check_same_as_gcode(filename, 1)
+    check_same_as_gcode('arc_raw_1.gcode', 2)
+
+
+def test_line_values():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    for line in gcode.lines:
+        copy = line_from_values(line_values(line))
+        eq_(line.raw, copy.raw)
+        eq_(line_values(line), line_values(copy))
+
+
+def check_filter_parallel(filename, make_filter, processes):
+    gcode = open_gcode_file(filename)
+    make_filter().filter(gcode)
+
+    filtered = open_gcode_file(filename)
+    filter_parallel(filtered, make_filter(), processes)
+    eq_(written(gcode), written(filtered))
+    eq_(gcode.filament_length, filtered.filament_length)
+
+
+def test_filter_parallel():
+    for processes in (1, 2):
+        check_filter_parallel('arc_raw_1.gcode', GCodeArcOptimizerFilter, processes)
+        check_filter_parallel('slic3r_square.gcode', Slic3rStretchFilter, processes)
+        check_filter_parallel('cura_square.gcode', CuraStretchFilter, processes)
+        check_filter_parallel('skeinforge_model1_prestretch.gcode', SkeinforgeStretchFilter, processes)
+        check_filter_parallel('simple1.gcode', lambda: GCodeXYTranslateFilter(x=2), processes)
+        check_filter_parallel('arc_raw_1.gcode', lambda: GCodeXYTranslateFilter(x=2, y=-1), processes)
+        check_filter_parallel('arc_raw_1.gcode', GCodeToRelativeExtrusionFilter, processes)
+
+
+def test_filter_parallel_not_layer_local():
+    check_filter_parallel('simple1.gcode', lambda: FilterPipeline(GCodeXYTranslateFilter(x=2)), 2)
@@ -0,0 +1,33 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.gcoder import Line, LightLine, P, S, T, parameter, parameters, raw_to_line
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def test_parameters():
+    eq_({'M': 104., 'S': 200., 'T': 1.}, parameters(Line("M104 S200 T1 ; S100")))
+    eq_({'G': 4., 'P': 500.}, parameters(Line("G4 P500")))
+    eq_({'G': 1., 'X': 1.5, 'Y': -2.}, parameters(Line("G1 (S5) X1.5 Y-2")))
+    eq_({'M': 117., 'H': None}, parameters(Line("M117 Hello")))
+    eq_(None, S(Line("M104 ;S200")))
+    eq_(200., S(Line("M104 S200 S100")))
+    eq_(500., P(Line("G4 P500")))
+    eq_(1., T(Line("M104 T1 S200")))
+    eq_(None, parameter(Line("M104 S."), 'S'))
+    eq_(210., S(LightLine("M104 S210")))
+
+
+def test_memo_follows_raw():
+    line = raw_to_line("M104 S200")
+    eq_(200., S(line))
+    ok_(parameters(line) is parameters(line))
+    line.raw = "M104 S210"
+    eq_(210., S(line))
+
+
+def test_parameter_values():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    eq_([0.], gcode.parameter_values('M104', 'S'))
+    eq_([], gcode.parameter_values('M104', 'Q'))
@@ -0,0 +1,109 @@
+from nose.tools import eq_
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, checksum, patch
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+
+def patched(raw, codes=None, imperial=False, **values):
+    line = GCode([raw]).lines[0]
+    for code, value in values.items():
+        setattr(line, code, value)
+    patch(line, codes, imperial)
+    return line.raw
+
+
+def test_changed_numbers_only():
+    eq_(patched("G1 X10.5 Y20 E1.23456 ; perimeter", x=10.8), "G1 X10.8 Y20 E1.23456 ; perimeter")
+    eq_(patched("G1  X10.5   Y20 S5 E1.23456", e=0.1), "G1  X10.5   Y20 S5 E0.10000")
+    eq_(patched("g1 x1.0 y2", x=1.5), "g1 x1.5 y2")
+    eq_(patched("G1 X1.0 Y2 ; unchanged"), "G1 X1.0 Y2 ; unchanged")
+
+
+def test_precision_kept():
+    # the original number of decimals is kept unless the new value needs more
+    eq_(patched("G1 X10.12345", x=10.22345), "G1 X10.22345")
+    eq_(patched("G1 X10", x=12.), "G1 X12")
+    eq_(patched("G1 X10", x=12.25), "G1 X12.250")
+
+
+def test_added_and_removed_arguments():
+    eq_(patched("G92 ; reset", x=-10., y=-5.), "G92 X-10.000 Y-5.000 ; reset")
+    eq_(patched("G1 X1 E0 Y2 ;c", e=None), "G1 X1 Y2 ;c")
+
+
+def test_command_and_line_number():
+    eq_(patched("N12 G1 X1.0", command="G2", x=3.), "N12 G2 X3.0")
+
+
+def test_checksum():
+    eq_(checksum("N12 G1 X1.0 "), 108)
+    # the checksum of a modified line is computed again, new arguments coming before it
+    eq_(patched("N12 G1 X1.0 *108", command="G2", x=3.), "N12 G2 X3.0 *109")
+    eq_(patched("N3 G1 X1*98 ; c", y=2.), "N3 G1 X1 Y2.000*55 ; c")
+    eq_(patched("N12 G1 X1.0 *108"), "N12 G1 X1.0 *108")
+    # regenerated lines lose their line number and checksum
+    eq_(patched("N3 G1X1*66", x=2.), "G1 X2.000")
+
+
+def test_codes():
+    # only the given arguments are patched
+    eq_(patched("G1 X1.0 Y2.0", 'y', x=3., y=4.), "G1 X1.0 Y4.0")
+
+
+def test_imperial():
+    eq_(patched("G1 X1.0 Y2.0", imperial=True, x=50.8, y=50.8), "G1 X2.0 Y2.0")
+
+
+def test_unsplit_fallback():
+    eq_(patched("G1 X(1) Y2", x=1.5), "G1 X1.500 Y2.000")
+    eq_(patched("G1X1Y2", x=1.5), "G1 X1.500 Y2.000")
+    eq_(patched("G1\tX1 Y2", x=1.5), "G1 X1.500 Y2.000")
+
+
+def test_unchanged_fallback_lines():
+    # lines which would be regenerated by unsplit are kept as is when nothing changed
+    eq_(patched("G1\tX1 Y2"), "G1\tX1 Y2")
+    eq_(patched("G1 X(1) Y2 ; c"), "G1 X(1) Y2 ; c")
+    eq_(patched("G1X1Y2 S5", 'xy'), "G1X1Y2 S5")
+    eq_(patched("M92 E93", 'e'), "M92 E93")
+
+
+def test_comment_parenthesis():
+    # parenthesis in the ; comment don't prevent patching
+    eq_(patched("G1 X1 Y2 S5 ; (x)"), "G1 X1 Y2 S5 ; (x)")
+    eq_(patched("G1 X1 Y2 S5 ; (x)", x=1.5), "G1 X1.500 Y2 S5 ; (x)")
+
+
+def test_filters_keep_formatting():
+    gcode = GCode(["G90", "M82", "G1 X10 Y20.5 E1.5 F1200 ; perimeter", "G1 X11 Y21 E2.25", "G1 Z0.3 F7800"])
+    GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+    eq_([line.raw for line in gcode.lines],
+        ["G90", "M83", "G1 X11 Y22.5 E1.5 F1200 ; perimeter", "G1 X12 Y23 E0.75", "G1 Z0.3 F7800"])
+
+
+def test_filters_keep_comments():
+    gcode = GCode(["G90", "G1 Z0.200 F7800.000 ; move to next layer (0)", "G1 X1 Y2 S5 ; (x)"])
+    GCodeXYTranslateFilter(x=1, y=0).filter(gcode)
+    eq_([line.raw for line in gcode.lines], ["G90", "G1 Z0.200 F7800.000 ; move to next layer (0)",
+                                             "G1 X2 Y2 S5 ; (x)"])
+
+
+def test_filters_imperial():
+    gcode = GCode(["G20", "G90", "M82", "G1 X1 Y1 E0.1", "G1 X2 Y1 E0.3", "G21", "G1 X10 Y10 E20"])
+    GCodeXYTranslateFilter(x=25.4, y=0).filter(gcode)
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+    eq_([line.raw for line in gcode.lines],
+        ["G20", "G90", "M83", "G1 X2 Y1 E0.1", "G1 X3 Y1 E0.2", "G21", "G1 X35.400 Y10 E12.38000"])
+
+
+def test_filters_same_program():
+    for filename in ['cura_square.gcode', 'slic3r_square.gcode', 'simple3.gcode']:
+        gcode = open_gcode_file(filename)
+        GCodeToRelativeExtrusionFilter().filter(gcode)
+        # reparsing the patched lines gives back their values
+        eq_(GCode([line.raw for line in gcode.lines]), gcode)
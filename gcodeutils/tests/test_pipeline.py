@@ -0,0 +1,110 @@
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.filter import GCodeFilter
+from gcodeutils.filter.pipeline import FilterPipeline
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import raw_to_line
+from gcodeutils.stretch.stretch import Slic3rStretchFilter
+from gcodeutils.tests import open_gcode_file, open_gcode_stream, written
+
+__author__ = 'olivier'
+
+
+class CountingFilter(GCodeFilter):
+    """filter keeping every line, counting them"""
+
+    def __init__(self):
+        self.count = 0
+
+    def opcode_filter(self, opcode):
+        self.count += 1
+
+
+class DroppingFilter(GCodeFilter):
+    """filter dropping comments"""
+
+    def opcode_filter(self, opcode):
+        if opcode.command is None:
+            return []
+
+
+class HoldingFilter(GCodeFilter):
+    """filter holding back the last line of the program"""
+
+    def __init__(self):
+        self.held = None
+
+    def opcode_filter(self, opcode):
+        held, self.held = self.held, opcode
+        return [held] if held is not None else []
+
+    def flush(self):
+        return [self.held, raw_to_line('M84')]
+
+
+def chained_filters():
+    return [GCodeXYTranslateFilter(x=1, y=-2), DroppingFilter(), GCodeToRelativeExtrusionFilter(),
+            GCodeArcOptimizerFilter(), GCodeXYTranslateFilter(x=-3)]
+
+
+def test_same_as_filters_in_sequence():
+    for filename in ('arc_raw_1.gcode', 'simple1.gcode', 'slic3r_square.gcode'):
+        sequential = open_gcode_file(filename)
+        for gcode_filter in chained_filters():
+            gcode_filter.filter(sequential)
+
+        chained = open_gcode_file(filename)
+        FilterPipeline(*chained_filters()).filter(chained)
+
+        eq_(written(sequential), written(chained))
+
+
+def test_lines_filtered_once():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    counting_filters = [CountingFilter() for _ in range(5)]
+    FilterPipeline(*counting_filters).filter(gcode)
+
+    eq_([len(gcode.lines)] * 5, [counting_filter.count for counting_filter in counting_filters])
+
+
+def test_flushed_lines_filtered():
+    gcode = open_gcode_file('simple1.gcode')
+    raws = [line.raw for line in gcode.lines]
+    counting_filter = CountingFilter()
+    FilterPipeline(HoldingFilter(), counting_filter).filter(gcode)
+
+    eq_(raws + ['M84'], [line.raw for line in gcode.lines])
+    eq_(len(raws) + 1, counting_filter.count)
+
+
+def test_stream():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    for gcode_filter in chained_filters()[:3]:
+        gcode_filter.filter(gcode)
+
+    stream = open_gcode_stream('arc_raw_1.gcode')
+    stream.add_filter(FilterPipeline(*chained_filters()[:3]))
+    eq_(written(gcode), written(stream))
+
+
+def test_nested_pipelines():
+    pipeline = FilterPipeline(GCodeXYTranslateFilter(x=1), FilterPipeline(DroppingFilter(), CountingFilter()))
+    eq_(3, len(pipeline))
+    eq_('GCodeXYTranslateFilter+DroppingFilter+CountingFilter', pipeline.name)
+    ok_(not FilterPipeline())
+
+
+@raises(ValueError)
+def test_filter_walking_program_not_chained():
+    class LayerFilter(GCodeFilter):
+        def parse_layer(self, layer, opcode_filter):
+            return False
+
+    FilterPipeline(LayerFilter())
+
+
+@raises(TypeError)
+def test_stretch_not_chained():
+    FilterPipeline(Slic3rStretchFilter())
@@ -0,0 +1,100 @@
+from nose.tools import eq_, ok_, assert_almost_equal
+
+from gcodeutils.gcoder import GCode, raw_to_line
+from gcodeutils.planner import MachineLimits, MotionPlanner, numpy
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'skeinforge_square.gcode',
+            'slic3r_square.gcode']
+
+
+def limits(**kwargs):
+    settings = dict(max_feedrate=(1000., 1000., 1000., 1000.), max_acceleration=(10000., 10000., 10000., 10000.),
+                    acceleration=1000., retract_acceleration=1000., travel_acceleration=1000.)
+    settings.update(kwargs)
+    return MachineLimits(**settings)
+
+
+def planned(program, use_numpy=False, **kwargs):
+    return sum(MotionPlanner(limits(**kwargs), use_numpy=use_numpy).layer_durations(GCode(program)))
+
+
+def test_trapezoid():
+    # 5mm to reach 100mm/s at 1000mm/s^2, 90mm cruising and 5mm to stop
+    assert_almost_equal(1.1, planned(["G1 X100 F6000"]))
+
+
+def test_triangle():
+    # 100mm/s can't be reached in 1mm, the peak speed is sqrt(1000) mm/s
+    assert_almost_equal(2 * 1000 ** .5 / 1000, planned(["G1 X1 F6000"]))
+
+
+def test_axis_limits():
+    # Z is limited to 10mm/s
+    assert_almost_equal(1.01, planned(["G1 Z10 F6000"], max_feedrate=(1000., 1000., 10., 1000.)))
+
+
+def test_junctions():
+    straight = ["G1 X50 F6000", "G1 X100"]
+    reversal = ["G1 X50 F6000", "G1 X0"]
+    corner = ["G1 X50 F6000", "G1 X50 Y50"]
+    for settings in ({}, {'junction_deviation': 0.05}):
+        assert_almost_equal(1.1, planned(straight, **settings))
+        ok_(1.1 < planned(corner, **settings) < planned(reversal, **settings))
+    # full stop on reversal with junction deviation, a jerk worth of speed is kept with classic jerk
+    assert_almost_equal(1.2, planned(reversal, junction_deviation=0.05))
+    ok_(planned(reversal) < 1.2)
+
+
+def test_synchronizing_commands():
+    assert_almost_equal(1.2, planned(["G1 X50 F6000", "M400", "G1 X100"]))
+    assert_almost_equal(1.7, planned(["G1 X50 F6000", "G4 P500", "G1 X100"]))
+
+
+def test_limits_commands():
+    machine = MachineLimits()
+    for command in ["M201 X100 Y200 E300", "M203 Z12", "M204 P500 R600 T700", "M205 X8 E4 J0.02"]:
+        ok_(machine.update(raw_to_line(command)))
+    ok_(not machine.update(raw_to_line("M104 S200")))
+    eq_([100., 200., 100., 300.], machine.max_acceleration)
+    eq_(12., machine.max_feedrate[2])
+    eq_((500., 600., 700.), (machine.acceleration, machine.retract_acceleration, machine.travel_acceleration))
+    eq_([8., 10., 0.3, 4.], machine.max_jerk)
+    eq_(0.02, machine.junction_deviation)
+
+    # settings apply to the following moves only
+    assert_almost_equal(1.1 + 1.2, planned(["G1 X100 F6000", "M400", "M204 P500", "G1 X200 E1"]))
+
+
+def test_numpy_same_as_python():
+    if numpy is None:
+        return
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        for machine in (MachineLimits(), MachineLimits(junction_deviation=0.013)):
+            for python_duration, numpy_duration in zip(MotionPlanner(machine, use_numpy=False).layer_durations(gcode),
+                                                       MotionPlanner(machine).layer_durations(gcode)):
+                assert_almost_equal(python_duration, numpy_duration)
+
+
+
+def test_zero_jerk():
+    programs = (["G90", "M205 Z0", "G1 X10 F3000", "G1 X20 Y5", "G1 X0 Y5"],
+                ["G90", "M205 X0 Y0", "G1 X10 F3000", "G1 X0", "G1 X10 Y10"])
+    for program in programs:
+        python_duration = planned(program)
+        ok_(python_duration > 0)
+        if numpy is not None:
+            assert_almost_equal(python_duration, planned(program, use_numpy=True))
+        # durations are stored as integers
+        gcode = GCode(program)
+        eq_(int(sum(layer.duration for layer in gcode.all_layers)), gcode.plan_durations().seconds)
+
+
+def test_plan_durations():
+    gcode = open_gcode_file('cura_square.gcode')
+    duration = gcode.plan_durations()
+    eq_(duration, gcode.duration)
+    eq_(int(sum(layer.duration for layer in gcode.all_layers)), duration.seconds)
@@ -0,0 +1,75 @@
+from nose.tools import eq_, ok_
+
+from gcodeutils.filter.arc_optimizer import GCodeArcOptimizerFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, GCodeStream
+from gcodeutils.progress import Progress
+from gcodeutils.tests import raw_lines
+
+__author__ = 'olivier'
+
+
+def final_reports(reports):
+    return dict((report.stage, report) for report in reports if report.done)
+
+
+def test_gcode_stages():
+    reports = []
+    raws = raw_lines('arc_raw_1.gcode')
+    gcode = GCode(raws, progress=Progress(reports.append, every_lines=10, every_seconds=60))
+    lines = len(gcode.lines)
+    GCodeXYTranslateFilter(x=1).filter(gcode)
+    GCodeArcOptimizerFilter().filter(gcode)
+
+    eq_(['parse', 'preprocess', 'GCodeXYTranslateFilter', 'GCodeArcOptimizerFilter'],
+        [report.stage for report in reports if report.done])
+    done = final_reports(reports)
+    eq_(len(raws), done['parse'].lines)
+    eq_(sum(len(raw) for raw in raws), done['parse'].bytes)
+    eq_(lines, done['preprocess'].lines)
+    eq_(lines, done['GCodeXYTranslateFilter'].lines)
+    eq_(len(gcode.all_layers) - 1, done['preprocess'].layers)
+    eq_(len(gcode.all_layers), done['GCodeXYTranslateFilter'].layers)
+    for report in done.values():
+        eq_(0, report.eta)
+
+    # reported every 10 lines or so
+    preprocess_reports = [report for report in reports if report.stage == 'preprocess']
+    ok_(len(preprocess_reports) > 1)
+    for report in preprocess_reports[:-1]:
+        ok_(report.lines <= report.total_lines)
+        ok_(report.eta is not None)
+        ok_(not report.done)
+
+
+def test_throttled():
+    reports = []
+    GCode(raw_lines('arc_raw_1.gcode'), progress=Progress(reports.append, every_lines=10 ** 9, every_seconds=60))
+    eq_(2, len(reports))
+    ok_(all(report.done for report in reports))
+
+
+def test_stream():
+    reports = []
+    stream = GCodeStream(raw_lines('arc_raw_1.gcode'),
+                         progress=Progress(reports.append, every_lines=1, every_seconds=60))
+    layers = list(stream.layers())
+
+    eq_(len(layers) + 1, len(reports))
+    eq_(['stream'], list(final_reports(reports)))
+    eq_(list(range(1, len(layers) + 1)), [report.layers for report in reports[:-1]])
+    eq_(sum(len(layer) for layer in layers), reports[-1].lines)
+
+
+def test_time_throttled():
+    reports = []
+    progress = Progress(reports.append, every_lines=10 ** 9, every_seconds=0)
+    progress.start('sleepy', 4)
+    progress.update(1)
+    progress.update(1)
+    progress.finish()
+
+    eq_([1, 2, 2], [report.lines for report in reports])
+    eq_([False, False, True], [report.done for report in reports])
+    ok_(reports[0].eta >= 0)
+    ok_(progress.stage is None)
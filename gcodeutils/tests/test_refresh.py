@@ -0,0 +1,78 @@
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode
+from gcodeutils.mapped import MappedGCode
+from gcodeutils.tests import gcode_file_path, open_gcode_file
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'skeinforge_square.gcode',
+            'slic3r_square.gcode']
+
+
+def derived(gcode):
+    return ([(line.raw, line.current_x, line.current_y, line.current_z, line.current_e, line.extruding)
+             for line in gcode.lines],
+            [(len(layer), layer.z, layer.duration) for layer in gcode.all_layers],
+            list(gcode.layer_idxs), list(gcode.line_idxs), gcode.all_zs,
+            (gcode.xmin, gcode.xmax, gcode.ymin, gcode.ymax, gcode.zmin, gcode.zmax),
+            gcode.filament_length, gcode.duration, gcode.layers_count, gcode.est_layer_height)
+
+
+def check_refreshed(gcode):
+    """refreshed program has the same derived state as a program parsed from its lines"""
+    eq_(derived(gcode), derived(GCode([line.raw for line in gcode.lines])))
+
+
+def check_rewritten_layer(filename, layer_idx):
+    gcode = open_gcode_file(filename)
+    prefix = gcode.all_layers[:layer_idx]
+    gcode.rewrite_layer([line.raw for line in gcode.all_layers[layer_idx]] + ["G1 X5 Y5 E1", "G1 Z50"],
+                        layer_idx)
+    gcode.refresh()
+    check_refreshed(gcode)
+    # preprocessing resumed in the layer before the dirty one, layers before it are kept as is
+    ok_(all(layer is previous for layer, previous in zip(gcode.all_layers, prefix[:-1])))
+
+
+def test_rewritten_layer():
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        for layer_idx in set([1, gcode.append_layer_id // 2, gcode.append_layer_id - 1]):
+            check_rewritten_layer(filename, layer_idx)
+
+
+def test_filtered():
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        GCodeXYTranslateFilter(x=10, y=-5).filter(gcode)
+        GCodeToRelativeExtrusionFilter().filter(gcode)
+        gcode.refresh()
+        check_refreshed(gcode)
+
+
+def test_nothing_dirty():
+    gcode = open_gcode_file('cura_square.gcode')
+    layers = list(gcode.all_layers)
+    before = derived(gcode)
+    gcode.refresh()
+    eq_(derived(gcode), before)
+    ok_(all(layer is previous for layer, previous in zip(gcode.all_layers, layers[:-1])))
+
+
+def test_appended_lines_kept():
+    gcode = open_gcode_file('slic3r_square.gcode')
+    gcode.append("G1 X1 Y1 E2")
+    gcode.mark_dirty(2)
+    gcode.refresh()
+    expected = open_gcode_file('slic3r_square.gcode')
+    expected.append("G1 X1 Y1 E2")
+    eq_(derived(gcode), derived(expected))
+
+
+@raises(NotImplementedError)
+def test_mapped_refresh():
+    with MappedGCode(gcode_file_path('cura_square.gcode')) as mapped:
+        mapped.refresh()
@@ -0,0 +1,90 @@
+import random
+
+from nose.tools import eq_, ok_, raises
+
+from gcodeutils.gcoder import GCode
+from gcodeutils.spatial import LayerSpatialIndex, layer_segments, point_segment_distance, segment_in_rectangle
+from gcodeutils.tests import open_gcode_file
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'arc_ref_1.gcode', 'cura_square.gcode', 'slic3r_square.gcode']
+
+
+def brute_within(segments, x, y, distance):
+    return sorted(set(segment.line for segment in segments if point_segment_distance(x, y, segment) <= distance))
+
+
+def brute_in_rectangle(segments, xmin, ymin, xmax, ymax):
+    return sorted(set(segment.line for segment in segments if segment_in_rectangle(segment, xmin, ymin, xmax, ymax)))
+
+
+def brute_nearest(segments, x, y):
+    return min((point_segment_distance(x, y, segment), segment.line) for segment in segments)
+
+
+def check_queries(index, random_generator):
+    segments = index.segments
+    for _ in range(20):
+        x = random_generator.uniform(-30, 130)
+        y = random_generator.uniform(-30, 130)
+        distance = random_generator.uniform(0, 20)
+        eq_(index.within(x, y, distance), brute_within(segments, x, y, distance))
+        eq_(index.in_rectangle(x, y, x + distance, y + 2 * distance),
+            brute_in_rectangle(segments, x, y, x + distance, y + 2 * distance))
+        line_idx, nearest_distance = index.nearest(x, y)
+        eq_((nearest_distance, line_idx), brute_nearest(segments, x, y))
+
+
+def test_same_as_brute_force():
+    random_generator = random.Random(42)
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        for layer_idx, layer in enumerate(gcode.all_layers):
+            index = gcode.spatial_index(layer_idx, cell_size=random_generator.choice([0.5, 2, 5, 50]))
+            if len(index):
+                check_queries(index, random_generator)
+
+
+def test_synthetic_layer():
+    random_generator = random.Random(1)
+    lines = ["G21", "G90", "G1 Z0.2"]
+    lines += ["G1 X%.3f Y%.3f E%d" % (random_generator.uniform(0, 100), random_generator.uniform(0, 100), e)
+              for e in range(1, 500)]
+    gcode = GCode(lines)
+    check_queries(gcode.spatial_index(1), random_generator)
+
+
+def test_layer_start():
+    gcode = GCode(["G90", "G1 X10 Y10 Z0.2", "G1 X20 Y10 E1", "G1 Z0.4", "G1 X20 Y20 E2"])
+    eq_(len(gcode.all_layers), 4)
+    # the first move of the second layer starts where the first layer ended
+    segments = gcode.spatial_index(2).segments
+    eq_([(segment.x0, segment.y0, segment.x1, segment.y1) for segment in segments if segment.extruding],
+        [(20, 10, 20, 20)])
+    eq_(gcode.spatial_index(2).within(20, 12, 0.1), [1])
+    eq_(gcode.spatial_index(2).nearest(25, 15), (1, 5))
+    eq_(gcode.spatial_index(2).nearest(25, 15, max_distance=4), None)
+
+
+def test_arc():
+    gcode = GCode(["G90", "G1 X10 Y0 Z0.2", "G3 X-10 Y0 I-10 J0 E1"])
+    index = gcode.all_layers[1].spatial_index(start=(10, 0), cell_size=1)
+    # half circle through (0, 10), away from its chord
+    ok_(len(index) > 1)
+    eq_(index.within(0, 10, 0.1), [1])
+    eq_(index.within(0, -10, 5), [])
+    eq_(index.in_rectangle(-1, 9, 1, 11), [1])
+
+
+def test_empty_layer():
+    index = LayerSpatialIndex([])
+    eq_(len(index), 0)
+    eq_(index.within(0, 0, 10), [])
+    eq_(index.nearest(0, 0), None)
+    eq_(layer_segments([]), [])
+
+
+@raises(ValueError)
+def test_invalid_cell_size():
+    LayerSpatialIndex([], cell_size=0)
@@ -0,0 +1,137 @@
+import json
+import tempfile
+import shutil
+
+from nose.tools import eq_, ok_
+
+from gcodeutils.cache import parse_gcode
+from gcodeutils.filter.pipeline import FilterPipeline
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.gcoder import GCode, GCodeStream
+from gcodeutils.stats import Stats, run_filter, stage, tracemalloc
+from gcodeutils.tests import raw_lines
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+__author__ = 'olivier'
+
+
+def stage_names(stats):
+    return [stage_stats.name for stage_stats in stats.stages]
+
+
+def test_gcode_stages():
+    stats = Stats()
+    with stats:
+        gcode = GCode(raw_lines('arc_raw_1.gcode'), stats=stats)
+        stats.run_filter(GCodeXYTranslateFilter(x=1), gcode)
+
+    eq_(['parse', 'preprocess', 'GCodeXYTranslateFilter'], stage_names(stats))
+    for stage_stats in stats.stages:
+        eq_(1, stage_stats.calls)
+        eq_(len(gcode.lines), stage_stats.lines)
+        ok_(stage_stats.lines_per_second > 0)
+        eq_(None, stage_stats.peak_memory)
+    ok_(stats.seconds >= sum(stage_stats.seconds for stage_stats in stats.stages))
+
+
+def test_stream_stages():
+    stats = Stats()
+    stream = GCodeStream(raw_lines('arc_raw_1.gcode'), stats=stats)
+    stream.add_filter(GCodeXYTranslateFilter(x=1))
+    layers = list(stream.layers())
+
+    eq_(['preprocess', 'GCodeXYTranslateFilter'], stage_names(stats))
+    lines = sum(len(layer) for layer in layers)
+    eq_(lines, stats['preprocess'].lines)
+    eq_(lines, stats['GCodeXYTranslateFilter'].lines)
+    eq_(len(layers), stats['GCodeXYTranslateFilter'].calls)
+
+
+def test_pipeline_filter_stages():
+    stats = Stats()
+    stream = GCodeStream(raw_lines('arc_raw_1.gcode'), stats=stats)
+    stream.add_filter(FilterPipeline(GCodeXYTranslateFilter(x=1), GCodeToRelativeExtrusionFilter(), stats=stats))
+    layers = list(stream.layers())
+
+    pipeline_name = 'GCodeXYTranslateFilter+GCodeToRelativeExtrusionFilter'
+    eq_(['preprocess', pipeline_name, 'GCodeXYTranslateFilter', 'GCodeToRelativeExtrusionFilter'],
+        stage_names(stats))
+    lines = sum(len(layer) for layer in layers)
+    eq_(lines, stats['GCodeXYTranslateFilter'].lines)
+    eq_(lines, stats['GCodeToRelativeExtrusionFilter'].lines)
+    ok_(stats['GCodeXYTranslateFilter'].seconds > 0)
+    ok_(stats['GCodeToRelativeExtrusionFilter'].seconds > 0)
+
+
+def test_nested_stages():
+    stats = Stats()
+    with stats.stage('outer', 10):
+        with stats.stage('inner') as inner:
+            inner.lines += 5
+            GCode(raw_lines('arc_raw_1.gcode'))
+    with stats.stage('outer', 10):
+        pass
+
+    eq_(['outer', 'inner'], stage_names(stats))
+    eq_(2, stats['outer'].calls)
+    eq_(20, stats['outer'].lines)
+    eq_(5, stats['inner'].lines)
+    # time spent in the inner stage isn't counted in the outer one
+    ok_(stats['outer'].seconds < stats['inner'].seconds)
+    eq_(stats['outer'].seconds + stats['inner'].seconds, stats.to_dict()['seconds'])
+
+
+def test_traced_memory():
+    if tracemalloc is None:
+        return
+    stats = Stats(trace_memory=True)
+    with stats:
+        with stats.stage('outer'):
+            with stats.stage('inner'):
+                data = [str(value) for value in range(10000)]
+            del data
+    ok_(not tracemalloc.is_tracing())
+    ok_(stats['inner'].peak_memory > 0)
+    ok_(stats['outer'].peak_memory >= stats['inner'].peak_memory)
+    eq_(stats['outer'].peak_memory, stats.to_dict()['peak_memory'])
+
+
+def test_without_stats():
+    gcode = GCode(raw_lines('arc_raw_1.gcode'))
+    with stage(None, 'write', 3) as writing:
+        writing.lines += 1
+    run_filter(None, GCodeXYTranslateFilter(x=1), gcode)
+    ok_(not gcode == GCode(raw_lines('arc_raw_1.gcode')))
+
+
+def test_cache_stages():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        stats = Stats()
+        parse_gcode(raw_lines('arc_raw_1.gcode'), cache_dir, stats)
+        eq_(['cache load', 'parse', 'preprocess', 'cache store'], stage_names(stats))
+
+        stats = Stats()
+        parse_gcode(raw_lines('arc_raw_1.gcode'), cache_dir, stats)
+        eq_(['cache load'], stage_names(stats))
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_json():
+    stats = Stats()
+    with stats:
+        GCode(raw_lines('arc_raw_1.gcode'), stats=stats)
+    output = StringIO()
+    stats.write(output)
+    written = json.loads(output.getvalue())
+
+    eq_(stats.seconds, written['seconds'])
+    eq_(['parse', 'preprocess'], [stage_stats['name'] for stage_stats in written['stages']])
+    eq_(stats['parse'].lines, written['stages'][0]['lines'])
+    eq_(stats['parse'].lines_per_second, written['stages'][0]['lines_per_second'])
@@ -0,0 +1,91 @@
+from nose.tools import eq_, raises
+
+from gcodeutils.filter.relative_extrusion import GCodeToRelativeExtrusionFilter
+from gcodeutils.filter.translate import GCodeXYTranslateFilter
+from gcodeutils.tests import open_gcode_file, open_gcode_stream, written
+from gcodeutils.visit.iterator import GCodeIterator, GCodeStreamIterator
+from gcodeutils.visit.pause_at_layer import PauseAtLayer
+
+__author__ = 'olivier'
+
+
+def test_same_layers_as_gcode():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    stream = open_gcode_stream('arc_raw_1.gcode')
+
+    streamed_layers = list(stream.layers())
+
+    # the parsed gcode has an extra empty layer used to append lines
+    eq_(len(gcode.all_layers) - 1, len(streamed_layers))
+    for layer, streamed_layer in zip(gcode.all_layers, streamed_layers):
+        eq_(layer.z, streamed_layer.z)
+        eq_([line.raw for line in layer], [line.raw for line in streamed_layer])
+        eq_([line.current_e for line in layer], [line.current_e for line in streamed_layer])
+
+    eq_(gcode.all_zs, stream.all_zs)
+    eq_(gcode.filament_length, stream.filament_length)
+    eq_(gcode.duration, stream.duration)
+
+
+def test_filtered_stream():
+    gcode = open_gcode_file('simple3.gcode')
+    GCodeXYTranslateFilter(x=1, y=2).filter(gcode)
+    GCodeToRelativeExtrusionFilter().filter(gcode)
+
+    stream = open_gcode_stream('simple3.gcode')
+    stream.add_filter(GCodeXYTranslateFilter(x=1, y=2))
+    stream.add_filter(GCodeToRelativeExtrusionFilter())
+
+    eq_(written(gcode), written(stream))
+
+
+def test_pause_at_layer_stream():
+    # first printed layers of this program are not in ascending order, pause above them
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    GCodeIterator(gcode, digits_of_precision=3).accept(PauseAtLayer(pause_layer_list=[2]))
+
+    stream = open_gcode_stream('arc_raw_1.gcode')
+    GCodeStreamIterator(stream, digits_of_precision=3).accept(PauseAtLayer(pause_layer_list=[2]))
+
+    eq_(written(gcode), written(stream))
+
+
+def test_append_stream():
+    gcode = open_gcode_file('simple3.gcode')
+    gcode.append('G1 X10 E1')
+    gcode.append('M84')
+
+    stream = open_gcode_stream('simple3.gcode')
+    stream.append('G1 X10 E1')
+    # appended while streaming, by a layer processor
+    stream.add_layer_processor(lambda layer: stream.current_layer_idx == 0 and stream.append('M84'))
+
+    layers = list(stream.layers())
+    eq_(['G1 X10 E1', 'M84'], [line.raw for line in layers[-1]])
+    eq_(gcode.all_layers[-1][0].current_e, layers[-1][0].current_e)
+    eq_(gcode.filament_length, stream.filament_length)
+
+
+def test_rewrite_layer_stream():
+    gcode = open_gcode_file('simple3.gcode')
+    gcode.rewrite_layer(['M117 first layer'], 0)
+
+    stream = open_gcode_stream('simple3.gcode')
+    stream.add_layer_processor(lambda layer: stream.current_layer_idx == 0 and
+                               stream.rewrite_layer(['M117 first layer'], 0))
+
+    eq_(written(gcode), written(stream))
+
+
+@raises(ValueError)
+def test_rewrite_other_layer_stream():
+    stream = open_gcode_stream('simple3.gcode')
+    stream.add_layer_processor(lambda layer: stream.rewrite_layer(['M117 first layer'], 0))
+    list(stream.layers())
+
+
+@raises(RuntimeError)
+def test_append_consumed_stream():
+    stream = open_gcode_stream('simple3.gcode')
+    list(stream.layers())
+    stream.append('M84')
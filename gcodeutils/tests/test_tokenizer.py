@@ -0,0 +1,66 @@
+import os
+
+from nose.tools import eq_
+
+from gcodeutils.cache import parse_gcode
+from gcodeutils.gcoder import Line, split, parse_coordinates, tokenize, gcode_possible_arguments, GCode
+from gcodeutils.tests import open_gcode_file, gcode_file_path, gcode_eq
+
+__author__ = 'olivier'
+
+TRICKY_LINES = [
+    "G1 X10 Y20.5 E0.1 F1200 ; comment with X5",
+    "g1 x10 y20",
+    "G1X10Y20",
+    "N10 G1 X1 Y2*57",
+    "(full line comment)",
+    "G1 (inline comment) X3",
+    "M104 S200",
+    "T1",
+    "G92 E0",
+    "G1 X-.5 Y+3. Z0.2",
+    "G4 P500",
+    "M117 Hello",
+    ";LAYER:1",
+    "G2 X10 Y10 I5 J0 E1",
+    "G1 X1e3 Y2",
+    "G1 X1E3 Y2",
+    "G1 S1e3 X1",
+    "G1 Xinf Ynan",
+    "G1 X1_000",
+    "G28 X Y",
+]
+
+
+def parsed_attributes(line):
+    return [line.command, line.is_move] + [getattr(line, bit) for bit in gcode_possible_arguments]
+
+
+def legacy_parse(raw):
+    line = Line(raw)
+    parse_coordinates(line, split(line))
+    return line
+
+
+def tokenized(raw, imperial=False):
+    line = Line(raw)
+    tokenize(line, imperial)
+    return line
+
+
+def test_tricky_lines():
+    for raw in TRICKY_LINES:
+        eq_(parsed_attributes(legacy_parse(raw)), parsed_attributes(tokenized(raw)), raw)
+
+
+def test_fixtures_parse_identically():
+    for filename in sorted(os.listdir(os.path.dirname(gcode_file_path('')))):
+        if filename.endswith('.gcode'):
+            with open(gcode_file_path(filename)) as gcode_file:
+                gcode = GCode(gcode_file.readlines(), tokenizer=tokenize)
+            gcode_eq(open_gcode_file(filename), gcode)
+            eq_(open_gcode_file(filename).duration, gcode.duration)
+
+
+def test_cli_parsing_tokenizes():
+    eq_(tokenize, parse_gcode(["G1 X1 Y2"]).tokenizer)
@@ -0,0 +1,65 @@
+import io
+import os
+import tempfile
+
+from nose.tools import eq_
+
+from gcodeutils.tests import open_gcode_file
+from gcodeutils.writer import GCodeWriter
+
+__author__ = 'olivier'
+
+FIXTURES = ['arc_raw_1.gcode', 'cura_square.gcode', 'simple3.gcode', 'empty_for_good.gcode']
+
+
+def printed(gcode):
+    output = io.StringIO()
+    for line in gcode:
+        output.write(u"%s\n" % line.raw)
+    return output.getvalue()
+
+
+def test_write_same_as_print():
+    for filename in FIXTURES:
+        gcode = open_gcode_file(filename)
+        output = io.StringIO()
+        gcode.write(output)
+        eq_(printed(gcode), output.getvalue())
+
+
+def test_small_buffer():
+    gcode = open_gcode_file('cura_square.gcode')
+    output = io.StringIO()
+    with GCodeWriter(output, buffer_size=16) as writer:
+        for layer in gcode.all_layers:
+            writer.write_layer(layer)
+            # every layer bigger than the buffer is written right away
+            if sum(len(line.raw) + 1 for line in layer) >= 16:
+                eq_(writer.chunks, [])
+    eq_(printed(gcode), output.getvalue())
+
+
+def test_nothing_written_until_flush():
+    output = io.StringIO()
+    writer = GCodeWriter(output)
+    writer.write_line(u"G28")
+    writer.write_lines([])
+    eq_(output.getvalue(), u"")
+    writer.flush()
+    eq_(output.getvalue(), u"G28\n")
+
+
+def test_writev():
+    gcode = open_gcode_file('arc_raw_1.gcode')
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        with io.open(path, 'w') as output_file:
+            output_file.write(u"; header\n")
+            with GCodeWriter(output_file, buffer_size=64, use_writev=True) as writer:
+                for layer in gcode.all_layers:
+                    writer.write_layer(layer)
+        with io.open(path) as output_file:
+            eq_(u"; header\n" + printed(gcode), output_file.read())
+    finally:
+        os.remove(path)
@@ -3,6 +3,7 @@
 """An iterator for GCoder objects that accepts a GCodeVisitor
 """
 
+import bisect
 import logging
 
 __author__ = "wireddown"
@@ -46,8 +47,7 @@ class GCodeIterator(object):
         parsed_layer_number = 0
         parsed_line_number = 0
 
-        for parsed_layer in self.__gcode.all_layers:
-            layer_index = self.__gcode.all_layers.index(parsed_layer)
+        for layer_index, parsed_layer in enumerate(self.__gcode.all_layers):
             try:
                 layer_z = round(parsed_layer.z, self.__digits_of_precision)
                 layer_number = self.__all_zs.index(layer_z)
@@ -84,3 +84,66 @@ class GCodeIterator(object):
 
             parsed_layer_number += 1
             self.__logger.debug("  finished layer")
+
+
+class GCodeStreamIterator(object):
+    """This class visits the layers of a GCodeStream while the stream is consumed
+
+    Since a stream can only be walked once, accepted visitors are not called
+    right away but as each layer is read (for instance by GCodeStream.write).
+    Printed layers are numbered in the order their altitude is first met, which
+    matches GCodeIterator for programs printed bottom up.
+    """
+
+    def __init__(self, gcode, digits_of_precision=2):
+        self.__gcode = gcode
+        self.__digits_of_precision = digits_of_precision
+        self.__logger = logging.getLogger(LOGGER_NAME)
+        self.__visitors = []
+        self.__printed_zs = []
+        self.__parsed_layer_number = 0
+        self.__parsed_line_number = 0
+        gcode.add_layer_processor(self.__visit_layer, type(self).__name__)
+
+    def accept(self, visitor):
+        """Register a visitor, called for each layer and each line as the stream is read
+        """
+        self.__visitors.append(visitor)
+
+    def __visit_layer(self, parsed_layer):
+        layer_index = self.__gcode.current_layer_idx
+        is_printed = parsed_layer.z is not None and any(line.extruding for line in parsed_layer)
+        if is_printed:
+            layer_z = round(parsed_layer.z, self.__digits_of_precision)
+            layer_number = bisect.bisect_left(self.__printed_zs, layer_z)
+            if layer_number == len(self.__printed_zs) or self.__printed_zs[layer_number] != layer_z:
+                self.__printed_zs.insert(layer_number, layer_z)
+        else:
+            layer_number = self.__parsed_layer_number
+
+        layer_kind = PRINTED_LAYER_KIND if is_printed else PARSED_LAYER_KIND
+        self.__logger.debug(
+            "  visiting %-7s layer %+4s...", layer_kind, layer_number
+        )
+        info = GCodeIteratorInformation(
+            self.__gcode, layer_number, layer_index, self.__parsed_line_number, is_printed
+        )
+        for visitor in self.__visitors:
+            visitor.will_visit_layer(parsed_layer, info)
+
+        for line in parsed_layer:
+            info = GCodeIteratorInformation(
+                self.__gcode, layer_number, layer_index, self.__parsed_line_number, is_printed
+            )
+            for visitor in self.__visitors:
+                visitor.visit_line(line, info)
+            self.__parsed_line_number += 1
+
+        # "-1" because we haven't advanced to the next line /just/ yet
+        info = GCodeIteratorInformation(
+            self.__gcode, layer_number, layer_index, self.__parsed_line_number - 1, is_printed
+        )
+        for visitor in self.__visitors:
+            visitor.did_visit_layer(parsed_layer, info)
+
+        self.__parsed_layer_number += 1
@@ -0,0 +1,99 @@
+"""Buffered writer of GCode programs
+
+Raw lines are joined into large chunks before being written, instead of being printed one by one, which
+per call overhead dominates when writing millions of lines. Optionally, chunks are handed to os.writev in
+batches, without being joined together.
+"""
+
+import os
+import sys
+from itertools import islice
+
+__author__ = 'olivier'
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# maximum number of chunks given to a single os.writev call
+WRITEV_BATCH = 64
+
+# lines taken at once out of the iterables given to write_iter
+ITER_BATCH = 1024
+
+
+class GCodeWriter(object):
+    """write raw GCode lines to a file like object, by chunks of about buffer_size characters.
+
+    With use_writev, chunks are encoded and written with os.writev straight to the file descriptor of
+    output_file (when it has one, on platforms providing os.writev), bypassing its buffering and newline
+    translation. Pending lines are written by flush, or when leaving the writer used as a context manager."""
+
+    def __init__(self, output_file=sys.stdout, buffer_size=DEFAULT_BUFFER_SIZE, use_writev=False):
+        self.output_file = output_file
+        self.buffer_size = buffer_size
+        self.use_writev = use_writev and hasattr(os, 'writev') and self._has_fileno(output_file)
+        self.encoding = getattr(output_file, 'encoding', None) or 'utf-8'
+        self.chunks = []
+        self.size = 0
+
+    @staticmethod
+    def _has_fileno(output_file):
+        try:
+            output_file.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+        return True
+
+    def write_lines(self, raws):
+        """write a list of raw lines, without their newline"""
+        if not raws:
+            return
+        chunk = '\n'.join(raws) + '\n'
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def write_line(self, raw):
+        self.write_lines([raw])
+
+    def write_iter(self, lines):
+        """write the lines of an iterable, as they come (eg generated by GCodeFilter.iter_filter)"""
+        lines = iter(lines)
+        while True:
+            raws = [line.raw for line in islice(lines, ITER_BATCH)]
+            if not raws:
+                break
+            self.write_lines(raws)
+
+    def write_layer(self, layer):
+        """write the lines of a layer"""
+        self.write_lines([line.raw for line in layer])
+
+    def flush(self):
+        if not self.chunks:
+            return
+        chunks, self.chunks, self.size = self.chunks, [], 0
+        if self.use_writev:
+            self._writev([chunk.encode(self.encoding) for chunk in chunks])
+        else:
+            self.output_file.write(''.join(chunks))
+
+    def _writev(self, buffers):
+        # whatever output_file buffered so far goes first
+        self.output_file.flush()
+        fd = self.output_file.fileno()
+        start = 0
+        while start < len(buffers):
+            written = os.writev(fd, buffers[start:start + WRITEV_BATCH])
+            # skip what has been written, os.writev may write less than requested
+            while start < len(buffers) and written >= len(buffers[start]):
+                written -= len(buffers[start])
+                start += 1
+            if written:
+                buffers[start] = buffers[start][written:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()